@@ -0,0 +1,127 @@
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.headless import use_headless_gl
+use_headless_gl()
+
+import pyglet
+import numpy as np
+
+from fractions import Fraction
+
+from game.batch_renderer import create_headless_context
+from game.shader import create_sierpinsky_carpet_shader, set_carpet_uniforms, get_workgroup_count, measure_dispatch_time
+from game.shader_cache import get_compute_program
+from game.cpu_engine import get_carpet_view, render_sierpinsky_carpet
+
+# The kernel this one replaced: u_depth iterations whatever the zoom, an integer zoom around the last click and ivec2 coordinates.
+legacy_source = """#version 430 core
+uniform int u_depth;
+uniform int u_zoom;
+uniform vec2 u_center;
+layout (local_size_x = {local_size_x}, local_size_y = {local_size_y}, local_size_z = 1) in;
+layout(location = 0, rgba32f) uniform image2D img_output;
+void main() {{
+    if (any(greaterThanEqual(ivec2(gl_GlobalInvocationID.xy), imageSize(img_output)))) {{
+        return;
+    }}
+
+    vec2 centered = vec2(gl_GlobalInvocationID.xy) - u_center;
+    vec2 zoomed = centered / u_zoom;
+    vec2 final_coord = zoomed + u_center;
+    ivec2 coord = ivec2(final_coord);
+    bool isHole = false;
+    for (int i = 0; i < u_depth; ++i) {{
+        if (coord.x % 3 == 1 && coord.y % 3 == 1) {{
+            isHole = true;
+            break;
+        }}
+        coord /= 3;
+    }}
+    vec4 color = isHole ? vec4(0, 0, 0, 1) : vec4(1, 1, 1, 1);
+    imageStore(img_output, ivec2(gl_GlobalInvocationID.xy), color);
+}}
+"""
+
+def read_image(image):
+    value = np.empty((image.height, image.width, 4), dtype=np.float32)
+    pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, image.id)
+    pyglet.gl.glGetTexImage(pyglet.gl.GL_TEXTURE_2D, 0, pyglet.gl.GL_RGBA, pyglet.gl.GL_FLOAT, value.ctypes.data)
+    return value
+
+def time_legacy(width, height, zoom, center, depth, workgroup_size, repeats):
+    shader_program = get_compute_program(legacy_source, {"local_size_x": workgroup_size[0], "local_size_y": workgroup_size[1]})
+    image = pyglet.image.Texture.create(width, height, internalformat=pyglet.gl.GL_RGBA32F)
+    image.bind_image_texture(unit=shader_program['img_output'])
+
+    with shader_program:
+        shader_program['u_depth'] = depth
+        shader_program['u_zoom'] = zoom
+        shader_program['u_center'] = center
+
+    dispatch_time = measure_dispatch_time(shader_program, get_workgroup_count(width, height, workgroup_size), repeats)
+    return dispatch_time, read_image(image)
+
+def time_kernel(width, height, carpet_view, precision, workgroup_size, repeats):
+    shader_program, image = create_sierpinsky_carpet_shader(width, height, precision, workgroup_size)
+    set_carpet_uniforms(shader_program, carpet_view)
+
+    dispatch_time = measure_dispatch_time(shader_program, get_workgroup_count(width, height, workgroup_size), repeats)
+    return dispatch_time, read_image(image)
+
+def time_numpy(width, height, carpet_view, precision, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = render_sierpinsky_carpet(width, height, carpet_view, precision)
+        times.append(time.perf_counter() - start)
+    return min(times), value
+
+def run(arguments):
+    window = create_headless_context()
+    width, height = arguments.resolution
+    center = (width // 2, height // 2)
+
+    print(f"{'zoom':>10} {'depth':>6} {'levels':>6} {'legacy':>10} {'kernel':>10} {'numpy':>10} {'legacy diff':>12} {'numpy diff':>11}")
+    for zoom_exponent in arguments.zoom_exponents:
+        for depth in arguments.depths:
+            zoom = Fraction(arguments.zoom_increase) ** zoom_exponent
+            # zooming around the center of the image, the view the legacy kernel renders for an integer zoom at that click
+            scale = 1 / zoom
+            origin = tuple(Fraction(position) * (1 - scale) for position in center)
+            carpet_view = get_carpet_view(origin, scale, width, height, depth)
+
+            kernel_time, kernel_image = time_kernel(width, height, carpet_view, arguments.precision, arguments.workgroup_size, arguments.repeats)
+            numpy_time, numpy_image = time_numpy(width, height, carpet_view, arguments.precision, arguments.numpy_repeats)
+            numpy_difference = np.mean(np.any(kernel_image != numpy_image, axis=2))
+
+            # the legacy kernel only takes integer zooms that fit its coordinates
+            legacy_time, legacy_difference = None, None
+            if zoom.denominator == 1 and zoom <= 2 ** 31:
+                legacy_time, legacy_image = time_legacy(width, height, int(zoom), center, depth, arguments.workgroup_size, arguments.repeats)
+                legacy_difference = np.mean(np.any(kernel_image != legacy_image, axis=2))
+
+            levels = max(carpet_view["digits"] - carpet_view["skip"], 0)
+            legacy_text = f"{legacy_time * 1000:>8.3f}ms" if legacy_time is not None else f"{'-':>10}"
+            legacy_difference_text = f"{legacy_difference:>12.4%}" if legacy_difference is not None else f"{'-':>12}"
+            print(f"{arguments.zoom_increase}^{zoom_exponent:<{8 - len(str(arguments.zoom_increase))}} {depth:>6} {levels:>6} {legacy_text} {kernel_time * 1000:>8.3f}ms {numpy_time * 1000:>8.3f}ms {legacy_difference_text} {numpy_difference:>11.4%}")
+
+    window.close()
+
+def parse_resolution(resolution):
+    return tuple(map(int, resolution.split("x")))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the Sierpinsky carpet kernel against the kernel it replaced and the NumPy renderer, and report the fraction of pixels they disagree on.")
+    parser.add_argument("--resolution", type=parse_resolution, default=(1920, 1080))
+    parser.add_argument("--zoom-increase", type=int, default=3)
+    parser.add_argument("--zoom-exponents", type=int, nargs="+", default=[-2, 0, 1, 5, 15, 100, 2000])
+    parser.add_argument("--depths", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--precision", choices=["single", "double"], default="single")
+    parser.add_argument("--workgroup-size", type=parse_resolution, default=(8, 8))
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--numpy-repeats", type=int, default=3)
+    arguments = parser.parse_args()
+
+    run(arguments)
@@ -0,0 +1,209 @@
+import os, sys, json, time, argparse, platform, itertools, statistics, subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.headless import use_headless_gl
+use_headless_gl()
+
+from mpmath import mp
+mp.dps = 1000
+
+import pyglet
+import numpy as np
+
+from game.batch_renderer import BatchRenderer, create_job, get_viewport
+from game.shader import create_iter_calc_shader, float_float_powers
+from game.profiler import TimerQuery, supports_timer_queries
+from game.shader_cache import program_cache, get_driver_id
+from game.preturbation import supports_preturbation
+
+# Fixed views per fractal: the initial view, a window full of boundary detail (slow, divergent neighbours), one mostly inside the set
+# (every pixel runs to max_iter) and a perturbation deep zoom. Changing a view invalidates every result recorded with it.
+seahorse_valley = ["-0.743643887037158704752191506114774", "0.131825904205311970493132056385139"]
+
+catalog = {
+    "mandelbrot": {"boundary": {"center": seahorse_valley, "span": "0.01"}, "in_set": {"center": ["-0.225", "-0.475"], "span": "0.25"}, "deep": {"center": seahorse_valley, "span": "1e-13"}},
+    "mandelbar": {"boundary": {"center": ["-0.975", "-0.175"], "span": "0.25"}, "in_set": {"center": ["0.075", "-0.125"], "span": "0.25"}, "deep": {"center": ["-0.975", "-0.175"], "span": "1e-12"}},
+    "julia": {"boundary": {"center": ["1.1", "-0.45"], "span": "0.33"}, "in_set": {"center": ["0.4333", "-0.05"], "span": "0.33"}, "deep": {"center": ["1.1", "-0.45"], "span": "1e-12"}},
+    "burning_ship": {"boundary": {"center": ["-0.3375", "-1.0625"], "span": "0.29"}, "in_set": {"center": ["0.3042", "-0.9125"], "span": "0.29"}, "deep": {"center": ["-0.3375", "-1.0625"], "span": "1e-12"}},
+    "buffalo_fractal": {"boundary": {"center": ["-0.9792", "-1.6625"], "span": "0.29"}, "in_set": {"center": ["-0.9208", "-1.2125"], "span": "0.29"}, "deep": {"center": ["-0.9792", "-1.6625"], "span": "1e-12"}},
+    "phoenix_fractal": {"boundary": {"center": ["0.625", "-0.025"], "span": "0.25"}, "in_set": {"center": ["-1.075", "-0.275"], "span": "0.25"}},
+    "lambda_fractal": {"boundary": {"center": ["-0.575", "0.725"], "span": "0.25"}, "in_set": {"center": ["0.475", "-0.875"], "span": "0.25"}},
+    "newton_fractal": {"boundary": {"center": ["-0.3", "-0.15"], "span": "0.33"}}
+}
+
+# the fractals with an N setting
+multi_n_fractals = ["mandelbrot", "mandelbar", "julia", "buffalo_fractal"]
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_views(fractal):
+    yield "shallow", {}
+
+    for name, view in catalog[fractal].items():
+        if name == "deep" and not supports_preturbation(fractal, 2):
+            continue
+
+        yield name, {**view, "preturbation": name == "deep"}
+
+def time_gpu(renderer, job, repeats, use_timer_queries):
+    # compile: a cleared program cache and no binary cache, so this is the driver compiling and linking the source
+    program_cache.clear()
+    start = time.perf_counter()
+    shader_program, iteration_buffers = create_iter_calc_shader(job["fractal"], job["width"], job["height"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"], job["preturbation"], renderer.workgroup_size, "gpu", periodicity_check=job["periodicity_check"])
+    pyglet.gl.glFinish()
+    compile_time = time.perf_counter() - start
+
+    real_min, real_max, imag_min, imag_max = get_viewport(job)
+    start = time.perf_counter()
+    preturbation_buffers = renderer.set_uniforms(shader_program, job, real_min, real_max, imag_min, imag_max)
+    setup_time = time.perf_counter() - start
+
+    # some drivers only finish compiling on first use, so the first dispatch is reported on its own
+    start = time.perf_counter()
+    renderer.dispatch(shader_program, job)
+    pyglet.gl.glFinish()
+    first_dispatch_time = time.perf_counter() - start
+
+    dispatch_times, wall_times = [], []
+    for _ in range(repeats):
+        timer_query = TimerQuery() if use_timer_queries else None
+        start = time.perf_counter()
+
+        if timer_query:
+            with timer_query:
+                renderer.dispatch(shader_program, job)
+        else:
+            renderer.dispatch(shader_program, job)
+
+        pyglet.gl.glFinish()
+        wall_times.append(time.perf_counter() - start)
+
+        if timer_query:
+            dispatch_times.append(timer_query.result())
+            timer_query.delete()
+        else:
+            dispatch_times.append(wall_times[-1])
+
+    start = time.perf_counter()
+    iters = iteration_buffers.read_iters()
+    readback_time = time.perf_counter() - start
+
+    del preturbation_buffers
+    shader_program.delete()
+    return compile_time, setup_time, first_dispatch_time, dispatch_times, wall_times, readback_time, iters
+
+def time_cpu(renderer, job, repeats):
+    # the NumPy engine compiles nothing and renders straight into host memory, only the render (with the reference orbit of deep views) is timed
+    dispatch_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        iters = renderer.render_cpu(job, *get_viewport(job))
+        dispatch_times.append(time.perf_counter() - start)
+
+    return 0.0, 0.0, dispatch_times[0], dispatch_times, dispatch_times, 0.0, iters
+
+def run(arguments):
+    renderers = {backend: BatchRenderer(backend, (8, 8), arguments.cpu_workers, False, 0) for backend in arguments.backends}
+    if "gpu" in renderers and renderers["gpu"].backend != "gpu":
+        sys.exit("No OpenGL 4.3 context for the gpu backend.")
+
+    driver = get_driver_id() if "gpu" in renderers else None
+
+    # software rasterizers run compute dispatches on the CPU, their GPU timestamps do not cover that work
+    software_renderer = driver and any(name in driver.lower() for name in ("llvmpipe", "softpipe", "swiftshader"))
+    use_timer_queries = "gpu" in renderers and supports_timer_queries() and not software_renderer and not arguments.no_timer_queries
+
+    results = []
+    for fractal in arguments.fractals:
+        for view_name, view in get_views(fractal):
+            for width, height in arguments.resolutions:
+                for max_iter in arguments.max_iters:
+                    for multi_n, precision, periodicity_check, (backend, renderer) in itertools.product(arguments.multi_ns, arguments.precisions, arguments.periodicity_checks, renderers.items()):
+                        if multi_n != 2 and not view_name == "shallow":
+                            continue # the catalog views are picked for n = 2, other powers only get their initial view
+                        if multi_n != 2 and fractal not in multi_n_fractals:
+                            continue
+
+                        job = create_job(0, {"fractal": fractal, "width": width, "height": height, "max_iter": max_iter, "multi_n": multi_n, "precision": precision, "periodicity_check": {"auto": None, "on": True, "off": False}[periodicity_check], "output": "", **view})
+                        if job["precision"] != precision or (precision == "float-float" and fractal not in float_float_powers):
+                            continue # the fractal has no shader for this precision, the single or double precision result is already there
+
+                        if backend == "gpu":
+                            compile_time, setup_time, first_dispatch_time, dispatch_times, wall_times, readback_time, iters = time_gpu(renderer, job, arguments.repeats, use_timer_queries)
+                        else:
+                            compile_time, setup_time, first_dispatch_time, dispatch_times, wall_times, readback_time, iters = time_cpu(renderer, job, arguments.repeats)
+
+                        result = {
+                            "fractal": fractal, "view": view_name, "width": width, "height": height, "max_iter": max_iter, "multi_n": multi_n, "precision": job["precision"], "periodicity_check": job["periodicity_check"], "backend": backend,
+                            "compile_s": compile_time, "setup_s": setup_time, "first_dispatch_s": first_dispatch_time,
+                            "dispatch_s": statistics.median(dispatch_times), "dispatch_min_s": min(dispatch_times), "dispatch_wall_s": statistics.median(wall_times),
+                            "readback_s": readback_time,
+                            "dispatch_timer": "gl_timer_query" if backend == "gpu" and use_timer_queries else "cpu_clock",
+                            "mean_iterations": float(np.mean(iters)),
+                            "samples_per_second": width * height / statistics.median(dispatch_times)
+                        }
+                        results.append(result)
+
+                        print(f"{fractal:>16} {view_name:>8} {width:>5}x{height:<5} {max_iter:>6} {multi_n:>2} {job['precision']:>11} {'on' if job['periodicity_check'] else 'off':>3} {backend:>4}  compile {compile_time * 1000:8.2f}ms  dispatch {result['dispatch_s'] * 1000:9.3f}ms  readback {readback_time * 1000:7.2f}ms  {result['samples_per_second'] / 1e6:8.2f} MS/s")
+
+    for renderer in renderers.values():
+        renderer.close()
+
+    return results, driver
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r") as file:
+        baseline = json.load(file)
+
+    # results from before the periodicity check existed count as the unchecked kernel, the ones from before multi_n as n = 2
+    key_names = ("fractal", "view", "width", "height", "max_iter", "multi_n", "precision", "periodicity_check", "backend")
+    missing = {"multi_n": 2}
+    baseline_results = {tuple(result.get(name, missing.get(name, False)) for name in key_names): result for result in baseline["results"]}
+
+    print(f"\nAgainst {baseline_path} ({baseline['meta'].get('commit')}), dispatch time ratio, below 1 is faster:")
+    for result in results:
+        previous = baseline_results.get(tuple(result[name] for name in key_names))
+        if previous:
+            print(f"{result['fractal']:>16} {result['view']:>8} {result['width']:>5}x{result['height']:<5} {result['max_iter']:>6} {result['multi_n']:>2} {result['precision']:>11} {'on' if result['periodicity_check'] else 'off':>3} {result['backend']:>4}  {result['dispatch_s'] / previous['dispatch_s']:6.3f}x")
+
+def parse_resolution(resolution):
+    return tuple(map(int, resolution.split("x")))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time compile, dispatch and readback of the fractal kernels over a fixed catalog of views.")
+    parser.add_argument("--fractals", nargs="+", choices=list(catalog), default=list(catalog))
+    parser.add_argument("--resolutions", type=parse_resolution, nargs="+", default=[(640, 360), (1920, 1080)])
+    parser.add_argument("--max-iters", type=int, nargs="+", default=[256, 2048])
+    parser.add_argument("--multi-ns", type=int, nargs="+", default=[2], help="Powers N to render the fractals with an N setting with, the others always render with 2")
+    parser.add_argument("--precisions", nargs="+", choices=["single", "double", "float-float"], default=["single", "double", "float-float"])
+    parser.add_argument("--periodicity-checks", nargs="+", choices=["auto", "on", "off"], default=["auto"], help="Periodicity check setting to render with, auto is the fractal's default, on off shows what it costs or saves per view")
+    parser.add_argument("--backends", nargs="+", choices=["gpu", "cpu"], default=["gpu"])
+    parser.add_argument("--cpu-workers", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-timer-queries", action="store_true", help="Time dispatches with glFinish and the CPU clock even if GL timer queries exist")
+    parser.add_argument("--output", default="kernel_benchmark.json")
+    parser.add_argument("--compare", help="Earlier output of this benchmark to compare the dispatch times against")
+    arguments = parser.parse_args()
+
+    results, driver = run(arguments)
+
+    meta = {
+        "commit": get_git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "driver": driver,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "repeats": arguments.repeats
+    }
+
+    with open(arguments.output, "w") as file:
+        json.dump({"meta": meta, "results": results}, file, indent=1)
+
+    if arguments.compare:
+        compare(results, arguments.compare)
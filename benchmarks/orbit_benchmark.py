@@ -0,0 +1,66 @@
+import os, sys, time, argparse, array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mpmath import mp, mpc, mpf
+from game.preturbation import calculate_orbit, get_orbit_precision, big_int
+
+# Reference point on the boundary of the Mandelbrot set, its orbit stays bounded for a long time at every zoom depth.
+center = mpc(mpf("-0.743643887037158704752191506114774"), mpf("0.131825904205311970493132056385139"))
+
+def mpmath_orbit(c, max_iterations, multi_n=2, escape_radius=2):
+    # The orbit loop this engine replaced: one mpc per step, polar form for multi-n, element-wise copy into an array.
+    z = mpc(0, 0)
+    orbit = [z]
+
+    for _ in range(max_iterations):
+        if multi_n == 2:
+            z = z * z + c
+        else:
+            r = abs(z)
+            theta = mp.atan2(z.imag, z.real)
+            r_n = r ** multi_n
+            z = mpc(r_n * mp.cos(multi_n * theta), r_n * mp.sin(multi_n * theta)) + c
+
+        orbit.append(z)
+        if abs(z) > escape_radius:
+            break
+
+    orbit_array = array.array("f")
+    for z in orbit:
+        orbit_array.append(float(z.real))
+        orbit_array.append(float(z.imag))
+
+    return orbit_array
+
+def run(iterations, spans, multi_ns):
+    print(f"integer backend: {big_int.__module__}.{big_int.__name__}")
+    print(f"{'span':>8} {'n':>2} {'bits':>5} {'mpmath':>10} {'fixed point':>12} {'speedup':>8} {'max difference':>15}")
+
+    for span in spans:
+        for multi_n in multi_ns:
+            precision = get_orbit_precision(span)
+
+            start = time.perf_counter()
+            with mp.workprec(precision):
+                baseline = mpmath_orbit(center, iterations, multi_n)
+            baseline_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            orbit = calculate_orbit("mandelbrot", center, iterations, multi_n, span=span)
+            orbit_time = time.perf_counter() - start
+
+            # the baseline only kept float32, compare the first iterations where both are still well inside the escape radius
+            length = min(len(orbit), len(baseline) // 2, 1000)
+            difference = max((abs(orbit[i] - complex(baseline[2 * i], baseline[2 * i + 1])) for i in range(length)), default=0)
+
+            print(f"{span:>8.0e} {multi_n:>2} {precision:>5} {baseline_time:>9.3f}s {orbit_time:>11.3f}s {baseline_time / orbit_time:>7.1f}x {difference:>15.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the fixed point reference orbit engine against plain mpmath.")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--spans", type=float, nargs="+", default=[1e-10, 1e-50, 1e-200])
+    parser.add_argument("--multi-n", type=int, nargs="+", default=[2, 3])
+    args = parser.parse_args()
+
+    run(args.iterations, args.spans, args.multi_n)
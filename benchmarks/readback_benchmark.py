@@ -0,0 +1,92 @@
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.headless import use_headless_gl
+use_headless_gl()
+
+import pyglet
+import numpy as np
+
+from game.batch_renderer import BatchRenderer, create_job, get_viewport, to_rgb
+from game.readback import AsyncReadback, supports_persistent_mapping
+from game.shader import create_palette_texture
+
+# Ways to get a rendered frame into memory as 8 bit colors: the RGBA32F glGetTexImage of a color image, the iteration buffer read
+# back and colored with NumPy, the export kernel read back synchronously, and AsyncReadback overlapping the copies with rendering.
+
+def time_frames(frame_count, render, read):
+    # seconds per frame, and the seconds per frame spent waiting for pixels
+    wait_time = 0
+    start = time.perf_counter()
+    for index in range(frame_count):
+        render()
+        read_start = time.perf_counter()
+        read(index)
+        wait_time += time.perf_counter() - read_start
+    pyglet.gl.glFinish()
+    return (time.perf_counter() - start) / frame_count, wait_time / frame_count
+
+def run(arguments):
+    renderer = BatchRenderer("gpu", binary_cache=False)
+    width, height = arguments.resolution
+    job = create_job(0, {"fractal": arguments.fractal, "width": width, "height": height, "max_iter": arguments.max_iter, "output": "benchmark.png"})
+    palette_texture = create_palette_texture(job["palette"])
+
+    viewport = get_viewport(job)
+    iteration_buffers = renderer.dispatch_gpu(job, *viewport)
+    render = lambda: renderer.dispatch_gpu(job, *viewport)
+
+    color_image = pyglet.image.Texture.create(width, height, internalformat=pyglet.gl.GL_RGBA32F)
+    float_pixels = np.empty((height, width, 4), dtype=np.float32)
+
+    def read_float(index):
+        pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, color_image.id)
+        pyglet.gl.glGetTexImage(pyglet.gl.GL_TEXTURE_2D, 0, pyglet.gl.GL_RGBA, pyglet.gl.GL_FLOAT, float_pixels.ctypes.data)
+        np.rint(float_pixels[..., :3] * 255).astype(np.uint8)
+
+    def read_iters(index):
+        to_rgb(job, iteration_buffers.read_iters())
+
+    sync_readback = AsyncReadback(width, height, buffer_count=1)
+    def read_sync(index):
+        sync_readback.submit(index, iteration_buffers.images[0], palette_texture, job["fractal"], job["max_iter"])
+        sync_readback.collect(wait=True)
+
+    async_readback = AsyncReadback(width, height, buffer_count=arguments.buffers)
+    def read_async(index):
+        async_readback.submit(index, iteration_buffers.images[0], palette_texture, job["fractal"], job["max_iter"])
+        async_readback.collect()
+
+    # the export kernel and the NumPy colors have to agree before their timings mean anything
+    sync_readback.submit(0, iteration_buffers.images[0], palette_texture, job["fractal"], job["max_iter"])
+    exported = sync_readback.collect(wait=True)[0][1]
+    difference = np.abs(exported.astype(int) - to_rgb(job, iteration_buffers.read_iters()))
+    print(f"{width}x{height} {arguments.fractal}, persistent mapping: {supports_persistent_mapping()}, export differs from the NumPy colors on {np.mean(difference.max(axis=2) > 0):.4%} of the pixels by at most {difference.max()}")
+
+    render_time, _ = time_frames(arguments.frames, render, lambda index: None)
+    print(f"{'method':>22} {'bytes/frame':>12} {'ms/frame':>9} {'waiting':>9}")
+    print(f"{'render only':>22} {0:>12} {render_time * 1000:>9.2f} {0:>9.2f}")
+
+    for name, read, size in [("RGBA32F glGetTexImage", read_float, width * height * 16), ("iterations + NumPy", read_iters, width * height * 4), ("export, synchronous", read_sync, width * height * 4), (f"export, {arguments.buffers} buffers", read_async, width * height * 4)]:
+        frame_time, wait_time = time_frames(arguments.frames, render, read)
+        print(f"{name:>22} {size:>12} {frame_time * 1000:>9.2f} {wait_time * 1000:>9.2f}")
+
+    async_readback.collect(wait=True)
+    sync_readback.delete()
+    async_readback.delete()
+    renderer.close()
+
+def parse_resolution(resolution):
+    return tuple(map(int, resolution.split("x")))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time getting rendered frames back from the GPU as 8 bit colors, with and without the asynchronous pixel buffer readback.")
+    parser.add_argument("--resolution", type=parse_resolution, default=(3840, 2160))
+    parser.add_argument("--fractal", default="mandelbrot")
+    parser.add_argument("--max-iter", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--buffers", type=int, default=2)
+    arguments = parser.parse_args()
+
+    run(arguments)
@@ -0,0 +1,81 @@
+import time
+import numpy as np
+
+from game.cpu_engine import get_counts, color_iters
+from utils.constants import antialiasing_max_samples, antialiasing_budget, antialiasing_threshold
+
+# Adaptive antialiasing: the window's MSAA never touches the compute shader output, and supersampling every pixel multiplies the cost.
+# Only the pixels on an edge get extra samples at jittered positions inside them, their color is the average of the samples' colors.
+
+def get_jitter(samples, seed=0):
+    # Stratified: one random offset in each cell of a grid over the pixel, the same pattern for every pixel and frame so nothing flickers.
+    # Offsets are in pixels relative to the pixel's own sample, which sits in the middle of its footprint.
+    if not 0 < samples <= antialiasing_max_samples:
+        raise ValueError(f"Antialiasing takes 1 to {antialiasing_max_samples} samples per pixel, not {samples}")
+
+    random = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(samples)))
+    cells = random.permutation(side * side)[:samples]
+    jitter = np.stack([cells % side, cells // side], axis=1) + random.random((samples, 2))
+    return (jitter / side - 0.5).astype(np.float32)
+
+def get_contrast(fractal_type, iters, max_iter):
+    # Largest iteration difference to one of the four neighbours relative to max_iter. Newton roots are labels, any change is an edge.
+    counts = get_counts(iters).astype(np.float32)
+    contrast = np.zeros(counts.shape, dtype=np.float32)
+
+    for axis in (0, 1):
+        difference = np.abs(np.diff(counts, axis=axis))
+        difference = (difference != 0).astype(np.float32) if fractal_type == "newton_fractal" else difference / max_iter
+        before, after = [slice(None)] * 2, [slice(None)] * 2
+        before[axis], after[axis] = slice(None, -1), slice(1, None)
+        contrast[tuple(before)] = np.maximum(contrast[tuple(before)], difference)
+        contrast[tuple(after)] = np.maximum(contrast[tuple(after)], difference)
+
+    if iters.ndim == 3:
+        # the distance estimate sees the set come within a pixel even where the counts happen to agree
+        distance = iters[..., 2]
+        contrast[(distance >= 0) & (distance < 1)] = np.maximum(contrast[(distance >= 0) & (distance < 1)], 1)
+
+    return contrast
+
+def select_pixels(fractal_type, iters, max_iter, budget=antialiasing_budget, threshold=antialiasing_threshold):
+    # (x, y) of the edge pixels, the strongest edges first and no more than budget of all pixels, and how many edge pixels there were
+    contrast = get_contrast(fractal_type, iters, max_iter)
+    edges = np.flatnonzero(contrast > threshold)
+    limit = int(budget * contrast.size)
+
+    if len(edges) > limit:
+        edges = edges[np.argpartition(-contrast.ravel()[edges], limit)[:limit]] if limit else edges[:0]
+
+    y, x = np.unravel_index(edges, contrast.shape)
+    return np.stack([x, y], axis=1).astype(np.int32), int(np.count_nonzero(contrast > threshold))
+
+def get_sample_positions(pixels, jitter):
+    # every pixel's jittered sample positions in pixels, pixel after pixel
+    x = pixels[:, 0, np.newaxis] + jitter[np.newaxis, :, 0]
+    y = pixels[:, 1, np.newaxis] + jitter[np.newaxis, :, 1]
+    return x.ravel(), y.ravel()
+
+def average_colors(fractal_type, samples, max_iter, palette):
+    # samples has a row of jittered samples per pixel, like an image of iterations with or without channels
+    return color_iters(fractal_type, samples, max_iter, palette).mean(axis=1)
+
+def supersample(calculate, pixels, jitter):
+    # calculate takes the x and y sample positions and returns one sample per position, see calculate_iters' samples argument
+    samples = calculate(*get_sample_positions(pixels, jitter))
+    return samples.reshape((len(pixels), len(jitter)) + samples.shape[1:])
+
+def antialias_iters(fractal_type, iters, calculate, samples, max_iter, budget=antialiasing_budget, threshold=antialiasing_threshold):
+    # the refined pixels, their samples to color with average_colors, which stay valid when only the palette changes, and a report
+    start = time.perf_counter()
+    pixels, edges = select_pixels(fractal_type, iters, max_iter, budget, threshold)
+    jitter = get_jitter(samples)
+    return pixels, supersample(calculate, pixels, jitter), create_report(iters, pixels, edges, jitter, start)
+
+def create_report(iters, pixels, edges, jitter, start):
+    return {"pixels": get_counts(iters).size, "edges": edges, "refined": len(pixels), "samples": len(pixels) * len(jitter), "seconds": time.perf_counter() - start}
+
+def format_report(report):
+    capped = f", {report['edges'] - report['refined']} over the budget" if report["edges"] > report["refined"] else ""
+    return f"Antialiased {report['refined']} of {report['pixels']} pixels ({report['refined'] / report['pixels'] * 100:.1f}%{capped}) with {report['samples']} samples in {report['seconds'] * 1000:.1f} ms"
@@ -0,0 +1,336 @@
+import os, json, time, logging
+import pyglet
+import numpy as np
+
+from mpmath import mpc, mpf
+from PIL import Image
+
+from game.shader import create_iter_calc_shader, supports_compute_shaders, get_workgroup_count, set_view_uniforms, get_preturbation_reference, update_preturbation_reference, dispatch_subdivided, dispatch_antialiasing, get_required_bits, get_precision_ladder, select_precision, create_palette_texture
+from game.cpu_engine import calculate_iters, calculate_preturbation_iters, subdivide_iters, unresolved, get_counts, color_iters, get_default_palette
+from game.tile_renderer import TileRenderer, get_mp_context
+from game.antialiasing import antialias_iters, average_colors, format_report
+from game.readback import AsyncReadback
+from game.preturbation import supports_preturbation
+from game.shader_cache import release_program
+from utils.constants import batch_job_defaults, initial_real_imag, periodicity_check_fractals, subdivision_tile_size, subdivision_min_tile_size
+
+# Offline rendering without the arcade window: every job is a dict with the keys of batch_job_defaults.
+# One BatchRenderer renders a whole job list, so the GL context, the compiled programs and the buffers are set up once per process.
+
+def create_headless_context():
+    # In pyglet's headless mode a window is an EGL pbuffer, it needs neither a display nor a visible surface.
+    config = pyglet.gl.Config(major_version=4, minor_version=3, forward_compatible=True, double_buffer=False)
+    return pyglet.window.Window(width=1, height=1, visible=False, config=config)
+
+def load_jobs(path, overrides=None):
+    # A job file is either a list of jobs or {"defaults": {...}, "jobs": [...]}.
+    with open(path, "r") as file:
+        data = json.load(file)
+
+    if isinstance(data, list):
+        data = {"jobs": data}
+
+    defaults = {**data.get("defaults", {}), **(overrides or {})}
+    return [create_job(index, {**defaults, **job}) for index, job in enumerate(data["jobs"])]
+
+def create_job(index, job):
+    unknown = set(job) - set(batch_job_defaults)
+    if unknown:
+        raise ValueError(f"Unknown batch job keys: {', '.join(sorted(unknown))}")
+
+    job = {**batch_job_defaults, **job}
+
+    if job["fractal"] not in initial_real_imag:
+        raise ValueError(f"Unknown fractal {job['fractal']}")
+    if job["strategy"] not in ("pixel", "subdivision"):
+        raise ValueError(f"Unknown render strategy {job['strategy']}")
+
+    job["index"] = index
+    job["output"] = job["output"].format(**job)
+    job["palette"] = job["palette"] or get_default_palette(job["fractal"])
+    job["preturbation"] = job["preturbation"] and supports_preturbation(job["fractal"], job["multi_n"])
+    job["periodicity_check"] = job["fractal"] in periodicity_check_fractals if job["periodicity_check"] is None else job["periodicity_check"]
+
+    if job["precision"] == "auto":
+        # the cheapest kernel exact enough for the view like in the viewer, without measuring whether float-float is faster
+        precision, preturbation = select_precision(get_precision_ladder(job["fractal"], job["multi_n"]), get_required_bits(*get_viewport(job), job["width"]))
+        job["precision"], job["preturbation"] = precision, job["preturbation"] or preturbation
+
+    if job["fractal"] == "newton_fractal":
+        job["precision"] = "single" # the Newton shader only has a single precision version, the viewer has no precision setting for it either
+    return job
+
+def get_viewport(job):
+    # Coordinates can be given as strings so deep zoom locations keep every digit.
+    if job["center"] is not None:
+        center_real, center_imag = map(mpf, job["center"])
+        real_span = mpf(job["span"])
+        imag_span = real_span * job["height"] / job["width"]
+        return center_real - real_span / 2, center_real + real_span / 2, center_imag - imag_span / 2, center_imag + imag_span / 2
+
+    if job["viewport"] is not None:
+        return tuple(map(mpf, job["viewport"]))
+
+    return get_initial_viewport(job)
+
+def get_initial_viewport(job):
+    # The view the viewer opens with, zoom 1
+    if job["fractal"] == "julia":
+        return tuple(map(mpf, (-job["escape_radius"], job["escape_radius"], -job["escape_radius"], job["escape_radius"])))
+
+    return tuple(map(mpf, initial_real_imag[job["fractal"]]))
+
+def is_image_output(job):
+    return os.path.splitext(job["output"])[1].lower() not in (".npy", ".raw")
+
+def to_rgb(job, iters, colors=None):
+    # colors overrides the palette colors of the iterations, the antialiased ones for example
+    if colors is None:
+        colors = color_iters(job["fractal"], iters, job["max_iter"], job["palette"])
+    return np.rint(np.clip(colors[..., :3], 0.0, 1.0) * 255).astype(np.uint8)
+
+def create_output_directory(job):
+    directory = os.path.dirname(job["output"])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def write_output(job, iters, colors=None):
+    create_output_directory(job)
+
+    # The iteration buffers start at the bottom of the view, files start at the top.
+    iters = np.flipud(iters)
+    colors = None if colors is None else np.flipud(colors)
+    extension = os.path.splitext(job["output"])[1].lower()
+
+    if extension == ".npy":
+        np.save(job["output"], iters.astype(np.float32))
+    elif extension == ".raw":
+        iters.astype("<f4").tofile(job["output"])
+    else:
+        Image.fromarray(to_rgb(job, iters, colors)).save(job["output"])
+
+def write_pixels(job, pixels):
+    # 8 bit colors of an AsyncReadback export
+    create_output_directory(job)
+    Image.fromarray(np.flipud(pixels)).save(job["output"])
+
+class BatchRenderer:
+    def __init__(self, backend="auto", workgroup_size=(8, 8), cpu_workers=1, binary_cache=True, orbit_cache_budget=256 * 1024 * 1024):
+        self.backend = backend
+        self.workgroup_size = workgroup_size
+        # without a worker pool on this platform, see get_mp_context
+        self.cpu_workers = cpu_workers if get_mp_context() else 1
+        self.binary_cache = binary_cache
+        self.orbit_cache_budget = orbit_cache_budget
+        self.programs = {}
+        self.tile_renderers = {}
+        self.readbacks = {}
+        self.palette_textures = {}
+        self.window = None
+
+        if backend != "cpu":
+            try:
+                self.window = create_headless_context()
+            except Exception:
+                if backend == "gpu":
+                    raise
+
+                logging.exception("Creating a headless OpenGL context failed, falling back to the CPU engine.")
+
+            if not self.window or not supports_compute_shaders():
+                self.backend = "cpu"
+
+        logging.info(f"Batch renderer using the {self.backend} backend")
+
+    def get_program(self, job):
+        key = (job["fractal"], job["width"], job["height"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"], job["preturbation"], job["periodicity_check"], job["channels"])
+
+        if key not in self.programs:
+            self.programs[key] = create_iter_calc_shader(
+                job["fractal"], job["width"], job["height"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"],
+                job["preturbation"], self.workgroup_size, self.backend, self.cpu_workers, self.binary_cache, job["periodicity_check"], job["channels"]
+            )
+
+        return self.programs[key]
+
+    def get_reference_arguments(self, job, real_min, real_max, imag_min, imag_max):
+        # The reference orbit sits at the exact center of the view, like in the viewer.
+        return (
+            job["fractal"], mpc((real_min + real_max) / 2, (imag_min + imag_max) / 2), (real_max - real_min, imag_max - imag_min),
+            job["max_iter"], job["multi_n"], job["julia_type"], job["escape_radius"], job["series_approximation"], self.orbit_cache_budget
+        )
+
+    def set_uniforms(self, shader_program, job, real_min, real_max, imag_min, imag_max):
+        with shader_program:
+            shader_program["u_maxIter"] = int(job["max_iter"])
+            shader_program["u_pass_scale"] = 1
+            shader_program["u_previous_scale"] = 0
+            shader_program["u_reuse"] = False
+            shader_program["u_resolution"] = (job["width"], job["height"])
+            set_view_uniforms(shader_program, real_min, real_max, imag_min, imag_max)
+
+        # the storage buffers have to stay referenced until the dispatch is done
+        if job["preturbation"]:
+            return update_preturbation_reference(shader_program, *self.get_reference_arguments(job, real_min, real_max, imag_min, imag_max))
+
+        return []
+
+    def dispatch(self, shader_program, job):
+        if job["strategy"] == "subdivision":
+            dispatch_subdivided(shader_program, job["width"], job["height"], self.workgroup_size)
+            return
+
+        with shader_program:
+            shader_program.dispatch(*get_workgroup_count(job["width"], job["height"], self.workgroup_size), 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+
+    def dispatch_gpu(self, job, real_min, real_max, imag_min, imag_max):
+        shader_program, iteration_buffers = self.get_program(job)
+        iteration_buffers.bind()
+
+        preturbation_buffers = self.set_uniforms(shader_program, job, real_min, real_max, imag_min, imag_max)
+        self.dispatch(shader_program, job)
+        del preturbation_buffers
+
+        return iteration_buffers
+
+    def render_gpu(self, job, real_min, real_max, imag_min, imag_max):
+        return self.dispatch_gpu(job, real_min, real_max, imag_min, imag_max).read_iters()
+
+    def render_cpu(self, job, real_min, real_max, imag_min, imag_max):
+        real_range, imag_range = (float(real_min), float(real_max)), (float(imag_min), float(imag_max))
+        reference = get_preturbation_reference(*self.get_reference_arguments(job, real_min, real_max, imag_min, imag_max)) if job["preturbation"] else None
+
+        if self.cpu_workers != 1:
+            key = (job["width"], job["height"], job["channels"])
+            if key not in self.tile_renderers:
+                self.tile_renderers[key] = TileRenderer(job["width"], job["height"], self.cpu_workers, channels=job["channels"])
+
+        def calculate(mask=None):
+            if reference:
+                return calculate_preturbation_iters(job["fractal"], job["width"], job["height"], max_iter=job["max_iter"], multi_n=job["multi_n"], escape_radius=job["escape_radius"], mask=mask, channels=job["channels"], **reference)
+            elif self.cpu_workers != 1:
+                return self.tile_renderers[key].render(job["fractal"], real_range, imag_range, job["max_iter"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"], mask, job["periodicity_check"])
+
+            return calculate_iters(job["fractal"], job["width"], job["height"], real_range, imag_range, job["max_iter"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"], mask=mask, periodicity_check=job["periodicity_check"], channels=job["channels"])
+
+        if job["strategy"] == "subdivision":
+            shape = (job["height"], job["width"], 3) if job["channels"] else (job["height"], job["width"])
+            return subdivide_iters(calculate, np.full(shape, unresolved, dtype=np.float32 if job["channels"] else np.int32), subdivision_tile_size, subdivision_min_tile_size)[0]
+
+        return calculate()
+
+    def render(self, job):
+        viewport = get_viewport(job)
+
+        if self.backend == "cpu":
+            return self.render_cpu(job, *viewport)
+
+        return self.render_gpu(job, *viewport)
+
+    def exports_on_gpu(self, job):
+        # PNGs without antialiasing are colored on the GPU and read back 8 bit, antialiasing colors the samples on the CPU
+        return self.backend != "cpu" and is_image_output(job) and not job["antialiasing"]
+
+    def get_readback(self, job):
+        key = (job["width"], job["height"])
+        if key not in self.readbacks:
+            self.readbacks[key] = AsyncReadback(job["width"], job["height"], self.workgroup_size, binary_cache=self.binary_cache)
+
+        return self.readbacks[key]
+
+    def export(self, tag, job, image):
+        # queues the colors of an iteration buffer image, collect_exports hands them out once they are read back
+        if job["palette"] not in self.palette_textures:
+            self.palette_textures[job["palette"]] = create_palette_texture(job["palette"])
+
+        self.get_readback(job).submit(tag, image, self.palette_textures[job["palette"]], job["fractal"], job["max_iter"], job["channels"])
+
+    def collect_exports(self, wait=False):
+        return [export for readback in self.readbacks.values() for export in readback.collect(wait)]
+
+    def write_exports(self, job_count, wait=False):
+        for (job, job_start), pixels in self.collect_exports(wait):
+            write_pixels(job, pixels)
+            logging.info(f"[{job['index'] + 1}/{job_count}] {job['output']} ({job['width']}x{job['height']}, {job['fractal']}) in {time.perf_counter() - job_start:.3f}s")
+
+    def antialias(self, job, iters, viewport=None):
+        # Colors of the whole image with the edge pixels supersampled, see game/antialiasing.py. viewport defaults to the job's.
+        real_min, real_max, imag_min, imag_max = viewport or get_viewport(job)
+
+        if self.backend == "cpu":
+            real_range, imag_range = (float(real_min), float(real_max)), (float(imag_min), float(imag_max))
+            reference = get_preturbation_reference(*self.get_reference_arguments(job, real_min, real_max, imag_min, imag_max)) if job["preturbation"] else None
+
+            def calculate(x, y):
+                if reference:
+                    return calculate_preturbation_iters(job["fractal"], job["width"], job["height"], max_iter=job["max_iter"], multi_n=job["multi_n"], escape_radius=job["escape_radius"], channels=job["channels"], samples=(x, y), **reference)
+
+                return calculate_iters(job["fractal"], job["width"], job["height"], real_range, imag_range, job["max_iter"], job["precision"], job["multi_n"], job["escape_radius"], job["julia_type"], periodicity_check=job["periodicity_check"], channels=job["channels"], samples=(x, y))
+
+            pixels, samples, report = antialias_iters(job["fractal"], iters, calculate, job["antialiasing"], job["max_iter"], job["antialiasing_budget"])
+        else:
+            shader_program, iteration_buffers = self.get_program(job)
+            iteration_buffers.bind()
+
+            preturbation_buffers = self.set_uniforms(shader_program, job, real_min, real_max, imag_min, imag_max)
+            calculate = lambda x, y: dispatch_antialiasing(shader_program, iteration_buffers, x, y, self.workgroup_size)
+            pixels, samples, report = antialias_iters(job["fractal"], iters, calculate, job["antialiasing"], job["max_iter"], job["antialiasing_budget"])
+            del preturbation_buffers
+
+        logging.info(f"{job['output']}: {format_report(report)}")
+
+        colors = color_iters(job["fractal"], iters, job["max_iter"], job["palette"])
+        colors[pixels[:, 1], pixels[:, 0]] = average_colors(job["fractal"], samples, job["max_iter"], job["palette"])
+        return colors
+
+    def check_strategy(self, job, iters):
+        # Renders the job again pixel by pixel and reports where the chosen strategy differs, returns the number of such pixels.
+        # with channels only the iterations are compared, filled tiles take the smooth count and the distance of a corner
+        iters, reference = get_counts(iters), get_counts(self.render({**job, "strategy": "pixel"}))
+        mismatches = int(np.count_nonzero(iters != reference))
+
+        if mismatches:
+            logging.warning(f"{job['output']}: {mismatches} of {iters.size} pixels ({mismatches / iters.size * 100:.3f}%) differ from the per pixel render, largest difference {int(np.abs(iters - reference).max())} iterations")
+        else:
+            logging.info(f"{job['output']}: {job['strategy']} render matches the per pixel render")
+
+        return mismatches
+
+    def run(self, jobs, check=False):
+        start = time.perf_counter()
+        mismatched_jobs = 0
+
+        for job in jobs:
+            job_start = time.perf_counter()
+
+            if self.exports_on_gpu(job) and not (check and job["strategy"] != "pixel"):
+                # the next jobs render while this one is read back
+                self.export((job, job_start), job, self.dispatch_gpu(job, *get_viewport(job)).images[0])
+                self.write_exports(len(jobs))
+                continue
+
+            iters = self.render(job)
+            colors = self.antialias(job, iters) if job["antialiasing"] and is_image_output(job) else None
+            write_output(job, iters, colors)
+            logging.info(f"[{job['index'] + 1}/{len(jobs)}] {job['output']} ({job['width']}x{job['height']}, {job['fractal']}) in {time.perf_counter() - job_start:.3f}s")
+
+            if check and job["strategy"] != "pixel":
+                mismatched_jobs += self.check_strategy(job, iters) > 0
+
+        self.write_exports(len(jobs), wait=True)
+        logging.info(f"Rendered {len(jobs)} frames in {time.perf_counter() - start:.3f}s")
+        return mismatched_jobs
+
+    def close(self):
+        for tile_renderer in self.tile_renderers.values():
+            tile_renderer.close()
+
+        for readback in self.readbacks.values():
+            readback.delete()
+
+        for shader_program, iteration_buffers in self.programs.values():
+            release_program(shader_program)
+            iteration_buffers.delete()
+
+        if self.window:
+            self.window.close()
@@ -0,0 +1,579 @@
+import math, numpy as np
+
+from math import comb
+from fractions import Fraction
+
+from utils.constants import c_for_julia_type
+
+# NumPy mirror of the compute shaders in game/shader.py, used when there is no OpenGL 4.3 context.
+# Every kernel iterates only the pixels that are still active, so the working set shrinks as points escape.
+
+unresolved = -2 # not computed yet, no fractal produces it
+
+# With channels an image holds float32 [iterations, smooth iterations, distance estimate] per pixel instead of int32 iterations.
+
+def get_counts(iters):
+    return iters[..., 0] if iters.ndim == 3 else iters
+
+def get_dtypes(precision="single", multi_n=2):
+    # float-float is the shaders' stand-in for double precision, NumPy has real doubles
+    if precision in ("double", "float-float"):
+        return np.float64, np.complex128
+
+    return np.float32, np.complex64
+
+def get_periodicity_tolerance(precision="single", multi_n=2):
+    # how close an orbit has to come back to a saved value to count as a cycle, a few ulps of the type it is iterated in
+    return 1e-12 if get_dtypes(precision, multi_n)[0] == np.float64 else 1e-6
+
+def map_pixels(width, height, real_range, imag_range, precision="single", multi_n=2, region=None, step=1):
+    float_dtype, complex_dtype = get_dtypes(precision, multi_n)
+
+    # region is (x0, y0, x1, y1) in pixels, the mapping stays the one of the whole width x height image
+    # step only samples every step-th pixel of it, which is what the coarse progressive passes render
+    x0, y0, x1, y1 = region or (0, 0, width, height)
+
+    x = np.arange(x0, x1, step, dtype=float_dtype)
+    y = np.arange(y0, y1, step, dtype=float_dtype)
+
+    real = float_dtype(real_range[0]) + (x / float_dtype(width)) * float_dtype(real_range[1] - real_range[0])
+    imag = float_dtype(imag_range[0]) + (y / float_dtype(height)) * float_dtype(imag_range[1] - imag_range[0])
+
+    pos = np.empty((y.size, x.size), dtype=complex_dtype)
+    pos.real = real[np.newaxis, :]
+    pos.imag = imag[:, np.newaxis]
+
+    return pos
+
+def map_samples(width, height, real_range, imag_range, x, y, precision="single", multi_n=2):
+    # the mapping of map_pixels for arbitrary, also fractional, pixel positions, one point per position
+    float_dtype, complex_dtype = get_dtypes(precision, multi_n)
+    x, y = np.asarray(x, dtype=float_dtype), np.asarray(y, dtype=float_dtype)
+
+    pos = np.empty(x.shape, dtype=complex_dtype)
+    pos.real = float_dtype(real_range[0]) + (x / float_dtype(width)) * float_dtype(real_range[1] - real_range[0])
+    pos.imag = float_dtype(imag_range[0]) + (y / float_dtype(height)) * float_dtype(imag_range[1] - imag_range[0])
+    return pos
+
+def to_complex(real, imag, dtype):
+    z = np.empty(np.shape(real), dtype=dtype)
+    z.real = real
+    z.imag = imag
+    return z
+
+def complex_power(z, n):
+    # repeated squaring like complex_power in game/shader.py
+    result, n = np.ones_like(z), int(n)
+    while n > 0:
+        if n & 1:
+            result = result * z
+        z, n = z * z, n >> 1
+    return result
+
+def mandelbrot_step(z, c, multi_n):
+    if int(multi_n) == 2:
+        return z * z + c
+    return complex_power(z, multi_n) + c
+
+def mandelbar_step(z, c, multi_n):
+    if int(multi_n) == 2:
+        return np.conjugate(z * z) + c
+    return complex_power(np.conjugate(z), multi_n) + c
+
+def buffalo_fractal_step(z, c, multi_n):
+    zn = z * z if int(multi_n) == 2 else complex_power(z, multi_n)
+    return to_complex(np.abs(zn.real), np.abs(zn.imag), z.dtype) + c
+
+def burning_ship_step(z, c, multi_n):
+    x, y = z.real, z.imag
+    return to_complex(x * x - y * y, np.abs(2 * x * y), z.dtype) + c
+
+def lambda_fractal_step(z, c, multi_n):
+    z = to_complex(np.where(z.real == 0, 0.5, z.real), z.imag, z.dtype)
+    one_minus_z = to_complex(1 - z.real, 1 - z.imag, z.dtype)
+    return c * (z * one_minus_z)
+
+iteration_steps = {
+    "mandelbrot": mandelbrot_step,
+    "julia": mandelbrot_step,
+    "mandelbar": mandelbar_step,
+    "buffalo_fractal": buffalo_fractal_step,
+    "burning_ship": burning_ship_step,
+    "lambda_fractal": lambda_fractal_step
+}
+
+# Derivatives of the steps above by c (by z_0 for Julia sets), scaled by the pixel size so the distance estimate comes out in pixels.
+# The abs() fractals are not holomorphic, they carry the scalar bound n |z|^(n - 1) |d| + 1 instead.
+
+def mandelbrot_derivative(z, d, c, multi_n, pixel_size):
+    return int(multi_n) * complex_power(z, int(multi_n) - 1) * d + pixel_size
+
+def julia_derivative(z, d, c, multi_n, pixel_size):
+    return int(multi_n) * complex_power(z, int(multi_n) - 1) * d
+
+def mandelbar_derivative(z, d, c, multi_n, pixel_size):
+    return int(multi_n) * complex_power(np.conjugate(z), int(multi_n) - 1) * np.conjugate(d) + pixel_size
+
+def buffalo_fractal_derivative(z, d, c, multi_n, pixel_size):
+    return (int(multi_n) * np.abs(z) ** (int(multi_n) - 1) * np.abs(d) + pixel_size).astype(z.dtype)
+
+def burning_ship_derivative(z, d, c, multi_n, pixel_size):
+    return (2 * np.abs(z) * np.abs(d) + pixel_size).astype(z.dtype)
+
+def lambda_fractal_derivative(z, d, c, multi_n, pixel_size):
+    # the step is c z w with w = (1 + i) - z
+    z = to_complex(np.where(z.real == 0, 0.5, z.real), z.imag, z.dtype)
+    w = to_complex(1 - z.real, 1 - z.imag, z.dtype)
+    return z * w * pixel_size + c * (w - z) * d
+
+derivative_steps = {
+    "mandelbrot": mandelbrot_derivative,
+    "julia": julia_derivative,
+    "mandelbar": mandelbar_derivative,
+    "buffalo_fractal": buffalo_fractal_derivative,
+    "burning_ship": burning_ship_derivative,
+    "lambda_fractal": lambda_fractal_derivative
+}
+
+def get_degree(fractal_type, multi_n=2):
+    return 2 if fractal_type in ("burning_ship", "lambda_fractal") else int(multi_n)
+
+def count_channels(iters):
+    # fractals without a derivative, and points that never escaped: the smooth count is the count and the distance is unknown (-1)
+    channels = np.empty((iters.size, 3), dtype=np.float32)
+    channels[:, 0] = iters
+    channels[:, 1] = iters
+    channels[:, 2] = -1
+    return channels
+
+def escape_channels(iters, z, d, max_iter, escape_radius, degree):
+    # A point escaping after n iterations gets a smooth count between n and n + 1 that is continuous across the bands,
+    # and the exterior distance estimate |z| log|z| / 2|dz/dc|, in pixels because d was scaled by the pixel size.
+    channels = count_channels(iters)
+    escaped = iters < max_iter
+    r, d = np.abs(z[escaped]).astype(np.float64), np.abs(d[escaped]).astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        channels[escaped, 1] = iters[escaped] + 1 - np.log(np.log(r) / np.log(escape_radius)) / np.log(degree)
+        channels[escaped, 2] = np.nan_to_num(0.5 * r * np.log(r) / d, nan=0.0, posinf=0.0)
+
+    return channels
+
+def in_main_cardioid_or_bulb(c):
+    q = (c.real - 0.25) ** 2 + c.imag ** 2
+    return (q * (q + c.real - 0.25) <= 0.25 * c.imag ** 2) | ((c.real + 1) ** 2 + c.imag ** 2 <= 0.0625)
+
+def escape_time(step, z, c, max_iter, escape_radius, multi_n=2, periodicity_tolerance=0, derivative_step=None, derivative=0, pixel_size=1):
+    # With a derivative_step the derivative starting at derivative is carried along and (iters, z, derivative) at escape is returned.
+    iters = np.full(z.size, max_iter, dtype=np.int32)
+
+    c = np.broadcast_to(np.asarray(c, dtype=z.dtype), z.shape).ravel().copy()
+    z = z.ravel().copy()
+    if derivative_step:
+        d, escaped_z, escaped_d = np.full(z.size, derivative, dtype=z.dtype), np.zeros_like(z), np.zeros_like(z)
+    index = np.arange(z.size)
+    radius_squared = escape_radius * escape_radius
+
+    # Brent's cycle detection like the shaders, points that come back to the value saved at the last power of two are in the set
+    z_saved = z.copy()
+    next_save = 1
+
+    for n in range(max_iter):
+        escaped = z.real * z.real + z.imag * z.imag >= radius_squared
+        if escaped.any():
+            iters[index[escaped]] = n
+            active = ~escaped
+            if derivative_step:
+                escaped_z[index[escaped]], escaped_d[index[escaped]] = z[escaped], d[escaped]
+                d = d[active]
+            z, z_saved, c, index = z[active], z_saved[active], c[active], index[active]
+            if not index.size:
+                break
+
+        if derivative_step:
+            d = derivative_step(z, d, c, multi_n, pixel_size)
+        z = step(z, c, multi_n)
+
+        if not periodicity_tolerance:
+            continue
+
+        periodic = (np.abs(z.real - z_saved.real) < periodicity_tolerance) & (np.abs(z.imag - z_saved.imag) < periodicity_tolerance)
+        if periodic.any():
+            active = ~periodic
+            if derivative_step:
+                d = d[active]
+            z, z_saved, c, index = z[active], z_saved[active], c[active], index[active]
+            if not index.size:
+                break
+
+        if n + 1 == next_save:
+            z_saved = z.copy()
+            next_save *= 2
+
+    if derivative_step:
+        return iters, escaped_z, escaped_d
+    return iters
+
+def phoenix_escape_time(c, max_iter, escape_radius):
+    iters = np.full(c.size, max_iter, dtype=np.int32)
+
+    c = c.ravel().copy()
+    z = np.zeros_like(c)
+    z_prev = np.zeros_like(c)
+    index = np.arange(c.size)
+    p = z.real.dtype.type(0.56667)
+    radius_squared = escape_radius * escape_radius
+
+    for n in range(max_iter):
+        escaped = z.real * z.real + z.imag * z.imag >= radius_squared
+        if escaped.any():
+            iters[index[escaped]] = n
+            active = ~escaped
+            z, z_prev, c, index = z[active], z_prev[active], c[active], index[active]
+            if not index.size:
+                break
+
+        z, z_prev = z * z + c - p * z_prev, z
+
+    return iters
+
+def newton_roots(z, max_iter):
+    roots = np.array([1, -0.5 + 0.866025404j, -0.5 - 0.866025404j], dtype=z.dtype)
+    tolerance = 0.000001
+
+    result = np.full(z.size, -1, dtype=np.int32)
+
+    z = z.ravel().copy()
+    index = np.arange(z.size)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(max_iter):
+            z = z - (z * z * z - 1) / (3 * z * z)
+
+            converged = np.zeros(z.size, dtype=bool)
+            for root_index, root in enumerate(roots):
+                difference = z - root
+                close = (np.abs(difference.real) < tolerance) & (np.abs(difference.imag) < tolerance) & ~converged
+                result[index[close]] = root_index
+                converged |= close
+
+            if converged.any():
+                active = ~converged
+                z, index = z[active], index[active]
+                if not index.size:
+                    break
+
+    return result
+
+def scatter_samples(iters, shape, mask=None):
+    # iters has one row per sample, and a channel axis with channels
+    shape = shape + iters.shape[1:]
+    if mask is None:
+        return iters.reshape(shape)
+
+    result = np.zeros(shape, dtype=iters.dtype)
+    result[mask] = iters
+    return result
+
+def calculate_iters(fractal_type, width, height, real_range, imag_range, max_iter, precision="single", multi_n=2, escape_radius=2, julia_type="Classic swirling", region=None, step=1, mask=None, periodicity_check=True, channels=False, samples=None):
+    # mask restricts the work to some of the pixels, the others are left at 0 in the result
+    # samples are (x, y) pixel positions computed instead of the pixels, the result then has one row per position
+    if samples is None:
+        pos = map_pixels(width, height, real_range, imag_range, precision, multi_n, region, step)
+        selected = (pos if mask is None else pos[mask]).ravel()
+    else:
+        selected = map_samples(width, height, real_range, imag_range, *samples, precision, multi_n)
+
+    max_iter = int(max_iter)
+
+    tolerance = get_periodicity_tolerance(precision, multi_n) if periodicity_check else 0
+    derivative_step = derivative_steps.get(fractal_type) if channels else None
+    pixel_size = (real_range[1] - real_range[0]) / width
+
+    def iterate(z, c):
+        if not derivative_step:
+            iters = escape_time(iteration_steps[fractal_type], z, c, max_iter, escape_radius, multi_n, tolerance)
+            return count_channels(iters) if channels else iters
+
+        iters, z, d = escape_time(iteration_steps[fractal_type], z, c, max_iter, escape_radius, multi_n, tolerance, derivative_step, pixel_size if fractal_type == "julia" else 0, pixel_size)
+        return escape_channels(iters, z, d, max_iter, escape_radius, get_degree(fractal_type, multi_n))
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        if fractal_type == "julia":
+            iters = iterate(selected, complex(*c_for_julia_type[julia_type]))
+        elif fractal_type in ("phoenix_fractal", "newton_fractal"):
+            iters = phoenix_escape_time(selected, max_iter, escape_radius) if fractal_type == "phoenix_fractal" else newton_roots(selected, max_iter)
+            iters = count_channels(iters) if channels else iters
+        elif fractal_type == "mandelbrot" and int(multi_n) == 2:
+            # the main cardioid and the period 2 bulb are known to be inside, only the rest is iterated
+            interior = in_main_cardioid_or_bulb(selected)
+            iters = np.full(selected.size, max_iter, dtype=np.int32)
+            iters = count_channels(iters) if channels else iters
+            iters[~interior] = iterate(np.zeros(int(np.count_nonzero(~interior)), dtype=selected.dtype), selected[~interior])
+        else:
+            iters = iterate(np.zeros_like(selected), selected)
+
+    if samples is not None:
+        return iters
+    return scatter_samples(iters, pos.shape, mask)
+
+def get_grid_lines(size, spacing):
+    # every spacing-th pixel and the last one, the borders of the subdivision tiles along one axis
+    return np.unique(np.append(np.arange(0, size, spacing), size - 1))
+
+def subdivide_iters(calculate, iters, tile_size, min_tile_size=2):
+    # Mariani-Silver, mirror of dispatch_subdivided in game/shader.py. iters is unresolved wherever nothing is known yet and
+    # calculate(mask) returns an image with at least the masked pixels computed. Returns the iterations and which pixels were iterated.
+    iters = iters.copy()
+    counts = get_counts(iters)
+    height, width = counts.shape
+    computed = np.zeros(counts.shape, dtype=bool)
+
+    def compute(mask):
+        mask &= counts == unresolved
+        if mask.any():
+            iters[mask] = calculate(mask)[mask]
+            computed[mask] = True
+
+    size = tile_size
+    while size >= min_tile_size:
+        xs, ys = get_grid_lines(width, size), get_grid_lines(height, size)
+        if len(xs) < 2 or len(ys) < 2:
+            break
+
+        grid = np.zeros(counts.shape, dtype=bool)
+        grid[ys, :] = True
+        grid[:, xs] = True
+        compute(grid.copy())
+
+        # minimum and maximum over the border of every tile between neighbouring grid lines, reduceat leaves out the far corner
+        rows, columns, corners = counts[ys, :], counts[:, xs], counts[np.ix_(ys[1:], xs[1:])]
+        borders = []
+        for reduce in (np.minimum, np.maximum):
+            horizontal = reduce.reduceat(rows, xs[:-1], axis=1)
+            vertical = reduce.reduceat(columns, ys[:-1], axis=0)
+            borders.append(reduce.reduce([horizontal[:-1], horizontal[1:], vertical[:, :-1], vertical[:, 1:], corners]))
+
+        values = np.where(borders[0] == borders[1], borders[0], unresolved)
+        tile_x = np.minimum(np.searchsorted(xs, np.arange(width), side="right") - 1, len(xs) - 2)
+        tile_y = np.minimum(np.searchsorted(ys, np.arange(height), side="right") - 1, len(ys) - 2)
+        fill = ~grid & (counts == unresolved) & (values[np.ix_(tile_y, tile_x)] != unresolved)
+
+        # the whole sample of the tile corner, with channels the smooth count and the distance are approximated by the corner's
+        iters[fill] = iters[np.ix_(ys[tile_y], xs[tile_x])][fill]
+
+        size //= 2
+
+    # inside the tiles of the smallest size that were not filled every pixel is computed
+    compute(np.ones(counts.shape, dtype=bool))
+    return iters, computed
+
+def diffabs(c, d):
+    # |c + d| - |c| without cancellation, the delta of abs() for the burning ship style fractals
+    return np.where(c >= 0, np.where(c + d >= 0, d, -(2 * c + d)), np.where(c + d > 0, 2 * c + d, -d))
+
+def delta_power(reference, dz, multi_n):
+    # (Z + dz)^n - Z^n expanded binomially, Horner's scheme in dz
+    n = int(multi_n)
+    result = np.ones_like(dz)
+    for k in range(n - 1, 0, -1):
+        result = result * dz + comb(n, k) * reference ** (n - k)
+    return result * dz
+
+def mandelbrot_delta(reference, dz, dc, multi_n):
+    if int(multi_n) == 2:
+        return (2 * reference + dz) * dz + dc
+    return delta_power(reference, dz, multi_n) + dc
+
+def mandelbar_delta(reference, dz, dc, multi_n):
+    return delta_power(np.conjugate(reference), np.conjugate(dz), multi_n) + dc
+
+def burning_ship_delta(reference, dz, dc, multi_n):
+    x, y, dx, dy = reference.real, reference.imag, dz.real, dz.imag
+    return to_complex((2 * x + dx) * dx - (2 * y + dy) * dy, 2 * diffabs(x * y, x * dy + dx * y + dx * dy), dz.dtype) + dc
+
+def buffalo_fractal_delta(reference, dz, dc, multi_n):
+    x, y, dx, dy = reference.real, reference.imag, dz.real, dz.imag
+    return to_complex(diffabs(x * x - y * y, (2 * x + dx) * dx - (2 * y + dy) * dy), 2 * diffabs(x * y, x * dy + dx * y + dx * dy), dz.dtype) + dc
+
+delta_steps = {
+    "mandelbrot": mandelbrot_delta,
+    "julia": mandelbrot_delta,
+    "mandelbar": mandelbar_delta,
+    "burning_ship": burning_ship_delta,
+    "buffalo_fractal": buffalo_fractal_delta
+}
+
+def calculate_preturbation_iters(fractal_type, width, height, span, orbit, max_iter, multi_n=2, escape_radius=2, series_skip=0, series_coefficients=(0j, 0j, 0j), region=None, step=1, mask=None, channels=False, samples=None):
+    # Mirror of calculate_preturbation_iters in game/shader.py, deltas are relative to the reference orbit at the center of the view.
+    # samples work like in calculate_iters.
+    if samples is None:
+        offset = map_pixels(width, height, (-span[0] / 2, span[0] / 2), (-span[1] / 2, span[1] / 2), "double", 2, region, step)
+        selected = offset.ravel() if mask is None else offset[mask]
+    else:
+        selected = map_samples(width, height, (-span[0] / 2, span[0] / 2), (-span[1] / 2, span[1] / 2), *samples, "double", 2)
+
+    max_iter = int(max_iter)
+    step = delta_steps[fractal_type]
+    derivative_step = derivative_steps[fractal_type] if channels else None
+    pixel_size = span[0] / width
+
+    a, b, c = series_coefficients
+    dz = selected * (a + selected * (b + selected * c))
+    dc = np.zeros_like(dz) if fractal_type == "julia" else selected.copy()
+
+    # the derivative of the series is where the derivative starts, A_0 = 1 makes it the pixel size for Julia sets
+    d = (a + selected * (2 * b + selected * 3 * c)) * pixel_size
+    escaped_z, escaped_d = np.zeros_like(d), np.zeros_like(d)
+
+    iters = np.full(dz.size, max_iter, dtype=np.int32)
+    ref = np.full(dz.size, series_skip, dtype=np.intp)
+    index = np.arange(dz.size)
+    radius_squared = escape_radius * escape_radius
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for n in range(series_skip, max_iter):
+            reference = orbit[ref]
+            z = reference + dz
+            z_squared = z.real * z.real + z.imag * z.imag
+
+            escaped = z_squared >= radius_squared
+            if escaped.any():
+                iters[index[escaped]] = n
+                escaped_z[index[escaped]], escaped_d[index[escaped]] = z[escaped], d[escaped]
+                active = ~escaped
+                z, z_squared, dz, dc, d, ref, index, reference = z[active], z_squared[active], dz[active], dc[active], d[active], ref[active], index[active], reference[active]
+                if not index.size:
+                    break
+
+            # glitch, rebase onto the start of the orbit
+            rebase = (z_squared < dz.real * dz.real + dz.imag * dz.imag) | (ref == len(orbit) - 1)
+            if rebase.any():
+                reference[rebase] = orbit[0]
+                dz[rebase] = z[rebase] - orbit[0]
+                ref[rebase] = 0
+
+            if derivative_step:
+                d = derivative_step(z, d, None, multi_n, pixel_size)
+            dz = step(reference, dz, dc, multi_n)
+            ref += 1
+
+    if channels:
+        iters = escape_channels(iters, escaped_z, escaped_d, max_iter, escape_radius, get_degree(fractal_type, multi_n))
+
+    if samples is not None:
+        return iters
+    return scatter_samples(iters, offset.shape, mask)
+
+def polynomial_palette(t):
+    value = np.zeros(t.shape + (4,), dtype=np.float32)
+    value[..., 0] = 9.0 * (1.0 - t) * t * t * t
+    value[..., 1] = 15.0 * (1.0 - t) * (1.0 - t) * t * t
+    value[..., 2] = 8.5 * (1.0 - t) * (1.0 - t) * (1.0 - t) * t
+    value[..., 3] = 1.0
+    return value
+
+def fire_palette(t):
+    value = np.zeros(t.shape + (4,), dtype=np.float32)
+    value[..., 0] = 3.0 * t
+    value[..., 1] = 2.0 * t * t
+    value[..., 2] = t * t * t
+    value[..., 3] = 1.0
+    return value
+
+palettes = {"Polynomial": polynomial_palette, "Fire": fire_palette}
+
+def get_default_palette(fractal_type):
+    return "Fire" if fractal_type in ("buffalo_fractal", "burning_ship") else "Polynomial"
+
+def color_iters(fractal_type, iters, max_iter, palette):
+    # Same rules as the coloring fragment shader, for output written without a GL context. With channels the smooth count is colored.
+    counts = get_counts(iters)
+    if fractal_type == "newton_fractal":
+        return newton_coloring(counts, max_iter)
+
+    value = palettes[palette](np.clip(iters[..., 1] if iters.ndim == 3 else counts, 0, max_iter).astype(np.float32) / np.float32(max_iter))
+    value[counts >= max_iter, :3] = 0.0
+    return value
+
+def newton_coloring(color_number, max_iter):
+    value = np.zeros(color_number.shape + (4,), dtype=np.float32)
+    for channel in range(3):
+        value[color_number == channel, channel] = 1.0
+    value[..., 3] = 1.0
+    return value
+
+# Sierpinsky carpet. A point is a hole if one of its base 3 digits is 1 on both axes at the same level. The view is an exact origin and
+# pixel size (Fractions, in pixels of the initial view), only the digits between the pixel size and the size of the image are looked at
+# per pixel, every coarser digit is shared by the whole view and resolved here with Python integers, so any zoom depth renders exactly.
+carpet_chunk_digits = 19
+
+def get_carpet_level(scale):
+    # smallest level L with scale * 3^L >= 1, cells of 3^-L are the finest a pixel can still tell apart
+    level = math.floor((scale.denominator.bit_length() - scale.numerator.bit_length()) / math.log2(3))
+    while scale * Fraction(3) ** level >= 1:
+        level -= 1
+    while scale * Fraction(3) ** level < 1:
+        level += 1
+    return level
+
+def is_carpet_hole(x, y, skip=0):
+    # negative coordinates keep going through floor division, -1 is all 2 digits and 0 all 0 digits, neither can make a hole
+    chunk = 3 ** carpet_chunk_digits
+    while x not in (0, -1) and y not in (0, -1):
+        (x, x_digits), (y, y_digits) = divmod(x, chunk), divmod(y, chunk)
+        for _ in range(carpet_chunk_digits):
+            if skip <= 0 and x_digits % 3 == 1 and y_digits % 3 == 1:
+                return True
+            x_digits, y_digits, skip = x_digits // 3, y_digits // 3, skip - 1
+    return False
+
+def get_carpet_view(origin, scale, width, height, depth):
+    level = get_carpet_level(scale)
+
+    # enough per pixel digits that adding the pixel's cell to the low digits carries at most once into the shared high digits
+    digits = 1
+    while 3 ** digits < 3 * max(width, height):
+        digits += 1
+    modulus = 3 ** digits
+
+    low, high, fraction = [], [], []
+    for value in origin:
+        cells = value * Fraction(3) ** level
+        whole = math.floor(cells)
+        fraction.append(float(cells - whole))
+        high.append(whole // modulus)
+        low.append(whole % modulus)
+
+    # the carpet has depth levels below the initial pixel size, finer digits are not part of it
+    skip = max(0, level - depth)
+    high_holes = [int(is_carpet_hole(high[0] + carry_x, high[1] + carry_y, skip - digits)) for carry_y in (0, 1) for carry_x in (0, 1)]
+
+    return {"low": tuple(low), "fraction": tuple(fraction), "scale": float(scale * Fraction(3) ** level), "modulus": modulus, "digits": digits, "skip": skip, "high_holes": tuple(high_holes), "level": level}
+
+def get_carpet_axis(size, low, fraction, carpet_view, float_dtype):
+    cells = float_dtype(fraction) + np.arange(size, dtype=float_dtype) * float_dtype(carpet_view["scale"])
+    coord = low + np.floor(cells).astype(np.int64)
+    carry = (coord >= carpet_view["modulus"]).astype(np.int64)
+    coord -= carry * carpet_view["modulus"]
+
+    ones = np.zeros((carpet_view["digits"], size), dtype=np.float32)
+    for digit in range(carpet_view["digits"]):
+        if digit >= carpet_view["skip"]:
+            ones[digit] = coord % 3 == 1
+        coord //= 3
+    return carry, ones
+
+def calculate_sierpinsky_carpet(width, height, carpet_view, precision="single"):
+    # the digits of a pixel only depend on its column or its row, a hole on the same level of both is a product of the two
+    float_dtype = get_dtypes(precision)[0]
+    carry_x, ones_x = get_carpet_axis(width, carpet_view["low"][0], carpet_view["fraction"][0], carpet_view, float_dtype)
+    carry_y, ones_y = get_carpet_axis(height, carpet_view["low"][1], carpet_view["fraction"][1], carpet_view, float_dtype)
+
+    holes = ones_y.T @ ones_x > 0
+    return holes | np.array(carpet_view["high_holes"], dtype=bool)[carry_x[None, :] + 2 * carry_y[:, None]]
+
+def render_sierpinsky_carpet(width, height, carpet_view, precision="single"):
+    value = np.ones((height, width, 4), dtype=np.float32)
+    value[calculate_sierpinsky_carpet(width, height, carpet_view, precision), :3] = 0.0
+    return value
@@ -0,0 +1,137 @@
+import os, json, itertools, numbers
+import numpy as np
+
+from utils.constants import ifs_fractals, user_ifs_file
+
+# Chaos game for iterated function systems: every point jumps through a randomly picked affine map each step and the pixels the points
+# land on are counted. The points start on a fixed point of a map, which is on the attractor, so no step is thrown away. The counts add
+# up across calls, a view that stays the same keeps getting sharper.
+
+def get_menger_slice_maps(digits):
+    # A cut at a height with repeating base 3 digits is self similar over one period. On a level whose height digit is 1 only the corner
+    # cells stay (two middle digits make a hole in the sponge), otherwise every cell but the middle one does.
+    levels = [[(x, y) for y in range(3) for x in range(3) if (x == 1) + (y == 1) + (digit == 1) < 2] for digit in digits]
+
+    maps = []
+    for cells in itertools.product(*levels):
+        offset = [sum(cell[axis] / 3 ** (level + 1) for level, cell in enumerate(cells)) for axis in range(2)]
+        maps.append([3 ** -len(digits), 0, 0, 3 ** -len(digits), *offset])
+    return maps
+
+def get_ifs_maps(definition):
+    if isinstance(definition, dict):
+        digits = definition.get("menger_slice")
+        if not isinstance(digits, list) or not digits or any(digit not in (0, 1, 2) for digit in digits):
+            raise ValueError("A Menger slice is {\"menger_slice\": [base 3 digits of its height]}")
+        return get_menger_slice_maps(digits)
+    return definition
+
+def is_affine_map(affine_map):
+    return isinstance(affine_map, (list, tuple)) and len(affine_map) in (6, 7) and all(isinstance(value, numbers.Real) and not isinstance(value, bool) for value in affine_map)
+
+def parse_maps(maps):
+    # (maps, 6) coefficients and the cumulative probability of picking each map
+    if not isinstance(maps, (list, tuple)) or not maps or not all(is_affine_map(affine_map) for affine_map in maps):
+        raise ValueError("An IFS is a list of maps [a, b, c, d, e, f] with an optional probability")
+
+    coefficients = np.array([affine_map[:6] for affine_map in maps], dtype=np.float64)
+    determinants = np.abs(coefficients[:, 0] * coefficients[:, 3] - coefficients[:, 1] * coefficients[:, 2])
+    # maps that flatten everything onto a line still get picked now and then
+    default_weights = np.maximum(determinants, 0.01 * determinants.max(initial=0) + 1e-3)
+    weights = np.array([affine_map[6] if len(affine_map) == 7 else default_weight for affine_map, default_weight in zip(maps, default_weights)], dtype=np.float64)
+
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError("IFS probabilities have to be positive")
+
+    return coefficients, np.cumsum(weights / weights.sum())
+
+def load_ifs_fractals(path=user_ifs_file):
+    # the presets and the ones in the user file, {"name": [[a, b, c, d, e, f], ...], ...}
+    fractals = {name: get_ifs_maps(definition) for name, definition in ifs_fractals.items()}
+
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            user_fractals = json.load(file)
+
+        # a malformed file is a ValueError like a malformed IFS, the viewer falls back to the presets on it
+        if not isinstance(user_fractals, dict):
+            raise ValueError("The IFS file is an object of {\"name\": [[a, b, c, d, e, f], ...], ...}")
+
+        for name, maps in user_fractals.items():
+            fractals[name] = get_ifs_maps(maps)
+            parse_maps(fractals[name])
+
+    return fractals
+
+def get_fixed_point(coefficients):
+    a, b, c, d, e, f = coefficients
+    return np.linalg.solve([[1 - a, -b], [-c, 1 - d]], [e, f])
+
+def fit_view(bounds, width, height, margin=0.05):
+    # the bounds with a margin, widened on one axis so pixels are square
+    x_min, x_max, y_min, y_max = bounds
+    center_x, center_y = (x_min + x_max) / 2, (y_min + y_max) / 2
+    pixel_size = max(x_max - x_min, 1e-12) / width, max(y_max - y_min, 1e-12) / height
+    pixel_size = max(pixel_size) * (1 + 2 * margin)
+    return (center_x - pixel_size * width / 2, center_x + pixel_size * width / 2, center_y - pixel_size * height / 2, center_y + pixel_size * height / 2)
+
+class ChaosGame:
+    def __init__(self, maps, width, height, view=None, batch_size=65536, seed=None):
+        self.coefficients, self.cumulative_probabilities = parse_maps(maps)
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        try:
+            start = get_fixed_point(self.coefficients[0])
+        except np.linalg.LinAlgError:
+            raise ValueError("The first map of an IFS has to be a contraction")
+
+        self.points = np.repeat(start[None, :], batch_size, axis=0)
+        for _ in self.iterate(16): # spread the batch over the attractor
+            pass
+
+        self.density = np.zeros((height, width), dtype=np.uint32)
+        self.set_view(view or fit_view(self.get_bounds(), width, height))
+
+    def get_bounds(self):
+        return (self.points[:, 0].min(), self.points[:, 0].max(), self.points[:, 1].min(), self.points[:, 1].max())
+
+    def set_view(self, view):
+        self.view = tuple(map(float, view))
+        self.pixel_size = ((self.view[1] - self.view[0]) / self.width, (self.view[3] - self.view[2]) / self.height)
+        self.density[:] = 0
+        self.total_points = 0
+
+    def iterate(self, steps):
+        a, b, c, d, e, f = self.coefficients.T
+        for _ in range(steps):
+            index = np.minimum(np.searchsorted(self.cumulative_probabilities, self.rng.random(len(self.points))), len(self.coefficients) - 1)
+            x, y = self.points[:, 0], self.points[:, 1]
+            self.points = np.stack((a[index] * x + b[index] * y + e[index], c[index] * x + d[index] * y + f[index]), axis=1)
+            yield self.points
+
+    def step(self, point_count):
+        # every step moves the whole batch, their pixels are gathered and counted with one bincount
+        pixels = []
+        for points in self.iterate(max(1, point_count // len(self.points))):
+            column = np.floor((points[:, 0] - self.view[0]) / self.pixel_size[0])
+            row = np.floor((points[:, 1] - self.view[2]) / self.pixel_size[1])
+            inside = (column >= 0) & (column < self.width) & (row >= 0) & (row < self.height)
+            pixels.append(row[inside].astype(np.int64) * self.width + column[inside].astype(np.int64))
+            self.total_points += len(points)
+
+        self.density += np.bincount(np.concatenate(pixels), minlength=self.width * self.height).reshape(self.height, self.width).astype(np.uint32)
+
+    def shade(self):
+        # log density, black where the points pile up on white like the carpet kernel
+        value = np.ones((self.height, self.width, 4), dtype=np.float32)
+        peak = self.density.max()
+        if peak > 0:
+            value[..., :3] -= (np.log1p(self.density.astype(np.float32)) / np.float32(np.log1p(peak)))[..., None]
+        return value
+
+def render_ifs(maps, width, height, point_count, view=None, seed=None):
+    chaos_game = ChaosGame(maps, width, height, view, seed=seed)
+    chaos_game.step(point_count)
+    return chaos_game.shade()
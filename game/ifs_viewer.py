@@ -0,0 +1,141 @@
+import arcade, arcade.gui, pyglet, json, logging
+
+from game.ifs import ChaosGame, load_ifs_fractals
+from game.shader import upload_texture
+from game.profiler import trace, format_timings
+from utils.constants import button_style, dropdown_style, ifs_upload_interval
+from utils.preload import button_texture, button_hovered_texture, cursor_texture
+
+class IFSViewer(arcade.gui.UIView):
+    def __init__(self, pypresence_client):
+        super().__init__()
+
+        self.pypresence_client = pypresence_client
+
+        with open("settings.json", "r") as file:
+            self.settings_dict = json.load(file)
+
+        self.points_per_frame = int(self.settings_dict.get("ifs_points_per_frame", 200000))
+        self.max_points = int(self.settings_dict.get("ifs_max_points", 100)) * 1000000
+        self.zoom = 1.0
+        self.time_since_upload = 0
+        self.has_controller = False
+
+        try:
+            self.fractals = load_ifs_fractals()
+        except (ValueError, OSError, json.JSONDecodeError):
+            logging.exception("Loading the user IFS file failed, only the presets are available.")
+            self.fractals = load_ifs_fractals(path="")
+
+        self.fractal_name = next(iter(self.fractals))
+
+    def on_show_view(self):
+        super().on_show_view()
+
+        self.density_image = pyglet.image.Texture.create(self.window.width, self.window.height, internalformat=pyglet.gl.GL_RGBA32F)
+        self.density_sprite = pyglet.sprite.Sprite(img=self.density_image)
+
+        self.setup_ui()
+
+        self.select_fractal(self.fractal_name)
+
+        if self.window.get_controllers():
+            self.sprite_list = arcade.SpriteList()
+            self.cursor_sprite = arcade.Sprite(cursor_texture)
+            self.sprite_list.append(self.cursor_sprite)
+            self.has_controller = True
+
+    def setup_ui(self):
+        self.anchor = self.add_widget(arcade.gui.UIAnchorLayout(size_hint=(1, 1)))
+
+        self.info_box = self.anchor.add(arcade.gui.UIBoxLayout(space_between=10, vertical=False), anchor_x="center", anchor_y="top")
+        self.fractal_dropdown = self.info_box.add(arcade.gui.UIDropdown(options=list(self.fractals), default=self.fractal_name, width=250, height=40, primary_style=dropdown_style, active_style=dropdown_style, dropdown_style=dropdown_style))
+        self.fractal_dropdown.on_change = lambda event: self.select_fractal(event.new_value)
+        self.zoom_label = self.info_box.add(arcade.gui.UILabel(text=f"Zoom: {self.zoom}", font_name="Roboto", font_size=16))
+        self.points_label = self.info_box.add(arcade.gui.UILabel(text="Points: 0", font_name="Roboto", font_size=16))
+
+        self.timings_label = self.anchor.add(arcade.gui.UILabel(text="", font_name="Roboto", font_size=12, width=400, height=300, multiline=True), anchor_x="left", anchor_y="bottom", align_x=5, align_y=5)
+        self.timings_label.visible = False
+
+        self.back_button = arcade.gui.UITextureButton(texture=button_texture, texture_hovered=button_hovered_texture, text='<--', style=button_style, width=100, height=50)
+        self.back_button.on_click = lambda event: self.main_exit()
+        self.anchor.add(self.back_button, anchor_x="left", anchor_y="top", align_x=5, align_y=-5)
+
+    def select_fractal(self, fractal_name):
+        self.fractal_name = fractal_name
+        self.chaos_game = ChaosGame(self.fractals[fractal_name], self.density_image.width, self.density_image.height)
+        self.zoom = 1.0
+        self.zoom_label.text = f"Zoom: {self.zoom}"
+        self.time_since_upload = ifs_upload_interval
+
+        self.pypresence_client.update(state=f'Viewing {fractal_name}', details=f'Zoom: {self.zoom}', start=self.pypresence_client.start_time)
+
+    def accumulate(self, delta_time):
+        # the counts keep adding up while the view stays, every frame only adds points_per_frame more
+        with trace("chaos_game"):
+            self.chaos_game.step(self.points_per_frame)
+
+        self.points_label.text = f"Points: {self.chaos_game.total_points / 1e6:.1f}M"
+
+        # the density is shown a few times a second, right away for a new view and once more when the last points are in
+        self.time_since_upload += delta_time
+        if self.time_since_upload >= ifs_upload_interval or self.chaos_game.total_points >= self.max_points:
+            with trace("upload"):
+                upload_texture(self.density_image, self.chaos_game.shade(), pyglet.gl.GL_RGBA)
+            self.time_since_upload = 0
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == arcade.key.F3:
+            self.timings_label.visible = not self.timings_label.visible
+
+    def on_update(self, delta_time):
+        if self.chaos_game.total_points < self.max_points:
+            self.accumulate(delta_time)
+
+        if self.timings_label.visible:
+            self.timings_label.text = format_timings()
+
+    def on_mouse_press(self, x: int, y: int, button: int, modifiers: int) -> bool | None:
+        if button == arcade.MOUSE_BUTTON_LEFT:
+            zoom = self.settings_dict.get("ifs_zoom_increase", 2)
+        elif button == arcade.MOUSE_BUTTON_RIGHT:
+            zoom = 1 / self.settings_dict.get("ifs_zoom_increase", 2)
+        else:
+            return
+
+        # the point under the cursor stays where it is, the counts of the old view do not fit the new one
+        x_min, x_max, y_min, y_max = self.chaos_game.view
+        point_x = x_min + (x_max - x_min) * x / self.density_image.width
+        point_y = y_min + (y_max - y_min) * y / self.density_image.height
+        self.chaos_game.set_view((point_x - (point_x - x_min) / zoom, point_x + (x_max - point_x) / zoom, point_y - (point_y - y_min) / zoom, point_y + (y_max - point_y) / zoom))
+
+        self.zoom *= zoom
+        self.zoom_label.text = f"Zoom: {self.zoom:.4g}"
+        self.time_since_upload = ifs_upload_interval
+
+        self.pypresence_client.update(state=f'Viewing {self.fractal_name}', details=f'Zoom: {self.zoom:.4g}', start=self.pypresence_client.start_time)
+
+    def on_button_press(self, controller, name):
+        if name == "a":
+            self.on_mouse_press(self.cursor_sprite.left, self.cursor_sprite.bottom, arcade.MOUSE_BUTTON_LEFT, 0)
+        elif name == "start":
+            self.main_exit()
+
+    def on_stick_motion(self, controller, name, vector):
+        if name == "leftstick":
+            self.cursor_sprite.center_x += vector.x * 5
+            self.cursor_sprite.center_y += vector.y * 5
+
+    def main_exit(self):
+        from menus.main import Main
+        self.window.show_view(Main(self.pypresence_client))
+
+    def on_draw(self):
+        with trace("draw"):
+            self.window.clear()
+            self.density_sprite.draw()
+
+        with trace("ui_draw"):
+            self.ui.draw()
+        if self.has_controller:
+            self.sprite_list.draw()
@@ -1,9 +1,18 @@
-import arcade, arcade.gui, pyglet, json
-
-from mpmath import mpc
-
-from game.shader import create_iter_calc_shader
-from utils.constants import button_style, initial_real_imag
+import arcade, arcade.gui, pyglet, json, logging, time, os
+import numpy as np
+
+from mpmath import mpc, mpf
+from PIL import Image
+
+from game.shader import create_iter_calc_shader, parse_workgroup_size, get_workgroup_count, measure_dispatch_time, update_preturbation_reference, set_view_uniforms, create_coloring_program, create_palette_texture, get_default_palette, palettes, dispatch_subdivided, dispatch_antialiasing, get_required_bits, get_precision_ladder, select_precision, is_exact_enough, precision_bits, float_float_powers, CPUIterCalcProgram
+from game.antialiasing import antialias_iters, average_colors, format_report
+from game.preturbation import supports_preturbation
+from game.shader_cache import release_program
+from game.iteration_limit import get_auto_max_iter, adjust_iter_scale, format_histogram
+from game.readback import AsyncReadback
+from game.profiler import trace, trace_gpu, poll_timer_queries, format_timings
+from game.zoom_video import get_reprojection
+from utils.constants import button_style, initial_real_imag, workgroup_sizes, progressive_render_scales, periodicity_check_fractals, refinement_start_iter, screenshot_dir, zoom_snap_tolerance
 from utils.preload import button_texture, button_hovered_texture, cursor_texture
 
 class IterFractalViewer(arcade.gui.UIView):
@@ -19,17 +28,61 @@ class IterFractalViewer(arcade.gui.UIView):
         self.escape_radius = int(
             self.settings_dict.get(f"{self.fractal_name}_escape_radius", 2)
         )
-        self.real_min, self.real_max, self.imag_min, self.imag_max = (
-            initial_real_imag[fractal_name]
-            if fractal_name != "julia"
-            else (
-                -self.escape_radius,
-                self.escape_radius,
-                -self.escape_radius,
-                self.escape_radius,
-            )
+        self.real_min, self.real_max, self.imag_min, self.imag_max = map(
+            mpf,
+            (
+                initial_real_imag[fractal_name]
+                if fractal_name != "julia"
+                else (
+                    -self.escape_radius,
+                    self.escape_radius,
+                    -self.escape_radius,
+                    self.escape_radius,
+                )
+            ),
         )
         self.max_iter = self.settings_dict.get(f"{self.fractal_name}_max_iter", 200)
+        # Automatic max_iter: the slider value holds for the initial view, see create_image and update_iter_scale.
+        # Newton fractal pixels converge to a root instead of escaping, their counts say nothing about the limit.
+        self.auto_max_iter = self.settings_dict.get("auto_max_iter", True) and fractal_name != "newton_fractal"
+        self.base_max_iter = self.max_iter
+        self.iter_scale = 1.0
+        self.workgroup_size = parse_workgroup_size(
+            self.settings_dict.get(f"{self.fractal_name}_workgroup_size", "8x8")
+        )
+        self.multi_n = int(self.settings_dict.get(f"{self.fractal_name}_n", 2))
+        self.preturbation_setting = self.settings_dict.get(
+            f"{self.fractal_name}_preturbation", False
+        ) and supports_preturbation(self.fractal_name, self.multi_n)
+        self.use_preturbation = self.preturbation_setting
+        # Auto switches kernels as the view gets deeper, see update_precision
+        precision = self.settings_dict.get(f"{self.fractal_name}_precision", "Auto")
+        self.auto_precision = precision == "Auto"
+        self.precision = "single" if self.auto_precision else precision.lower()
+        self.prefer_float_float = None
+        self.series_approximation = self.settings_dict.get(
+            f"{self.fractal_name}_series_approximation", True
+        )
+        self.preturbation_buffers = []
+        self.progressive_rendering = self.settings_dict.get("progressive_rendering", True)
+        self.subdivision = self.settings_dict.get("render_strategy", "Per Pixel") == "Subdivision"
+        self.smooth_coloring = self.settings_dict.get("smooth_coloring", False)
+        antialiasing = self.settings_dict.get("adaptive_antialiasing", "Off")
+        self.antialiasing_samples = 0 if antialiasing == "Off" else int(antialiasing.rstrip("x"))
+        self.antialiased = None
+        # Iteration refinement: the limit the current frame is iterated to so far, see refine_iterations
+        self.iteration_refinement = self.settings_dict.get("iteration_refinement", True)
+        self.refinement_time_budget = self.settings_dict.get("refinement_time_budget", 10)
+        self.iter_limit = self.max_iter
+        self.refining = False
+        self.refinement_time = 0.0
+        self.render_passes = []
+        self.previous_render_scale = 0
+        self.pixel_reuse = self.settings_dict.get("pixel_reuse", True)
+        self.rendered_view = None
+        self.rendered_max_iter = 0
+        self.readback = None
+        self.palette = get_default_palette(fractal_name)
         self.zoom = 1.0
         self.zoom_start_position = ()
         self.zoom_rect = None
@@ -38,25 +91,38 @@ class IterFractalViewer(arcade.gui.UIView):
         self.center_real = self.real_min + 0.5 * (self.real_max - self.real_min)
         self.center_imag = self.imag_min + 0.5 * (self.imag_max - self.imag_min)
 
-    def on_show_view(self):
-        super().on_show_view()
-
-        self.shader_program, self.fractal_image = create_iter_calc_shader(
+    def create_shader(self, workgroup_size, precision=None, use_preturbation=None):
+        return create_iter_calc_shader(
             self.fractal_name,
             self.window.width,
             self.window.height,
-            self.settings_dict.get(f"{self.fractal_name}_precision", "Single").lower(),
-            int(
-                self.settings_dict.get(f"{self.fractal_name}_n", 2)
-            ),  # This will work for non-exponentiable fractals as well because they dont have an _n property
+            precision or self.precision,
+            self.multi_n,  # This will work for non-exponentiable fractals as well because they dont have an _n property
             int(self.settings_dict.get(f"{self.fractal_name}_escape_radius", 2)),
             self.settings_dict.get("julia_type", "Classic swirling"),
-            False,
-            mpc(self.real_min, self.imag_min),
-            int(self.max_iter),
+            self.use_preturbation if use_preturbation is None else use_preturbation,
+            workgroup_size,
+            self.settings_dict.get("render_backend", "Auto").lower(),
+            int(self.settings_dict.get("cpu_workers", 0)),
+            self.settings_dict.get("shader_binary_cache", True),
+            self.settings_dict.get(f"{self.fractal_name}_periodicity_checking", self.fractal_name in periodicity_check_fractals),
+            self.smooth_coloring,
         )
 
-        self.fractal_sprite = pyglet.sprite.Sprite(img=self.fractal_image)
+    def on_show_view(self):
+        super().on_show_view()
+
+        self.shader_program, self.iteration_buffers = self.create_shader(self.workgroup_size)
+
+        self.palette_texture = create_palette_texture(self.palette)
+        self.coloring_program = create_coloring_program(
+            self.fractal_name, self.max_iter, self.smooth_coloring
+        )
+        self.fractal_sprite = pyglet.sprite.Sprite(
+            img=self.iteration_buffers.images[0], program=self.coloring_program
+        )
+
+        self.setup_ui()
 
         self.create_image()
 
@@ -66,7 +132,19 @@ class IterFractalViewer(arcade.gui.UIView):
             start=self.pypresence_client.start_time,
         )
 
-        self.setup_ui()
+    def on_hide_view(self):
+        super().on_hide_view()
+
+        release_program(self.shader_program)
+        self.preturbation_buffers = []
+        self.render_passes = []
+
+        if self.readback:
+            self.save_screenshots(wait=True)
+            self.readback.delete()
+            self.readback = None
+
+        self.iteration_buffers.delete()
 
     def main_exit(self):
         from menus.main import Main
@@ -93,6 +171,38 @@ class IterFractalViewer(arcade.gui.UIView):
                 font_size=16,
             )
         )
+        self.reuse_label = self.info_box.add(
+            arcade.gui.UILabel(text="Reused: 0%", font_name="Roboto", font_size=16)
+        )
+        self.precision_label = self.info_box.add(
+            arcade.gui.UILabel(
+                text=self.get_precision_text(True), font_name="Roboto", font_size=16
+            )
+        )
+        self.workgroup_label = self.info_box.add(
+            arcade.gui.UILabel(
+                text=f"Workgroup: {self.workgroup_size[0]}x{self.workgroup_size[1]}",
+                font_name="Roboto",
+                font_size=16,
+            )
+        )
+
+        # F3, the latest time of every traced section, GPU times arrive a few frames late
+        self.timings_label = self.anchor.add(
+            arcade.gui.UILabel(
+                text="",
+                font_name="Roboto",
+                font_size=12,
+                width=400,
+                height=300,
+                multiline=True,
+            ),
+            anchor_x="left",
+            anchor_y="bottom",
+            align_x=5,
+            align_y=5,
+        )
+        self.timings_label.visible = False
 
         self.back_button = arcade.gui.UITextureButton(
             texture=button_texture,
@@ -144,36 +254,432 @@ class IterFractalViewer(arcade.gui.UIView):
                     None,
                 )
 
-    def create_image(self):
-        with self.shader_program:
-            self.shader_program["u_maxIter"] = int(self.max_iter)
-            self.shader_program["u_resolution"] = (
+    def set_uniforms(self, shader_program):
+        with shader_program:
+            shader_program["u_maxIter"] = int(self.max_iter)
+            shader_program["u_pass_scale"] = 1
+            shader_program["u_previous_scale"] = 0
+            shader_program["u_reuse"] = False
+            shader_program["u_iter_limit"] = 0
+            shader_program["u_continue"] = False
+            shader_program["u_resolution"] = (
                 self.window.width,
                 self.window.height,
             )
-            self.shader_program["u_real_range"] = (self.real_min, self.real_max)
-            self.shader_program["u_imag_range"] = (self.imag_min, self.imag_max)
-            # TODO: fix preturbation
-            # self.shader_program["u_center"] = (self.center_real, self.center_imag)
-            # self.shader_program["usepreturbation"] = False
+            set_view_uniforms(shader_program, self.real_min, self.real_max, self.imag_min, self.imag_max)
+
+    def update_preturbation_reference(self, shader_program):
+        # The reference orbit sits at the exact center of the view, the shader only sees offsets from it.
+        self.preturbation_buffers = update_preturbation_reference(
+            shader_program,
+            self.fractal_name,
+            mpc(
+                (self.real_min + self.real_max) / 2,
+                (self.imag_min + self.imag_max) / 2,
+            ),
+            (self.real_max - self.real_min, self.imag_max - self.imag_min),
+            int(self.max_iter),
+            self.multi_n,
+            self.settings_dict.get("julia_type", "Classic swirling"),
+            self.escape_radius,
+            self.series_approximation,
+            int(self.settings_dict.get("orbit_cache_size", 256)) * 1024 * 1024,
+        )
+
+    def get_precision_text(self, exact_enough):
+        text = f"Precision: {'Perturbation' if self.use_preturbation else self.precision.title()}"
+        return text if exact_enough else f"{text} (too low)"
+
+    def compare_double_kernels(self):
+        # Emulated doubles beat real ones where fp64 is slow, measured once on the first view that needs either of them.
+        if isinstance(self.shader_program, CPUIterCalcProgram):
+            return False # NumPy has real doubles
+
+        # both without perturbation, which would need a reference orbit, the kernels are only compared on plain coordinates
+        frame_times = {}
+        for precision in ("double", "float-float"):
+            shader_program, iteration_buffers = self.create_shader(self.workgroup_size, precision, use_preturbation=False)
+            self.set_uniforms(shader_program)
+            frame_times[precision] = measure_dispatch_time(
+                shader_program,
+                get_workgroup_count(
+                    iteration_buffers.width, iteration_buffers.height, self.workgroup_size
+                ),
+                repeats=1,
+            )
+            release_program(shader_program)
+            iteration_buffers.delete()
+
+        self.iteration_buffers.bind()
+
+        logging.info(
+            f"{self.fractal_name} double precision: {frame_times['double'] * 1000:.2f} ms, float-float: {frame_times['float-float'] * 1000:.2f} ms"
+        )
+        return frame_times["float-float"] < frame_times["double"]
+
+    def update_precision(self):
+        # The cheapest kernel that still tells the pixels of the new view apart, so shallow views keep the fast one.
+        required_bits = get_required_bits(
+            self.real_min, self.real_max, self.imag_min, self.imag_max, self.window.width
+        )
+
+        if self.auto_precision:
+            precision, use_preturbation = select_precision(
+                get_precision_ladder(self.fractal_name, self.multi_n, bool(self.prefer_float_float)),
+                required_bits,
+            )
+
+            # Deep Zoom renders with perturbation whatever the ladder picks, float-float never comes into it
+            if (
+                self.prefer_float_float is None
+                and not self.preturbation_setting
+                and (precision, use_preturbation) == ("double", False)
+                and self.fractal_name in float_float_powers
+                and is_exact_enough("float-float", False, required_bits)
+            ):
+                self.prefer_float_float = self.compare_double_kernels()
+                if self.prefer_float_float:
+                    precision = "float-float"
+
+            use_preturbation = use_preturbation or self.preturbation_setting
+
+            if (precision, use_preturbation) != (self.precision, self.use_preturbation):
+                logging.info(
+                    f"{self.fractal_name}: {required_bits:.0f} bits to resolve a pixel, switching from {self.precision}{' perturbation' if self.use_preturbation else ''} to {precision}{' perturbation' if use_preturbation else ''}"
+                )
+                release_program(self.shader_program)
+                self.iteration_buffers.delete()
+                self.precision, self.use_preturbation = precision, use_preturbation
+                self.shader_program, self.iteration_buffers = self.create_shader(self.workgroup_size)
+                self.fractal_sprite.image = self.iteration_buffers.images[0]
+
+                # the new buffers hold nothing to reproject from
+                self.rendered_view = None
+                self.preturbation_buffers = []
+
+        exact_enough = is_exact_enough(self.precision, self.use_preturbation, required_bits)
+        if not exact_enough and self.precision_label.text != self.get_precision_text(False):
+            logging.warning(
+                f"{self.fractal_name}: {required_bits:.0f} bits to resolve a pixel, {self.precision} precision has {precision_bits[self.precision]}, the image turns blocky"
+            )
+        self.precision_label.text = self.get_precision_text(exact_enough)
+
+    def supports_refinement(self):
+        # Only the single and double precision escape time kernel keeps per pixel state, Mariani-Silver would fill tiles whose
+        # border has merely not escaped yet.
+        return (
+            self.iteration_refinement
+            and not isinstance(self.shader_program, CPUIterCalcProgram)
+            and self.precision in ("single", "double")
+            and not self.use_preturbation
+            and not self.subdivision
+            and self.fractal_name not in ("phoenix_fractal", "newton_fractal")
+            and self.max_iter > refinement_start_iter
+        )
+
+    def update_max_iter(self):
+        max_iter = get_auto_max_iter(self.base_max_iter, self.zoom, self.iter_scale)
+        if max_iter != self.max_iter:
+            self.max_iter = max_iter
+            with self.coloring_program:
+                self.coloring_program["u_maxIter"] = self.max_iter
+
+    def update_iter_scale(self):
+        # A finished frame whose late escapes are many gets a higher limit next time, one where hardly any pixel escapes late a lower one.
+        histogram, capped = self.iteration_buffers.read_escape_histogram(self.shader_program, self.iter_limit, self.workgroup_size)
+        self.iter_scale = adjust_iter_scale(self.iter_scale, histogram, histogram.sum() + capped)
+        logging.debug(f"{self.fractal_name} frame: {format_histogram(histogram, capped, self.iter_limit)}")
+
+    def create_image(self):
+        with trace("create_image"):
+            if self.auto_max_iter:
+                self.update_max_iter()
+
+            self.update_precision()
+            self.set_uniforms(self.shader_program)
+
+            if self.use_preturbation:
+                self.update_preturbation_reference(self.shader_program)
+
+            self.refining = self.supports_refinement()
+            self.refinement_time = 0.0
+            self.iter_limit = min(refinement_start_iter, self.max_iter) if self.refining else self.max_iter
+            if self.refining:
+                self.iteration_buffers.reset_pixel_states(self.precision)
+                with self.shader_program:
+                    self.shader_program["u_iter_limit"] = self.iter_limit
+            self.max_iter_label.text = self.get_max_iter_text()
+
+            self.set_reprojection_uniforms(self.shader_program)
+
+            # the antialiased colors belong to the previous view
+            self.antialiased = None
+            with self.coloring_program:
+                self.coloring_program["u_antialiased"] = False
+
+        # A new view drops whatever passes of the previous one were still queued.
+        # Subdivision renders in one go, its early stages only hold tile borders.
+        self.render_passes = (
+            list(progressive_render_scales)
+            if self.progressive_rendering and not self.subdivision
+            else [1]
+        )
+        self.previous_render_scale = 0
+
+        self.render_next_pass()
+
+    def get_view(self):
+        return (
+            self.real_min,
+            self.imag_min,
+            self.real_max - self.real_min,
+            self.imag_max - self.imag_min,
+        )
+
+    def set_reprojection_uniforms(self, shader_program):
+        # Only a finished frame has exact iteration counts everywhere, an interrupted one still holds coarse blocks.
+        reprojection = None
+        if self.pixel_reuse and self.rendered_view is not None and not self.render_passes:
+            # None for a zoom that is no whole factor or a view off the pixel grid, no sample would land on a previous pixel
+            reprojection = get_reprojection(
+                self.get_view(), self.rendered_view, self.window.width, self.window.height
+            )
+
+        self.iteration_buffers.swap()
+        self.fractal_sprite.image = self.iteration_buffers.images[0]
+
+        with shader_program:
+            shader_program["u_reuse"] = reprojection is not None
+
+            if reprojection:
+                shader_program["u_previous_max_iter"] = int(self.rendered_max_iter)
+                # where pixel (0, 0) of this view and one pixel step of it fall in previous frame pixels
+                shader_program["u_previous_origin"], shader_program["u_previous_step"] = reprojection
+
+    def finish_frame(self):
+        reused, computed = self.iteration_buffers.read_stats(self.shader_program)
+        saved = reused / max(reused + computed, 1)
+
+        logging.debug(
+            f"{self.fractal_name} frame: {reused} samples reprojected, {computed} computed ({saved * 100:.1f}% of the work saved)"
+            + (f", {self.iteration_buffers.width * self.iteration_buffers.height - reused - computed} filled by subdivision" if self.subdivision else "")
+        )
+        self.reuse_label.text = f"Reused: {saved * 100:.0f}%"
+        self.rendered_view = self.get_view()
+        # the limit the pixels that had not escaped were iterated to, they are only reused under a limit no higher
+        self.rendered_max_iter = self.iter_limit
+
+        # with refinement the edges and the escape counts only settle once it is done
+        if not self.refining:
+            self.finish_refinement()
+
+    def finish_refinement(self):
+        if self.auto_max_iter:
+            self.update_iter_scale()
+
+        if self.antialiasing_samples:
+            self.antialias()
+
+    def get_max_iter_text(self):
+        auto_text = " (auto)" if self.auto_max_iter else ""
+        if self.iter_limit < self.max_iter:
+            return f"Max Iterations: {self.iter_limit}/{self.max_iter}{auto_text}"
+        return f"Max Iterations: {self.max_iter}{auto_text}"
+
+    def refine_iterations(self):
+        # Carries the pixels that had not escaped at the current limit on to twice the limit, from the z they stopped at, so no
+        # iteration is done twice. Stops at max_iter, when no pixel is left or when the view used up its time budget.
+        iter_limit = min(self.iter_limit * 2, self.max_iter)
+        self.iteration_buffers.reset_stats()
+
+        start = time.perf_counter()
+        with trace("refine", iter_limit=iter_limit), trace_gpu("refine"), self.shader_program:
+            self.shader_program["u_iter_limit"] = iter_limit
+            self.shader_program["u_continue"] = True
             self.shader_program.dispatch(
-                self.fractal_image.width,
-                self.fractal_image.height,
+                *get_workgroup_count(
+                    self.iteration_buffers.width, self.iteration_buffers.height, self.workgroup_size
+                ),
                 1,
                 barrier=pyglet.gl.GL_ALL_BARRIER_BITS,
             )
+            self.shader_program["u_continue"] = False
 
-    def on_key_press(self, symbol, modifiers):
-        if symbol == arcade.key.ESCAPE:
-            self.real_min, self.real_max, self.imag_min, self.imag_max = (
-                initial_real_imag[self.fractal_name]
-                if self.fractal_name != "julia"
-                else (
-                    -self.escape_radius,
-                    self.escape_radius,
-                    -self.escape_radius,
-                    self.escape_radius,
+        pending = self.iteration_buffers.read_stats(self.shader_program)[1]
+        self.refinement_time += time.perf_counter() - start
+        self.iter_limit = self.max_iter if pending == 0 else iter_limit
+        self.rendered_max_iter = self.iter_limit
+
+        if self.iter_limit >= self.max_iter or self.refinement_time > self.refinement_time_budget:
+            logging.debug(
+                f"{self.fractal_name} refinement: stopped at {self.iter_limit} of {self.max_iter} iterations after {self.refinement_time:.2f}s, {pending} pixels iterated in the last step"
+            )
+            self.refining = False
+            self.finish_refinement()
+
+        self.max_iter_label.text = self.get_max_iter_text()
+
+    def antialias(self):
+        # Supersamples the edges of the finished frame, the other pixels keep their single sample.
+        with trace("antialias"):
+            pixels, samples, report = antialias_iters(
+                self.fractal_name,
+                self.iteration_buffers.read_iters(),
+                lambda x, y: dispatch_antialiasing(
+                    self.shader_program, self.iteration_buffers, x, y, self.workgroup_size
+                ),
+                self.antialiasing_samples,
+                self.max_iter,
+            )
+
+        logging.debug(f"{self.fractal_name} frame: {format_report(report)}")
+        self.antialiased = (pixels, samples)
+        self.upload_antialiased()
+
+    def upload_antialiased(self):
+        # The samples are kept, a new palette only averages their colors again.
+        pixels, samples = self.antialiased
+        self.iteration_buffers.upload_antialiased(
+            pixels, average_colors(self.fractal_name, samples, self.max_iter, self.palette)
+        )
+
+        with self.coloring_program:
+            self.coloring_program["u_antialiased"] = True
+
+    def render_next_pass(self):
+        scale = self.render_passes.pop(0)
+
+        with trace("dispatch", scale=scale), trace_gpu("dispatch", scale=scale), self.shader_program:
+            self.shader_program["u_pass_scale"] = scale
+            self.shader_program["u_previous_scale"] = self.previous_render_scale
+
+            if self.subdivision:
+                dispatch_subdivided(
+                    self.shader_program,
+                    self.iteration_buffers.width,
+                    self.iteration_buffers.height,
+                    self.workgroup_size,
+                )
+            else:
+                self.shader_program.dispatch(
+                    *get_workgroup_count(
+                        -(-self.iteration_buffers.width // scale),
+                        -(-self.iteration_buffers.height // scale),
+                        self.workgroup_size,
+                    ),
+                    1,
+                    barrier=pyglet.gl.GL_ALL_BARRIER_BITS,
                 )
+
+        self.previous_render_scale = scale
+
+        if not self.render_passes:
+            self.finish_frame()
+
+    def take_screenshot(self):
+        # The frame as it is drawn, saved once the GPU has copied it, see save_screenshots
+        if self.readback is None:
+            self.readback = AsyncReadback(
+                self.iteration_buffers.width, self.iteration_buffers.height, self.workgroup_size
+            )
+
+        self.readback.submit(
+            os.path.join(screenshot_dir, f"{self.fractal_name}_{time.strftime('%Y-%m-%d_%H-%M-%S')}.png"),
+            self.iteration_buffers.images[0],
+            self.palette_texture,
+            self.fractal_name,
+            self.max_iter,
+            self.smooth_coloring,
+            self.iteration_buffers.antialiased_image if self.antialiased else None,
+        )
+
+    def save_screenshots(self, wait=False):
+        for path, pixels in self.readback.collect(wait):
+            os.makedirs(screenshot_dir, exist_ok=True)
+            Image.fromarray(np.flipud(pixels)).save(path)
+            logging.info(f"Saved a screenshot to {path}")
+
+    def on_update(self, delta_time):
+        if self.render_passes:
+            self.render_next_pass()
+        elif self.refining:
+            self.refine_iterations()
+
+        if self.readback:
+            self.save_screenshots()
+
+        poll_timer_queries()
+
+        if self.timings_label.visible:
+            self.timings_label.text = format_timings()
+
+    def compare_workgroup_sizes(self):
+        frame_times = {}
+
+        for workgroup_size in workgroup_sizes:
+            shader_program, iteration_buffers = self.create_shader(workgroup_size)
+            self.set_uniforms(shader_program)
+
+            if self.use_preturbation:
+                self.update_preturbation_reference(shader_program)
+
+            frame_times[workgroup_size] = measure_dispatch_time(
+                shader_program,
+                get_workgroup_count(
+                    iteration_buffers.width, iteration_buffers.height, workgroup_size
+                ),
+            )
+
+            logging.info(
+                f"{self.fractal_name} {self.window.width}x{self.window.height} workgroup {workgroup_size}: {frame_times[workgroup_size] * 1000:.2f} ms"
+            )
+
+            release_program(shader_program)
+            iteration_buffers.delete()
+
+        # Every candidate bound its own buffers to the shared image units, take them back.
+        self.iteration_buffers.bind()
+
+        best_workgroup_size = min(frame_times, key=frame_times.get)
+        self.workgroup_label.text = f"Workgroup: {self.workgroup_size[0]}x{self.workgroup_size[1]} (best: {best_workgroup_size}, {frame_times[best_workgroup_size] * 1000:.2f} ms)"
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == arcade.key.T:
+            self.compare_workgroup_sizes()
+
+        elif symbol == arcade.key.F3:
+            self.timings_label.visible = not self.timings_label.visible
+
+        elif symbol == arcade.key.F12:
+            self.take_screenshot()
+
+        elif symbol == arcade.key.P:
+            # Only the lookup table changes, the iteration buffer is drawn with it as is.
+            names = list(palettes)
+            self.palette = names[(names.index(self.palette) + 1) % len(names)]
+            self.palette_texture = create_palette_texture(self.palette)
+
+            if self.antialiased:
+                self.upload_antialiased()
+
+        elif symbol in (arcade.key.LEFT, arcade.key.RIGHT, arcade.key.UP, arcade.key.DOWN):
+            pan_x = {arcade.key.LEFT: -1, arcade.key.RIGHT: 1}.get(symbol, 0)
+            pan_y = {arcade.key.DOWN: -1, arcade.key.UP: 1}.get(symbol, 0)
+            self.pan(pan_x * (self.window.width // 8), pan_y * (self.window.height // 8))
+
+        elif symbol == arcade.key.ESCAPE:
+            self.real_min, self.real_max, self.imag_min, self.imag_max = map(
+                mpf,
+                (
+                    initial_real_imag[self.fractal_name]
+                    if self.fractal_name != "julia"
+                    else (
+                        -self.escape_radius,
+                        self.escape_radius,
+                        -self.escape_radius,
+                        self.escape_radius,
+                    )
+                ),
             )
 
             self.zoom = 1
@@ -221,6 +727,18 @@ class IterFractalViewer(arcade.gui.UIView):
             left=left, right=right, top=top, bottom=bottom
         )
 
+    def pan(self, pixels_x, pixels_y):
+        # Whole pixel steps, so everything still on screen is reprojected instead of recomputed.
+        real_step = (self.real_max - self.real_min) / self.window.width * pixels_x
+        imag_step = (self.imag_max - self.imag_min) / self.window.height * pixels_y
+
+        self.real_min += real_step
+        self.real_max += real_step
+        self.imag_min += imag_step
+        self.imag_max += imag_step
+
+        self.create_image()
+
     def on_mouse_release(self, x, y, button, modifiers):
         if self.zoom_start_position and self.zoom_rect:
             rect = self.zoom_rect
@@ -228,6 +746,30 @@ class IterFractalViewer(arcade.gui.UIView):
             center_x = (rect.left + rect.right) / 2
             center_y = (rect.bottom + rect.top) / 2
 
+            factors = (
+                self.width / max(rect.right - rect.left, 1),
+                self.height / max(rect.top - rect.bottom, 1),
+            )
+            factor = round(factors[0])
+            if (
+                self.pixel_reuse
+                and factor > 1
+                and all(abs(value - factor) <= zoom_snap_tolerance * factor for value in factors)
+            ):
+                # A whole zoom factor on a pixel aligned view puts every factor-th new pixel on an old one.
+                # Only a rect that is nearly one already is snapped, any other is zoomed to as drawn and recomputed.
+                left = round(center_x - self.width / (2 * factor))
+                bottom = round(center_y - self.height / (2 * factor))
+                rect = arcade.rect.LRBT(
+                    left=left,
+                    right=left + self.width / factor,
+                    bottom=bottom,
+                    top=bottom + self.height / factor,
+                )
+
+                center_x = (rect.left + rect.right) / 2
+                center_y = (rect.bottom + rect.top) / 2
+
             self.center_real = self.real_min + (center_x / self.width) * (
                 self.real_max - self.real_min
             )
@@ -252,9 +794,9 @@ class IterFractalViewer(arcade.gui.UIView):
                 - initial_real_imag[self.fractal_name][0]
             )
             new_real_range = self.real_max - self.real_min
-            self.zoom = initial_real_range / new_real_range
+            self.zoom = float(initial_real_range / new_real_range)
 
-            self.zoom_label.text = f"Zoom: {self.zoom:.4f}"
+            self.zoom_label.text = f"Zoom: {self.zoom:.4g}"
 
             self.zoom_start_position = None
             self.zoom_rect = None
@@ -263,14 +805,20 @@ class IterFractalViewer(arcade.gui.UIView):
 
             self.pypresence_client.update(
                 state=f"Viewing {self.fractal_name.replace('_', ' ').capitalize()}",
-                details=f"Zoom: {self.zoom:.4f}\nMax Iterations: {self.max_iter}",
+                details=f"Zoom: {self.zoom:.4g}\nMax Iterations: {self.max_iter}",
                 start=self.pypresence_client.start_time,
             )
 
     def on_draw(self):
-        self.window.clear()
-        self.fractal_sprite.draw()
-        self.ui.draw()
+        with trace("draw"):
+            self.window.clear()
+            self.palette_texture.bind(texture_unit=1)
+            if self.antialiased:
+                self.iteration_buffers.antialiased_image.bind(texture_unit=2)
+            self.fractal_sprite.draw()
+
+        with trace("ui_draw"):
+            self.ui.draw()
 
         if self.has_controller:
             self.sprite_list.draw()
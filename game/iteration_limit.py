@@ -0,0 +1,38 @@
+import math
+import numpy as np
+
+from game.cpu_engine import get_counts
+from utils.constants import auto_max_iter_growth, auto_max_iter_bins, auto_max_iter_raise_fraction, auto_max_iter_lower_fraction, auto_max_iter_scale_range, auto_max_iter_range
+
+# Automatic max_iter: the slider value is the limit of the initial view, deeper views get more in proportion to the zoom depth, and the
+# escape counts of every finished frame scale that up or down for the next one.
+
+def get_escape_histogram(iters, max_iter, bins=auto_max_iter_bins):
+    # escape counts of the pixels that escaped, in bins over [0, max_iter), and how many pixels hit the limit
+    counts = get_counts(iters)
+    escaped = counts[(counts >= 0) & (counts < max_iter)]
+    histogram, _ = np.histogram(escaped, bins=bins, range=(0, max_iter))
+    return histogram, int(np.count_nonzero(counts >= max_iter))
+
+def get_late_fraction(histogram, pixel_count):
+    # Pixels escaping in the upper half of the range are the ones a lower limit would cut off, the interior hits the limit whatever it is.
+    return histogram[len(histogram) // 2:].sum() / max(pixel_count, 1)
+
+def adjust_iter_scale(iter_scale, histogram, pixel_count):
+    late_fraction = get_late_fraction(histogram, pixel_count)
+    if late_fraction > auto_max_iter_raise_fraction:
+        iter_scale *= 2
+    elif late_fraction < auto_max_iter_lower_fraction:
+        iter_scale /= 2
+    return min(max(iter_scale, auto_max_iter_scale_range[0]), auto_max_iter_scale_range[1])
+
+def get_auto_max_iter(base_max_iter, zoom, iter_scale=1.0):
+    # linear in the zoom depth, a view zoomed in 2^k times gets auto_max_iter_growth * k more times the base
+    depth = math.log2(zoom) if 1 < zoom < math.inf else (math.inf if zoom == math.inf else 0)
+    max_iter = base_max_iter * (1 + auto_max_iter_growth * depth) * iter_scale
+    return int(min(max(max_iter, auto_max_iter_range[0]), auto_max_iter_range[1]))
+
+def format_histogram(histogram, capped, max_iter):
+    pixel_count = histogram.sum() + capped
+    bars = " ".join(f"{count / max(pixel_count, 1) * 100:.1f}" for count in histogram)
+    return f"Escape counts in {len(histogram)} bins of {max_iter / len(histogram):.0f} iterations (%): {bars}, {capped / max(pixel_count, 1) * 100:.1f}% at the limit of {max_iter}"
@@ -0,0 +1,65 @@
+import os, glob, hashlib, logging
+import numpy as np
+
+from mpmath import mpc
+from game.preturbation import calculate_orbit, get_orbit_precision
+from utils.constants import orbit_cache_dir, c_for_julia_type
+
+# Reference orbits on disk, one .npy of complex128 per location named <key>-<max_iter>.npy.
+# The key covers everything that changes the orbit except max_iter, so a cached orbit also serves every shorter request.
+
+def get_orbit_key(fractal_type, center, multi_n, julia_type, escape_radius, precision):
+    center = mpc(center)
+    julia_constant = c_for_julia_type[julia_type] if fractal_type == "julia" else None
+
+    # _mpf_ is the exact binary (sign, mantissa, exponent, bitcount) of the center, no decimal rounding sneaks into the key
+    key = repr((fractal_type, int(multi_n), julia_constant, float(escape_radius), center.real._mpf_, center.imag._mpf_, precision))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def find_cached_orbit(key):
+    for path in glob.glob(os.path.join(orbit_cache_dir, f"{key}-*.npy")):
+        return path, int(os.path.basename(path).rsplit("-", 1)[1].removesuffix(".npy"))
+
+    return None, 0
+
+def evict_orbits(budget):
+    files = [(os.path.getmtime(path), os.path.getsize(path), path) for path in glob.glob(os.path.join(orbit_cache_dir, "*.npy"))]
+    total = sum(size for _, size, _ in files)
+
+    for _, size, path in sorted(files):
+        if total <= budget:
+            break
+
+        os.remove(path)
+        total -= size
+
+def get_orbit(fractal_type, center, max_iter, multi_n=2, julia_type="Classic swirling", escape_radius=2, span=None, cache_budget=256 * 1024 * 1024):
+    if not cache_budget:
+        return calculate_orbit(fractal_type, center, max_iter, multi_n, julia_type, escape_radius, span)
+
+    key = get_orbit_key(fractal_type, center, multi_n, julia_type, escape_radius, get_orbit_precision(span))
+    path, cached_max_iter = find_cached_orbit(key)
+
+    if path:
+        orbit = np.load(path, mmap_mode="r")
+
+        # an orbit that escaped before its own max_iter is complete for any max_iter
+        if cached_max_iter >= max_iter or len(orbit) <= cached_max_iter:
+            os.utime(path) # the modification time is the LRU clock
+            logging.debug(f"Orbit cache hit for {fractal_type}: {len(orbit)} cached iterations, {max_iter} requested")
+            return orbit[:max_iter + 1]
+
+    orbit = calculate_orbit(fractal_type, center, max_iter, multi_n, julia_type, escape_radius, span)
+
+    os.makedirs(orbit_cache_dir, exist_ok=True)
+    temporary_path = os.path.join(orbit_cache_dir, f"{key}.tmp")
+    with open(temporary_path, "wb") as file:
+        np.save(file, orbit)
+    os.replace(temporary_path, os.path.join(orbit_cache_dir, f"{key}-{max_iter}.npy"))
+
+    if path:
+        os.remove(path) # superseded by the longer orbit
+
+    evict_orbits(cache_budget)
+
+    return orbit
@@ -1,208 +1,167 @@
-
-from mpmath import mp, mpc
+from mpmath import mp, mpf, mpc
 from utils.constants import c_for_julia_type
-import array, pyglet
-from pyglet.gl import GL_TEXTURE_1D, GL_RG32F, GL_NEAREST
+from game.profiler import traced
+import math
+import numpy as np
+
+try:
+    from gmpy2 import mpz as big_int # GMP multiplication is a lot faster than CPython's for the huge fixed point numbers of deep zooms
+except ImportError:
+    big_int = int
+
+# Fractals whose iteration can be written as reference orbit + delta, see the *_delta_calc snippets in game/shader.py
+preturbation_fractals = ["mandelbrot", "mandelbar", "julia", "burning_ship", "buffalo_fractal"]
+
+def supports_preturbation(fractal_type, multi_n=2):
+    if fractal_type == "buffalo_fractal":
+        return int(multi_n) == 2
+    return fractal_type in preturbation_fractals
+
+def supports_series_approximation(fractal_type, multi_n=2):
+    return fractal_type in ("mandelbrot", "julia") and int(multi_n) == 2
+
+def get_orbit_precision(span):
+    # enough bits to resolve a pixel of the view plus a safety margin for the error growing along the orbit
+    return max(53, int(-math.log2(float(span))) + 64) if span else 53
+
+# Reference orbits are iterated in fixed point: every value is an integer scaled by 2^precision.
+# This skips mpmath's per-operation object creation and normalisation, and all fractals use integer power recurrences
+# instead of atan2/cos/sin so the orbit stays exact up to the chosen precision.
+
+def to_fixed(value, precision):
+    return big_int(int(mp.ldexp(mpf(value), precision)))
+
+def fixed_multiply(x0, y0, x1, y1, precision):
+    return (x0 * x1 - y0 * y1) >> precision, (x0 * y1 + y0 * x1) >> precision
+
+def fixed_power(x, y, n, precision):
+    # binary exponentiation, log2(n) squarings instead of n - 1 multiplications
+    result_x, result_y = big_int(1) << precision, big_int(0)
+    while n:
+        if n & 1:
+            result_x, result_y = fixed_multiply(result_x, result_y, x, y, precision)
+        n >>= 1
+        if n:
+            x, y = fixed_multiply(x, y, x, y, precision)
+    return result_x, result_y
+
+def mandelbrot_orbit_step(x, y, cx, cy, multi_n, precision):
+    if multi_n == 2:
+        return ((x * x - y * y) >> precision) + cx, ((x * y) >> (precision - 1)) + cy
+    x, y = fixed_power(x, y, multi_n, precision)
+    return x + cx, y + cy
+
+def mandelbar_orbit_step(x, y, cx, cy, multi_n, precision):
+    if multi_n == 2:
+        return ((x * x - y * y) >> precision) + cx, -((x * y) >> (precision - 1)) + cy
+    x, y = fixed_power(x, -y, multi_n, precision)
+    return x + cx, y + cy
+
+def buffalo_fractal_orbit_step(x, y, cx, cy, multi_n, precision):
+    if multi_n == 2:
+        return abs((x * x - y * y) >> precision) + cx, abs((x * y) >> (precision - 1)) + cy
+    x, y = fixed_power(x, y, multi_n, precision)
+    return abs(x) + cx, abs(y) + cy
+
+def burning_ship_orbit_step(x, y, cx, cy, multi_n, precision):
+    return ((x * x - y * y) >> precision) + cx, abs((x * y) >> (precision - 1)) + cy
+
+orbit_steps = {
+    "mandelbrot": mandelbrot_orbit_step,
+    "julia": mandelbrot_orbit_step,
+    "mandelbar": mandelbar_orbit_step,
+    "buffalo_fractal": buffalo_fractal_orbit_step,
+    "burning_ship": burning_ship_orbit_step
+}
+
+def calculate_phoenix_fractal_orbit(cx, cy, max_iterations, precision, escape_radius=2):
+    p = to_fixed(0.56667, precision)
+    escape_radius_squared = to_fixed(escape_radius * escape_radius, 2 * precision)
+    x = y = previous_x = previous_y = big_int(0)
+    yield x, y
 
-def calculate_julia_orbit(z_start, c_constant, max_iterations):
-    z = z_start # position
-    orbit = [z]
-    
     for _ in range(max_iterations):
-        z = z*z + c_constant
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_multi_julia_orbit(z_start, c_constant, max_iterations, multi_n):
-    z = z_start # position
-    orbit = [z]
-
-    for _ in range(max_iterations):
-        r = abs(z)
-        theta = mp.atan2(z.imag, z.real)
-        r_pow = r**multi_n
-
-        z = mpc(r_pow * mp.cos(multi_n * theta), r_pow * mp.sin(multi_n * theta)) + c_constant
-        
-        orbit.append(z)
+        new_x, new_y = mandelbrot_orbit_step(x, y, cx, cy, 2, precision)
+        x, y, previous_x, previous_y = new_x - ((p * previous_x) >> precision), new_y - ((p * previous_y) >> precision), x, y
+        yield x, y
+        if x * x + y * y > escape_radius_squared:
+            break
+
+def calculate_lambda_fractal_orbit(cx, cy, max_iterations, precision, escape_radius=2):
+    one = big_int(1) << precision
+    escape_radius_squared = to_fixed(escape_radius * escape_radius, 2 * precision)
+    x, y = one >> 1, big_int(0)
+    yield x, y
 
-    return orbit
-
-def calculate_mandelbrot_orbit(c_val, max_iterations):
-    z = mpc(0, 0)
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        z = z*z + c_val
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_multibrot_orbit(c_val, max_iterations, multi_n):
-    z = mpc(0, 0)
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        r = abs(z)
-        theta = mp.atan2(z.imag, z.real)
-        r_n = r ** multi_n
-        theta_n = multi_n * theta
-
-        z = mpc(r_n * mp.cos(theta_n), r_n * mp.sin(theta_n)) + c_val
-        
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_mandelbar_orbit(c_val, max_iterations):
-    z = mpc(0, 0)
-    orbit = [z]
-    
     for _ in range(max_iterations):
-        z = z.conjugate() ** 2 + c_val
-        orbit.append(z)
+        x, y = fixed_multiply(x, y, one - x, one - y, precision)
+        x, y = fixed_multiply(cx, cy, x, y, precision)
+        yield x, y
+        if x * x + y * y > escape_radius_squared:
+            break
 
-    return orbit
+def iterate_orbit(step, x, y, cx, cy, max_iterations, multi_n, precision, escape_radius=2):
+    escape_radius_squared = to_fixed(escape_radius * escape_radius, 2 * precision)
+    yield x, y
 
-def calculate_multi_mandelbar_orbit(c_val, max_iterations, multi_n):
-    z = mpc(0, 0)
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        r = abs(z)
-        theta = mp.atan2(-z.imag, z.real)
-        r_n = r ** multi_n
-        theta_n = multi_n * theta
-
-        z = mpc(r_n * mp.cos(theta_n), r_n * mp.sin(theta_n)) + c_val
-        
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_buffalo_fractal_orbit(c_val, max_iterations):
-    z = mpc(0, 0)
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        z_squared = z * z
-        z_abs = mpc(abs(z_squared.real), abs(z_squared.imag))
-        z = z_abs + c_val
-        
-        orbit.append(z)
-
-    return orbit
-
-def calculate_multi_buffalo_fractal_orbit(c_val, max_iterations, multi_n):
-    z = mpc(0, 0)
-    orbit = [z]
-    
     for _ in range(max_iterations):
-        r = abs(z)
-        theta = mp.atan2(z.imag, z.real)
-        r_n = r ** multi_n
-        theta_n = multi_n * theta
-        zn_real = r_n * mp.cos(theta_n)
-        zn_imag = r_n * mp.sin(theta_n)
-
-        z = mpc(abs(zn_real), abs(zn_imag)) + c_val
-        
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_burning_ship_orbit(c_val, max_iterations):
-    z = mpc(0, 0)
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        x = z.real
-        y = z.imag
-
-        xtemp = x*x - y*y + c_val.real
-        ytemp = abs(2 * x * y) + c_val.imag
-
-        z = mpc(xtemp, ytemp)
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_phoenix_fractal_orbit(c_val, max_iterations):
-    z = mpc(0, 0)
-    z_prev = mpc(0, 0)
-    p = 0.56667
-    orbit = [z]
-    
-    for _ in range(max_iterations):
-        z_new = z.conjugate() ** 2 + c_val - p * z_prev
-
-        z_prev = z
-
-        z = z_new
-        
-        orbit.append(z)
+        x, y = step(x, y, cx, cy, multi_n, precision)
+        yield x, y
+        if x * x + y * y > escape_radius_squared:
+            break
+
+@traced
+def calculate_orbit(fractal_type, position, max_iterations, multi_n=2, julia_type="Classic swirling", escape_radius=2, span=None):
+    precision = get_orbit_precision(span)
+    multi_n = int(multi_n)
+    position = mpc(position)
+    px, py = to_fixed(position.real, precision), to_fixed(position.imag, precision)
+
+    if fractal_type == "phoenix_fractal":
+        orbit = calculate_phoenix_fractal_orbit(px, py, max_iterations, precision, escape_radius)
+    elif fractal_type == "lambda_fractal":
+        orbit = calculate_lambda_fractal_orbit(px, py, max_iterations, precision, escape_radius)
+    elif fractal_type == "julia":
+        cx, cy = (to_fixed(part, precision) for part in c_for_julia_type[julia_type])
+        orbit = iterate_orbit(orbit_steps[fractal_type], px, py, cx, cy, max_iterations, multi_n, precision, escape_radius)
+    else:
+        orbit = iterate_orbit(orbit_steps[fractal_type], big_int(0), big_int(0), px, py, max_iterations, multi_n, precision, escape_radius)
 
-    return orbit
+    # Written straight into the float64 buffer the shader storage buffer is uploaded from, trimmed to the iterations that ran.
+    buffer = np.empty((max_iterations + 1, 2), dtype=np.float64)
+    scale = 1 << precision
+    length = 0
 
-def calculate_lambda_fractal_orbit(c_val, max_iterations):
-    z = mpc(0.5, 0)
-    orbit = [z]
-    number_reverse_complex = mpc(1, 1)
+    for x, y in orbit:
+        buffer[length] = int(x) / scale, int(y) / scale
+        length += 1
 
-    for _ in range(max_iterations):
-        one_minus_z = number_reverse_complex - z
-        
-        temp = z * one_minus_z
-        
-        z = c_val * temp
-
-        orbit.append(z)
-            
-    return orbit
-
-def calculate_orbit(fractal_type, position, max_iterations, multi_n=2, julia_type="Classic swirling"):
-    if fractal_type == "mandelbrot":
-        if int(multi_n) == 2:
-            orbit = calculate_mandelbrot_orbit(position, max_iterations)
-        else:
-            orbit = calculate_multibrot_orbit(position, max_iterations, multi_n)
-
-    elif fractal_type == "mandelbar":
-        if int(multi_n) == 2:
-            orbit = calculate_mandelbar_orbit(position, max_iterations)
-        else:
-            orbit = calculate_multi_mandelbar_orbit(position, max_iterations)
-
-    elif fractal_type == "phoenix_fractal":
-        orbit = calculate_phoenix_fractal_orbit(position, max_iterations)
+    return buffer[:length].view(np.complex128).ravel()
 
-    elif fractal_type == "lambda_fractal":
-        orbit = calculate_lambda_fractal_orbit(position, max_iterations)
+def calculate_series_approximation(fractal_type, orbit, max_delta, multi_n=2, tolerance=1e-6):
+    # Third order series delta_n = A_n * d + B_n * d^2 + C_n * d^3 in the pixel offset d, lets every pixel start at iteration skip.
+    # For the Mandelbrot set d is the offset of c and delta_0 = 0, for Julia sets d is the offset of z_0 so A_0 = 1.
+    julia = fractal_type == "julia"
+    coefficients = (1 + 0j, 0j, 0j) if julia else (0j, 0j, 0j)
 
-    elif fractal_type == "julia":
-        if int(multi_n) == 2:
-            orbit = calculate_julia_orbit(position, c_for_julia_type[julia_type], max_iterations)
-        else:
-            orbit = calculate_multi_julia_orbit(position, c_for_julia_type[julia_type], max_iterations, multi_n)
+    if not supports_series_approximation(fractal_type, multi_n) or not max_delta:
+        return 0, coefficients
 
-    elif fractal_type == "buffalo_fractal":
-        if int(multi_n) == 2:
-            orbit = calculate_buffalo_fractal_orbit(position, max_iterations)
-        else:
-            orbit = calculate_multi_buffalo_fractal_orbit(position, max_iterations)
+    a, b, c = coefficients
+    skip = 0
 
-    elif fractal_type == "burning_ship":
-        orbit = calculate_burning_ship_orbit(position, max_iterations)
+    for n in range(len(orbit) - 1):
+        two_z = 2 * orbit[n]
+        a, b, c = two_z * a + (0 if julia else 1), two_z * b + a * a, two_z * c + 2 * a * b
 
-    float_array = array.array('f')
+        if not all(map(math.isfinite, (a.real, a.imag, b.real, b.imag, c.real, c.imag))):
+            break
 
-    for c_val in orbit:
-        float_array.append(float(c_val.real))
-        float_array.append(float(c_val.imag))
+        # stop once the truncated terms would no longer be negligible against the linear one for the farthest pixel
+        if abs(c) * max_delta * max_delta > tolerance * abs(a) or abs(b) * max_delta > abs(a):
+            break
 
-    orbit_texture = pyglet.image.Texture.create(max_iterations, 1, internalformat=GL_RG32F, target=GL_TEXTURE_1D, min_filter=GL_NEAREST, mag_filter=GL_NEAREST)
-    orbit_image_data = pyglet.image.ImageData(max_iterations, 1, "RG", float_array.tobytes())
-    orbit_image_data.blit_to_texture(orbit_texture.target, orbit_texture.level, orbit_texture.anchor_x, orbit_texture.anchor_y, 0, None)
+        skip = n + 1
+        coefficients = (a, b, c)
 
-    return orbit_texture
\ No newline at end of file
+    return skip, coefficients
@@ -0,0 +1,108 @@
+import os, json, time, ctypes, logging, functools, threading
+import pyglet
+
+from contextlib import contextmanager
+
+# Timed sections are Chrome trace events (chrome://tracing, ui.perfetto.dev) on the "trace" logger, run.py decides where they are written.
+# Without a handler on that logger only latest_timings is kept, which is what the overlay shows.
+trace_logger = logging.getLogger("trace")
+trace_logger.setLevel(logging.DEBUG)
+trace_logger.propagate = False
+
+gpu_thread_id = 0 # GPU timer results get a timeline of their own in the trace
+latest_timings = {}
+pending_timer_queries = []
+
+class ChromeTraceHandler(logging.FileHandler):
+    # JSON array format: the closing bracket is optional, so events are appended as they happen and a crash still leaves a valid trace.
+    def __init__(self, filename):
+        super().__init__(filename, mode="w")
+        self.stream.write("[\n")
+        self.stream.write(json.dumps({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": gpu_thread_id, "args": {"name": "GPU"}}) + ",\n")
+
+    def format(self, record):
+        return json.dumps(record.trace_event) + ","
+
+def supports_timer_queries():
+    info = pyglet.gl.current_context.get_info()
+    return info.have_version(3, 3) or info.have_extension("GL_ARB_timer_query")
+
+class TimerQuery:
+    # GL_TIME_ELAPSED around the GL commands issued inside the with block, measured by the GPU itself instead of a glFinish round trip.
+    def __init__(self):
+        self.query = pyglet.gl.GLuint()
+        pyglet.gl.glGenQueries(1, ctypes.byref(self.query))
+
+    def __enter__(self):
+        pyglet.gl.glBeginQuery(pyglet.gl.GL_TIME_ELAPSED, self.query)
+        return self
+
+    def __exit__(self, *args):
+        pyglet.gl.glEndQuery(pyglet.gl.GL_TIME_ELAPSED)
+
+    def available(self):
+        available = pyglet.gl.GLint()
+        pyglet.gl.glGetQueryObjectiv(self.query, pyglet.gl.GL_QUERY_RESULT_AVAILABLE, ctypes.byref(available))
+        return bool(available.value)
+
+    def result(self):
+        # blocks until the GPU got through the timed commands
+        elapsed = pyglet.gl.GLuint64()
+        pyglet.gl.glGetQueryObjectui64v(self.query, pyglet.gl.GL_QUERY_RESULT, ctypes.byref(elapsed))
+        return elapsed.value / 1e9
+
+    def delete(self):
+        pyglet.gl.glDeleteQueries(1, ctypes.byref(self.query))
+
+def log_event(name, start, duration, category="cpu", thread_id=None, **args):
+    latest_timings[name] = duration * 1000
+
+    if trace_logger.handlers:
+        trace_logger.debug(name, extra={"trace_event": {
+            "name": name, "cat": category, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident() if thread_id is None else thread_id, "args": args
+        }})
+
+@contextmanager
+def trace(name, **args):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log_event(name, start, time.perf_counter() - start, **args)
+
+def traced(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with trace(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+@contextmanager
+def trace_gpu(name, **args):
+    # The result is only collected by poll_timer_queries once the GPU is done, reading it here would stall until then.
+    if not supports_timer_queries():
+        yield
+        return
+
+    timer_query = TimerQuery()
+    start = time.perf_counter()
+
+    with timer_query:
+        yield
+
+    pending_timer_queries.append((name, start, timer_query, args))
+
+def poll_timer_queries():
+    for pending in list(pending_timer_queries):
+        name, start, timer_query, args = pending
+        if not timer_query.available():
+            continue
+
+        log_event(f"{name} (GPU)", start, timer_query.result(), "gpu", gpu_thread_id, **args)
+        timer_query.delete()
+        pending_timer_queries.remove(pending)
+
+def format_timings():
+    return "\n".join(f"{name}: {milliseconds:.2f} ms" for name, milliseconds in sorted(latest_timings.items()))
@@ -0,0 +1,170 @@
+import ctypes
+import pyglet
+import numpy as np
+
+from game.shader import coloring_function_source, parse_workgroup_size, get_workgroup_count
+from game.shader_cache import get_compute_program
+from utils.constants import readback_buffer_count
+
+# Exports of the iteration buffers as the window draws them. The export kernel colors a frame into an RGBA8 image on the GPU, so a
+# 4K frame moves 33 MB instead of the 133 MB of RGBA32F, and glGetTexImage copies it into a pixel buffer without waiting for it.
+# A fence after the copy tells when the buffer can be read, until then the next frames render into the other buffers.
+export_compute_template = """#version 430 core
+layout (local_size_x = {local_size_x}, local_size_y = {local_size_y}, local_size_z = 1) in;
+layout(binding = 0, rgba8) writeonly uniform image2D img_export;
+uniform sampler2D iters;
+{coloring_function}
+void main() {{
+    ivec2 texel_coord = ivec2(gl_GlobalInvocationID.xy);
+    ivec2 size = imageSize(img_export);
+    if (any(greaterThanEqual(texel_coord, size))) {{
+        return;
+    }}
+
+    vec2 coords = (vec2(texel_coord) + 0.5) / vec2(size);
+    imageStore(img_export, texel_coord, get_color(texelFetch(iters, texel_coord, 0), coords));
+}}
+"""
+
+def supports_persistent_mapping():
+    return pyglet.gl.current_context.get_info().have_version(4, 4)
+
+def wait_for_fence(fence, wait):
+    # True once the GPU is past the fence, with wait blocks until it is
+    while True:
+        status = pyglet.gl.glClientWaitSync(fence, pyglet.gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000 if wait else 0)
+        if status in (pyglet.gl.GL_ALREADY_SIGNALED, pyglet.gl.GL_CONDITION_SATISFIED):
+            return True
+        if status == pyglet.gl.GL_WAIT_FAILED:
+            raise RuntimeError("Waiting for a readback fence failed")
+        if not wait:
+            return False
+
+class ReadbackBuffer:
+    # One export image and the pixel buffer it is copied into. With OpenGL 4.4 the buffer stays mapped for its whole life,
+    # otherwise it is mapped for every read.
+    def __init__(self, width, height, persistent):
+        self.width = width
+        self.height = height
+        self.size = width * height * 4
+        self.persistent = persistent
+        self.image = pyglet.image.Texture.create(width, height, internalformat=pyglet.gl.GL_RGBA8, min_filter=pyglet.gl.GL_NEAREST, mag_filter=pyglet.gl.GL_NEAREST)
+
+        self.id = pyglet.gl.GLuint()
+        pyglet.gl.glGenBuffers(1, self.id)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.id)
+
+        if persistent:
+            flags = pyglet.gl.GL_MAP_READ_BIT | pyglet.gl.GL_MAP_PERSISTENT_BIT | pyglet.gl.GL_MAP_COHERENT_BIT
+            pyglet.gl.glBufferStorage(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.size, None, flags)
+            self.pixels = self.get_array(pyglet.gl.glMapBufferRange(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0, self.size, flags))
+        else:
+            pyglet.gl.glBufferData(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.size, None, pyglet.gl.GL_STREAM_READ)
+
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    def get_array(self, pointer):
+        return np.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctypes.c_uint8)), shape=(self.height, self.width, 4))
+
+    def copy(self):
+        # queues the copy of the export image, the pixels arrive once the GPU gets to it
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.id)
+        pyglet.gl.glPixelStorei(pyglet.gl.GL_PACK_ALIGNMENT, 4)
+        pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, self.image.id)
+        pyglet.gl.glGetTexImage(pyglet.gl.GL_TEXTURE_2D, 0, pyglet.gl.GL_RGBA, pyglet.gl.GL_UNSIGNED_BYTE, None)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    def read(self):
+        # (height, width, 3) uint8, rows from the bottom of the view like the iteration buffers
+        if self.persistent:
+            return self.pixels[..., :3].copy()
+
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.id)
+        pixels = self.get_array(pyglet.gl.glMapBufferRange(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0, self.size, pyglet.gl.GL_MAP_READ_BIT))[..., :3].copy()
+        pyglet.gl.glUnmapBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+        return pixels
+
+    def delete(self):
+        if self.persistent:
+            self.pixels = None
+            pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, self.id)
+            pyglet.gl.glUnmapBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER)
+            pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+
+        pyglet.gl.glDeleteBuffers(1, self.id)
+        self.image.delete()
+
+class AsyncReadback:
+    # submit queues the export of a frame and returns at once, collect hands out the frames whose copy is done, oldest first.
+    # A submit with every buffer in flight waits for the oldest one.
+    def __init__(self, width, height, workgroup_size=(8, 8), buffer_count=readback_buffer_count, binary_cache=False):
+        self.width = width
+        self.height = height
+        self.workgroup_size = parse_workgroup_size(workgroup_size)
+
+        self.shader_program = get_compute_program(export_compute_template, {"local_size_x": self.workgroup_size[0], "local_size_y": self.workgroup_size[1], "coloring_function": coloring_function_source}, binary_cache)
+        with self.shader_program:
+            self.shader_program["iters"] = 0
+            self.shader_program["palette"] = 1
+            self.shader_program["antialiased"] = 2
+
+        persistent = supports_persistent_mapping()
+        self.free_buffers = [ReadbackBuffer(width, height, persistent) for _ in range(buffer_count)]
+        self.pending = [] # (fence, buffer, tag)
+        self.finished = []
+
+    def submit(self, tag, image, palette_texture, fractal_type, max_iter, smooth_coloring=False, antialiased_image=None):
+        # image is an iteration buffer, the frame is colored like create_coloring_program would with the same arguments
+        if not self.free_buffers:
+            self.finish_oldest(wait=True)
+
+        readback_buffer = self.free_buffers.pop(0)
+
+        image.bind(texture_unit=0)
+        palette_texture.bind(texture_unit=1)
+        if antialiased_image is not None:
+            antialiased_image.bind(texture_unit=2)
+        readback_buffer.image.bind_image_texture(unit=0, access=pyglet.gl.GL_WRITE_ONLY, fmt=pyglet.gl.GL_RGBA8)
+
+        with self.shader_program:
+            self.shader_program["u_maxIter"] = int(max_iter)
+            self.shader_program["u_root_coloring"] = fractal_type == "newton_fractal"
+            self.shader_program["u_smooth_coloring"] = smooth_coloring
+            self.shader_program["u_antialiased"] = antialiased_image is not None
+            self.shader_program.dispatch(*get_workgroup_count(self.width, self.height, self.workgroup_size), 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+
+        readback_buffer.copy()
+
+        # flushed so the GPU starts on it now, not whenever the next frame gets flushed
+        self.pending.append((pyglet.gl.glFenceSync(pyglet.gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0), readback_buffer, tag))
+        pyglet.gl.glFlush()
+
+    def finish_oldest(self, wait):
+        fence, readback_buffer, tag = self.pending[0]
+        if not wait_for_fence(fence, wait):
+            return False
+
+        pyglet.gl.glDeleteSync(fence)
+        self.pending.pop(0)
+        self.finished.append((tag, readback_buffer.read()))
+        self.free_buffers.append(readback_buffer)
+        return True
+
+    def collect(self, wait=False):
+        # [(tag, pixels)] of the exports done so far, with wait of every submitted one
+        while self.pending and self.finish_oldest(wait):
+            pass
+
+        finished, self.finished = self.finished, []
+        return finished
+
+    def delete(self):
+        for fence, readback_buffer, _ in self.pending:
+            pyglet.gl.glDeleteSync(fence)
+            self.free_buffers.append(readback_buffer)
+
+        for readback_buffer in self.free_buffers:
+            readback_buffer.delete()
+
+        self.pending, self.free_buffers = [], []
@@ -1,135 +1,723 @@
-import pyglet
+import pyglet, time, logging, ctypes
+import numpy as np
+
+from utils.constants import c_for_julia_type, subdivision_tile_size, subdivision_min_tile_size, precision_margin_bits, auto_max_iter_bins
+from game.preturbation import calculate_series_approximation, supports_preturbation
+from game.orbit_cache import get_orbit
+from game.cpu_engine import calculate_iters, calculate_preturbation_iters, get_counts, get_periodicity_tolerance, get_degree, subdivide_iters, unresolved, palettes, get_default_palette
+from game.tile_renderer import TileRenderer, get_mp_context
+from game.shader_cache import get_compute_program
+from game.profiler import traced
+from game.iteration_limit import get_escape_histogram
+from math import comb
+from mpmath import mp, mpf
+
+# Coloring happens when the iteration buffer is drawn, so a palette change is a new 1D LUT instead of a recompute.
+# The export kernel of game/readback.py colors with the same function, so exported images match the window.
+coloring_function_source = """
+uniform sampler2D palette;
+uniform int u_maxIter;
+uniform bool u_root_coloring;
+uniform bool u_smooth_coloring;
+uniform sampler2D antialiased;
+uniform bool u_antialiased;
+
+vec4 get_color(vec4 texel, vec2 coords) {
+    float iters = texel.r;
+    vec4 color;
+
+    if (u_root_coloring) {
+        // Newton fractal, the buffer holds the index of the root the point converged to or -1
+        int root = int(iters);
+        color = vec4(root == 0 ? 1.0 : 0.0, root == 1 ? 1.0 : 0.0, root == 2 ? 1.0 : 0.0, 1.0);
+    }
+    else if (iters >= float(u_maxIter)) {
+        color = vec4(0.0, 0.0, 0.0, 1.0);
+    }
+    else {
+        // sample texel centers so t = 0 and t = 1 hit the first and the last palette entry exactly
+        float size = float(textureSize(palette, 0).x);
+        // the smooth iteration count of the channels image has no bands
+        float t = (u_smooth_coloring ? texel.g : iters) / float(u_maxIter);
+        color = texture(palette, vec2((t * (size - 1.0) + 0.5) / size, 0.5));
+    }
+
+    if (u_antialiased) {
+        // the averaged colors of the supersampled edge pixels, alpha is 0 everywhere else
+        vec4 antialiased_color = texture(antialiased, coords);
+        if (antialiased_color.a > 0.0) {
+            color = vec4(antialiased_color.rgb, 1.0);
+        }
+    }
+
+    return color;
+}
+"""
+
+coloring_fragment_source = """#version 150 core
+in vec4 vertex_colors;
+in vec3 texture_coords;
+out vec4 final_colors;
+
+uniform sampler2D sprite_texture;
+""" + coloring_function_source + """
+void main() {
+    final_colors = get_color(texture(sprite_texture, texture_coords.xy), texture_coords.xy);
+}
+"""
+
+iter_fractal_template = """#version 430 core
+uniform int u_maxIter;
+uniform vec2 u_resolution;
+uniform vec2 u_real_range;
+uniform vec2 u_imag_range;
+uniform vec2 u_real_range_lo;
+uniform vec2 u_imag_range_lo;
+uniform bool u_preturbation;
+uniform int u_pass_scale;
+uniform int u_previous_scale;
+uniform bool u_reuse;
+uniform int u_previous_max_iter;
+uniform vec2 u_previous_origin;
+uniform vec2 u_previous_step;
+uniform int u_subdivision_stage;
+uniform int u_subdivision_size;
+uniform int u_subdivision_spacing;
+uniform bool u_antialias;
+uniform int u_antialias_count;
+uniform int u_iter_limit;
+uniform bool u_continue;
+
+layout (local_size_x = {local_size_x}, local_size_y = {local_size_y}, local_size_z = 1) in;
+layout(binding = 1, {iters_format}) uniform image2D img_iters;
+layout(binding = 2, {iters_format}) readonly uniform image2D img_previous_iters;
+
+layout(std430, binding = 3) buffer RenderStats {{
+    uint reused_samples;
+    uint computed_samples;
+}};
+
+// Adaptive antialiasing, see dispatch_antialiasing: the positions in pixels of the jittered samples go in, what main would store for them comes out
+layout(std430, binding = 4) buffer AntialiasSamples {{
+    vec4 antialias_samples[];
+}};
+
+// Iteration refinement, see IterFractalViewer.refine_iterations: a frame is first iterated up to u_iter_limit (0 is u_maxIter), the pixels
+// still inside the escape radius keep their z, dz and count here and u_continue dispatches carry them on to a higher limit.
+struct PixelState {{
+    {vec2type} z;
+    {vec2type} d;
+    int iters;
+    int pending;
+}};
+
+layout(std430, binding = 5) buffer PixelStates {{
+    PixelState pixel_states[];
+}};
+
+int state_index = -1;
+
+// With channels the iteration image holds the iterations, the smooth iteration count and the distance estimate in pixels,
+// see escape_channels in game/cpu_engine.py. The derivative they need is only carried along then.
+const bool track_derivative = {channels};
+
+vec2 escape_channels(int iters, float r, float d) {{
+    // between iters and iters + 1, continuous across the bands, and |z| log|z| / 2|dz/dc| with d already in pixels
+    float smooth_iters = float(iters) + 1.0 - log(log(r) / log(float({escape_radius}))) / log(float({degree}));
+    return vec2(smooth_iters, d > 0.0 ? 0.5 * r * log(r) / d : 0.0);
+}}
+
+{iter_calc_func}
+{derivative_calc_func}
+{preturbation_func}
 
-from utils.constants import c_for_julia_type
-from game.preturbation import calculate_orbit
-from mpmath import mpc
+{calculate_iters_func}
 
-newton_coloring = """vec4 getColor(int color_number) {{
-    vec4 value = vec4(0.0, 0.0, 0.0, 1.0);
-    if (color_number == 0) {{
-        value.r = 1.0;
+bool reproject(ivec2 texel_coord, out vec4 texel) {{
+    // Where this pixel was in the previous frame, in previous frame pixels.
+    // It can only be reused if it lands on a previous sample, anything in between has to be computed.
+    vec2 previous = u_previous_origin + vec2(texel_coord) * u_previous_step;
+    ivec2 previous_texel = ivec2(round(previous));
+
+    if (!u_reuse || any(greaterThan(abs(previous - vec2(previous_texel)), vec2(0.001)))) {{
+        return false;
     }}
-    else if (color_number == 1) {{
-        value.g = 1.0;
+    if (any(lessThan(previous_texel, ivec2(0))) || any(greaterThanEqual(previous_texel, ivec2(u_resolution)))) {{
+        return false;
     }}
-    else if (color_number == 2) {{
-        value.b = 1.0;
+
+    texel = imageLoad(img_previous_iters, previous_texel);
+    return true;
+}}
+
+// Subdivision (Mariani-Silver) renders in stages, see dispatch_subdivided: pixels nothing was written to yet hold unresolved,
+// the grid lines every u_subdivision_spacing pixels are computed, and a tile whose whole border has one value is filled with it.
+const float unresolved = -2.0;
+
+bool on_subdivision_grid(ivec2 texel_coord, int spacing) {{
+    return any(equal(texel_coord % spacing, ivec2(0))) || any(equal(texel_coord, ivec2(u_resolution) - 1));
+}}
+
+void classify_tile(ivec2 tile) {{
+    // One invocation per tile, a uniform border is written to the first inner pixel where refine_tile finds it.
+    ivec2 start = tile * u_subdivision_size;
+    ivec2 end = min(start + u_subdivision_size, ivec2(u_resolution) - 1);
+    if (any(greaterThanEqual(start + 1, end))) {{
+        return;
+    }}
+
+    float value = imageLoad(img_iters, start).x;
+    for (int x = start.x; x <= end.x; x++) {{
+        if (imageLoad(img_iters, ivec2(x, start.y)).x != value || imageLoad(img_iters, ivec2(x, end.y)).x != value) {{
+            return;
+        }}
+    }}
+    for (int y = start.y; y <= end.y; y++) {{
+        if (imageLoad(img_iters, ivec2(start.x, y)).x != value || imageLoad(img_iters, ivec2(end.x, y)).x != value) {{
+            return;
+        }}
     }}
 
-    return value;
+    // with channels the tile gets the smooth count and the distance of its corner
+    imageStore(img_iters, start + 1, imageLoad(img_iters, start));
 }}
-"""
 
-polynomial_coloring = """vec4 getColor(int iters) {{
-    vec4 value = vec4(0.0, 0.0, 0.0, 1.0);
-    if (iters != u_maxIter) {{
-        float t = float(iters) / float(u_maxIter);
-        value.r = 9.0 * (1.0 - t) * t * t * t;
-        value.g = 15.0 * (1.0 - t) * (1.0 - t) * t * t;
-        value.b = 8.5 * (1.0 - t) * (1.0 - t) * (1.0 - t) * t;
+bool refine_tile(ivec2 texel_coord) {{
+    // Fills the pixel from its tile or tells whether it lies on the next grid and has to be computed. The pixel holding the value
+    // of a tile that was not uniform is left for the finish stage, computing it here would race with the pixels reading it.
+    ivec2 marker = texel_coord / u_subdivision_size * u_subdivision_size + 1;
+    if (texel_coord == marker) {{
+        return false;
     }}
-    return value;
+
+    vec4 value = imageLoad(img_iters, marker);
+    if (value.x != unresolved) {{
+        imageStore(img_iters, texel_coord, value);
+        return false;
+    }}
+    return on_subdivision_grid(texel_coord, u_subdivision_spacing);
 }}
-"""
 
-fire_coloring = """vec4 getColor(int iters) {{
-    vec4 value = vec4(0.0, 0.0, 0.0, 1.0);
-    if (iters != u_maxIter) {{
-        float t = float(iters) / float(u_maxIter);
-        value.r = 3.0 * t;
-        value.g = 2.0 * t * t;
-        value.b = t * t * t;
+void antialias_sample() {{
+    // one invocation per sample, the workgroups are laid out in rows of as many as a dispatch allows
+    int index = int(gl_WorkGroupID.y * gl_NumWorkGroups.x + gl_WorkGroupID.x) * {local_size_x} * {local_size_y} + int(gl_LocalInvocationIndex);
+    if (index >= u_antialias_count) {{
+        return;
+    }}
+
+    vec2 pixel = antialias_samples[index].xy;
+    int iters;
+    vec2 channels;
+    if (u_preturbation) {{
+        iters = calculate_preturbation_iters(pixel, channels);
+    }}
+    else {{
+        {vec2type} pos = map_pixel(pixel);
+        iters = calculate_iters(pos, channels);
     }}
-    return value;
+    antialias_samples[index] = vec4(iters, channels, 0.0);
 }}
-"""
 
-iter_fractal_template = """#version 430 core
-uniform int u_maxIter;
-uniform vec2 u_resolution;
-uniform vec2 u_real_range;
-uniform vec2 u_imag_range;
+void main() {{
+    if (u_antialias) {{
+        antialias_sample();
+        return;
+    }}
+    if (u_continue) {{
+        ivec2 pixel = ivec2(gl_GlobalInvocationID.xy);
+        if (any(greaterThanEqual(pixel, ivec2(u_resolution)))) {{
+            return;
+        }}
 
-uniform vec2 u_center;
-uniform sampler2D orbit;
-uniform bool usepreturbation;
+        state_index = pixel.y * int(u_resolution.x) + pixel.x;
+        if (pixel_states[state_index].pending == 0) {{
+            return;
+        }}
 
-layout (local_size_x = 1, local_size_y = 1, local_size_z = 1) in;
-layout(location = 0, rgba32f) uniform image2D img_output;
+        vec2 channels;
+        int iters = calculate_iters(map_pixel(vec2(pixel)), channels);
+        imageStore(img_iters, pixel, vec4(iters, channels, 0.0));
+        atomicAdd(computed_samples, 1u);
+        return;
+    }}
+    if (u_subdivision_stage == {subdivision_classify}) {{
+        if (all(lessThan(ivec2(gl_GlobalInvocationID.xy) * u_subdivision_size, ivec2(u_resolution)))) {{
+            classify_tile(ivec2(gl_GlobalInvocationID.xy));
+        }}
+        return;
+    }}
 
-{coloring_func}
-{iter_calc_func}
+    // Progressive passes sample every u_pass_scale-th pixel and fill the block it starts,
+    // samples a coarser pass already computed are left alone, their color already covers the block.
+    ivec2 texel_coord = ivec2(gl_GlobalInvocationID.xy) * u_pass_scale;
+    if (u_subdivision_stage == {subdivision_finish}) {{
+        texel_coord = ivec2(gl_GlobalInvocationID.xy) * u_subdivision_size + 1;
+    }}
+    if (texel_coord.x >= int(u_resolution.x) || texel_coord.y >= int(u_resolution.y)) {{
+        return;
+    }}
+    if (u_previous_scale > 0 && texel_coord.x % u_previous_scale == 0 && texel_coord.y % u_previous_scale == 0) {{
+        return;
+    }}
+
+    if (u_subdivision_stage == {subdivision_start} && !on_subdivision_grid(texel_coord, u_subdivision_spacing)) {{
+        imageStore(img_iters, texel_coord, vec4(unresolved));
+        return;
+    }}
+    if ((u_subdivision_stage == {subdivision_refine} || u_subdivision_stage == {subdivision_finish}) && imageLoad(img_iters, texel_coord).x != unresolved) {{
+        return;
+    }}
+    if (u_subdivision_stage == {subdivision_refine} && !refine_tile(texel_coord)) {{
+        return;
+    }}
+
+    if (u_iter_limit > 0) {{
+        state_index = texel_coord.y * int(u_resolution.x) + texel_coord.x;
+    }}
+
+    // An escape count holds under any limit. A pixel the previous limit (0 is u_maxIter) stopped is only known to stay inside a limit as
+    // low, and has no state for iteration refinement to go on from.
+    int previous_max_iter = u_previous_max_iter > 0 ? u_previous_max_iter : u_maxIter;
+    vec4 texel;
+    if (reproject(texel_coord, texel) && (texel.x < float(previous_max_iter) || (u_iter_limit == 0 && u_maxIter <= previous_max_iter))) {{
+        // an escape past a lowered limit is stored like the pixels that limit stops
+        if (texel.x >= float(u_maxIter)) {{
+            texel = vec4(u_maxIter, u_maxIter, -1.0, 0.0);
+        }}
+        atomicAdd(reused_samples, 1u);
+    }}
+    else {{
+        int iters;
+        vec2 channels;
+        if (u_preturbation) {{
+            iters = calculate_preturbation_iters(vec2(texel_coord), channels);
+        }}
+        else {{
+            {vec2type} pos = map_pixel(vec2(texel_coord));
+            iters = calculate_iters(pos, channels);
+        }}
+        texel = vec4(iters, channels, 0.0);
+        atomicAdd(computed_samples, 1u);
+    }}
+
+    ivec2 block_end = min(texel_coord + u_pass_scale, ivec2(u_resolution));
+    for (int y = texel_coord.y; y < block_end.y; y++) {{
+        for (int x = texel_coord.x; x < block_end.x; x++) {{
+            imageStore(img_iters, ivec2(x, y), texel);
+        }}
+    }}
+}}
+"""
+
+# Escape time of one point in {vec2type}, the single and double precision kernel
+calculate_iters_template = """
+{vec2type} get_range(vec2 range, vec2 range_lo) {{
+    // the float uniforms plus what they round off, see set_view_uniforms, double precision needs it past a zoom of about 1e5
+    return {vec2type}(range) + {vec2type}(range_lo);
+}}
 
-int calculate_iters({vec2type} pos) {{
+int calculate_iters({vec2type} pos, out vec2 channels) {{
     int fractal_type = {fractal_type};
     {vec2type} z = {initial_z};
     {vec2type} c = {initial_c};
+    channels = vec2(u_maxIter, -1.0);
 
     if (fractal_type != 0) {{
-        return int(fractal_iteration(z, c).x);
+        int result = int(fractal_iteration(z, c).x);
+        channels.x = float(result);
+        return result;
+    }}
+{interior_check}
+    int iters = 0;
+    int limit = u_iter_limit > 0 ? u_iter_limit : u_maxIter;
+    float R = {escape_radius};
+
+    // dz/dc (dz/dz0 for Julia sets) times the pixel size
+    {vec2type} real_range = get_range(u_real_range, u_real_range_lo);
+    {floattype} pixel_size = (real_range.y - real_range.x) / {floattype}(u_resolution.x);
+    {vec2type} d = {vec2type}({initial_derivative} * pixel_size, 0.0);
+
+    if (u_continue && state_index >= 0) {{
+        z = pixel_states[state_index].z;
+        d = pixel_states[state_index].d;
+        iters = pixel_states[state_index].iters;
+    }}
+
+    // Brent's cycle detection: z is saved after 1, 2, 4, 8... iterations, an orbit that comes back to the saved value
+    // is on an attracting cycle and can never escape, so points inside the set stop long before u_maxIter.
+    // Costs about as much as the iteration itself where nothing settles on a cycle, so it can be compiled out.
+    const bool periodicity_check = {periodicity_check};
+    {vec2type} z_saved = z;
+    int next_save = max(2 * iters, 1);
+
+    while (dot(z, z) < R * R && iters < limit) {{
+        if (track_derivative) {{
+            d = derivative_iteration(z, d, c, pixel_size);
+        }}
+        z = fractal_iteration(z, c);
+        iters++;
+
+        if (periodicity_check) {{
+            if (all(lessThan(abs(z - z_saved), {vec2type}({periodicity_tolerance})))) {{
+                if (state_index >= 0) {{
+                    pixel_states[state_index].pending = 0;
+                }}
+                return u_maxIter;
+            }}
+            if (iters == next_save) {{
+                z_saved = z;
+                next_save *= 2;
+            }}
+        }}
+    }}
+
+    // not escaped before the limit of this frame: colored as inside until a refinement dispatch gets it out
+    bool pending = dot(z, z) < R * R && iters < u_maxIter;
+    if (state_index >= 0) {{
+        pixel_states[state_index] = PixelState(z, d, iters, pending ? 1 : 0);
+    }}
+    if (pending) {{
+        return u_maxIter;
+    }}
+
+    if (track_derivative && iters < u_maxIter) {{
+        channels = escape_channels(iters, float(length(z)), float(length(d)));
+    }}
+    return iters;
+}}
+
+{vec2type} map_pixel(vec2 pixel) {{
+    {vec2type} real_range = get_range(u_real_range, u_real_range_lo);
+    {vec2type} imag_range = get_range(u_imag_range, u_imag_range_lo);
+    {floattype} real = real_range.x + ({floattype}(pixel.x) / {floattype}(u_resolution.x)) * (real_range.y - real_range.x);
+    {floattype} imag = imag_range.x + ({floattype}(pixel.y) / {floattype}(u_resolution.y)) * (imag_range.y - imag_range.x);
+    return {vec2type}(real, imag);
+}}
+"""
+
+# Emulated double precision for GPUs with slow or no fp64: every real number is an unevaluated sum hi + lo of two floats,
+# about 48 bits of mantissa. A complex number is vec4(real hi, real lo, imag hi, imag lo). Only the escape time fractals whose
+# step is a power of z with abs() or a conjugate in it have a kernel, see float_float_powers.
+float_float_template = """
+// precise keeps the compiler from reassociating or contracting into fma, which would lose exactly the rounding errors kept in lo
+vec2 ff_two_sum(float a, float b) {{
+    precise float s = a + b;
+    precise float v = s - a;
+    precise float e = (a - (s - v)) + (b - v);
+    return vec2(s, e);
+}}
+
+vec2 ff_quick_two_sum(float a, float b) {{
+    precise float s = a + b;
+    precise float e = b - (s - a);
+    return vec2(s, e);
+}}
+
+vec2 ff_split(float a) {{
+    // Dekker's split into two halves of 12 bits, their products are exact in a float
+    precise float t = 4097.0 * a;
+    precise float high = t - (t - a);
+    precise float low = a - high;
+    return vec2(high, low);
+}}
+
+vec2 ff_two_prod(float a, float b) {{
+    precise float p = a * b;
+    vec2 x = ff_split(a);
+    vec2 y = ff_split(b);
+    precise float e = ((x.x * y.x - p) + x.x * y.y + x.y * y.x) + x.y * y.y;
+    return vec2(p, e);
+}}
+
+vec2 ff_add(vec2 a, vec2 b) {{
+    vec2 s = ff_two_sum(a.x, b.x);
+    vec2 t = ff_two_sum(a.y, b.y);
+    s = ff_quick_two_sum(s.x, s.y + t.x);
+    return ff_quick_two_sum(s.x, s.y + t.y);
+}}
+
+vec2 ff_mul(vec2 a, vec2 b) {{
+    vec2 p = ff_two_prod(a.x, b.x);
+    precise float cross = a.x * b.y + a.y * b.x;
+    return ff_quick_two_sum(p.x, p.y + cross);
+}}
+
+vec4 ffc_add(vec4 a, vec4 b) {{
+    return vec4(ff_add(a.xy, b.xy), ff_add(a.zw, b.zw));
+}}
+
+vec4 ffc_mul(vec4 a, vec4 b) {{
+    return vec4(ff_add(ff_mul(a.xy, b.xy), -ff_mul(a.zw, b.zw)), ff_add(ff_mul(a.xy, b.zw), ff_mul(a.zw, b.xy)));
+}}
+
+vec4 ffc_sqr(vec4 a) {{
+    return vec4(ff_add(ff_mul(a.xy, a.xy), -ff_mul(a.zw, a.zw)), 2.0 * ff_mul(a.xy, a.zw));
+}}
+
+vec4 ffc_pow(vec4 z, int n) {{
+    // repeated squaring like complex_power
+    vec4 result = vec4(1.0, 0.0, 0.0, 0.0);
+    for (; n > 0; n >>= 1) {{
+        if ((n & 1) == 1) {{
+            result = ffc_mul(result, z);
+        }}
+        z = ffc_sqr(z);
+    }}
+    return result;
+}}
+
+vec4 ffc_conj(vec4 z) {{
+    return vec4(z.xy, -z.zw);
+}}
+
+vec4 ffc_abs(vec4 z) {{
+    // the sign of hi + lo is the sign of hi
+    return vec4(z.x < 0.0 ? -z.xy : z.xy, z.z < 0.0 ? -z.zw : z.zw);
+}}
+
+vec2 ff_range(vec2 range, vec2 range_lo, out vec2 span) {{
+    // the start of the range and its length, see set_view_uniforms
+    vec2 start = vec2(range.x, range_lo.x);
+    span = ff_add(vec2(range.y, range_lo.y), -start);
+    return start;
+}}
+
+vec4 fractal_iteration(vec4 z, vec4 c) {{
+    return ffc_add({float_float_power}, c);
+}}
+
+int check_interior(vec2 c) {{
+{interior_check}
+    return 0;
+}}
+
+int calculate_iters(vec4 pos, out vec2 channels) {{
+    // calculate_iters of calculate_iters_template with the orbit in float-float, the derivative only needs floats
+    vec4 z = {initial_z};
+    vec4 c = {initial_c};
+    channels = vec2(u_maxIter, -1.0);
+
+    if (check_interior(c.xz) == u_maxIter) {{
+        return u_maxIter;
     }}
 
     int iters = 0;
     float R = {escape_radius};
 
-    if (!usepreturbation) {{
-        while (dot(z, z) < R * R && iters < u_maxIter) {{
-            z = fractal_iteration(z, c);
-            iters++;
+    vec2 real_span;
+    ff_range(u_real_range, u_real_range_lo, real_span);
+    float pixel_size = real_span.x / u_resolution.x;
+    vec2 d = vec2({initial_derivative} * pixel_size, 0.0);
+
+    const bool periodicity_check = {periodicity_check};
+    vec4 z_saved = z;
+    int next_save = 1;
+
+    while (dot(z.xz, z.xz) < R * R && iters < u_maxIter) {{
+        if (track_derivative) {{
+            d = derivative_iteration(z.xz, d, c.xz, pixel_size);
         }}
+        z = fractal_iteration(z, c);
+        iters++;
+
+        if (periodicity_check) {{
+            vec4 difference = ffc_add(z, -z_saved);
+            if (abs(difference.x) < {periodicity_tolerance} && abs(difference.z) < {periodicity_tolerance}) {{
+                return u_maxIter;
+            }}
+            if (iters == next_save) {{
+                z_saved = z;
+                next_save *= 2;
+            }}
+        }}
+    }}
+
+    if (track_derivative && iters < u_maxIter) {{
+        channels = escape_channels(iters, length(z.xz), length(d));
+    }}
+    return iters;
+}}
+
+vec4 map_pixel(vec2 pixel) {{
+    vec2 real_span, imag_span;
+    vec2 real = ff_add(ff_range(u_real_range, u_real_range_lo, real_span), ff_mul(real_span, vec2(pixel.x / u_resolution.x, 0.0)));
+    vec2 imag = ff_add(ff_range(u_imag_range, u_imag_range_lo, imag_span), ff_mul(imag_span, vec2(pixel.y / u_resolution.y, 0.0)));
+    return vec4(real, imag);
+}}
+"""
+
+float_float_powers = {
+    "mandelbrot": "ffc_pow(z, {multi_n})",
+    "julia": "ffc_pow(z, {multi_n})",
+    "mandelbar": "ffc_pow(ffc_conj(z), {multi_n})",
+    "burning_ship": "ffc_sqr(ffc_abs(z))",
+    "buffalo_fractal": "ffc_abs(ffc_pow(z, {multi_n}))"
+}
+
+# Deep zoom: z = Z + dz where Z is a reference orbit computed at arbitrary precision on the CPU (game/preturbation.py)
+# and dz is the small per-pixel delta, which double precision can carry far below the range of the pixel coordinates themselves.
+preturbation_template = """
+layout(std430, binding = 1) readonly buffer ReferenceOrbit {{
+    dvec2 reference_orbit[];
+}};
+
+layout(std430, binding = 2) readonly buffer PreturbationParams {{
+    dvec2 view_span;
+    dvec2 series_a;
+    dvec2 series_b;
+    dvec2 series_c;
+    int orbit_length;
+    int series_skip;
+}};
+
+dvec2 cmul_double(dvec2 a, dvec2 b) {{
+    return dvec2(a.x * b.x - a.y * b.y, a.x * b.y + a.y * b.x);
+}}
 
-        return iters;
+double diffabs(double c, double d) {{
+    // |c + d| - |c| without cancellation
+    if (c >= 0.0) {{
+        return c + d >= 0.0 ? d : -(2.0 * c + d);
     }}
+    return c + d > 0.0 ? 2.0 * c + d : -d;
+}}
+
+{delta_calc_func}
 
-    {vec2type} delta = c - u_center;
-    {vec2type} eps = {vec2type}(0.0);
-    {vec2type} zn = {vec2type}(0, 0);
+int calculate_preturbation_iters(vec2 pixel, out vec2 channels) {{
+    dvec2 offset = (dvec2(pixel) / dvec2(u_resolution) - 0.5) * view_span;
+    dvec2 dc = {delta_c};
+    channels = vec2(u_maxIter, -1.0);
 
-    while (dot(zn, zn) < R * R && iters < u_maxIter) {{
-        vec2 Z = texelFetch(orbit, ivec2(iters, 0), 0).xy;
-        {vec2type} eps_sq = {vec2type}(eps.x * eps.x - eps.y * eps.y, 2.0 * eps.x * eps.y);
-        {vec2type} term1 = {vec2type}(2.0 * Z.x * eps.x - 2.0 * Z.y * eps.y, 2.0 * Z.x * eps.y + 2.0 * Z.y * eps.x);
-        eps = term1 + eps_sq + delta;
-        zn = Z + eps;
+    // series approximation, skips the first series_skip iterations
+    dvec2 dz = cmul_double(offset, series_a + cmul_double(offset, series_b + cmul_double(offset, series_c)));
+    int iters = series_skip;
+    int ref = series_skip;
+    double R = {escape_radius};
 
+    // the derivative starts as the one of the series, in pixels like in calculate_iters
+    double pixel_size = view_span.x / double(u_resolution.x);
+    dvec2 d = (series_a + cmul_double(offset, 2.0 * series_b + 3.0 * cmul_double(offset, series_c))) * pixel_size;
+    dvec2 z;
+
+    while (iters < u_maxIter) {{
+        dvec2 Z = reference_orbit[ref];
+        z = Z + dz;
+        double z_squared = dot(z, z);
+
+        if (z_squared >= R * R) {{
+            break;
+        }}
+
+        // Glitch: the pixel got closer to the critical point than to the reference, or the reference escaped.
+        // Rebase onto the start of the orbit, which is always a valid secondary reference.
+        if (z_squared < dot(dz, dz) || ref == orbit_length - 1) {{
+            Z = reference_orbit[0];
+            dz = z - Z;
+            ref = 0;
+        }}
+
+        if (track_derivative) {{
+            d = delta_derivative_iteration(z, d, dvec2(0.0), pixel_size);
+        }}
+        dz = delta_iteration(Z, dz, dc);
+        ref++;
         iters++;
     }}
 
+    if (track_derivative && iters < u_maxIter) {{
+        channels = escape_channels(iters, float(length(z)), float(length(d)));
+    }}
     return iters;
 }}
+"""
 
-{vec2type} map_pixel({floattype} x, {floattype} y, {vec2type} resolution, {vec2type} real_range, {vec2type} imag_range) {{
-    {floattype} real = real_range.x + (x / resolution.x) * (real_range.y - real_range.x);
-    {floattype} imag = imag_range.x + (y / resolution.y) * (imag_range.y - imag_range.x);
-    return {vec2type}(real, imag);
+mandelbrot_interior_check = """
+    // main cardioid and period 2 bulb, both entirely inside the set
+    {floattype} q = (c.x - 0.25) * (c.x - 0.25) + c.y * c.y;
+    if (q * (q + c.x - 0.25) <= 0.25 * c.y * c.y || (c.x + 1.0) * (c.x + 1.0) + c.y * c.y <= 0.0625) {{
+        return u_maxIter;
+    }}
+"""
+
+preturbation_stub = """
+int calculate_preturbation_iters(vec2 pixel, out vec2 channels) {{
+    channels = vec2(0.0);
+    return 0;
 }}
+"""
+
+# Escape counts of a finished frame for automatic max iterations, see IterationBuffers.read_escape_histogram. RenderStats continues the
+# block of the iteration kernel, every workgroup sums its pixels in shared memory and adds them to the buffer once.
+escape_histogram_template = """#version 430 core
+layout (local_size_x = {local_size_x}, local_size_y = {local_size_y}, local_size_z = 1) in;
+layout(binding = 1, {iters_format}) readonly uniform image2D img_iters;
+uniform int u_maxIter;
+
+layout(std430, binding = 3) buffer RenderStats {{
+    uint reused_samples;
+    uint computed_samples;
+    uint capped_samples;
+    uint escape_bins[{bins}];
+}};
+
+shared uint local_bins[{bins} + 1];
 
 void main() {{
+    uint index = gl_LocalInvocationIndex;
+    uint group_size = gl_WorkGroupSize.x * gl_WorkGroupSize.y;
+    for (uint bin = index; bin <= {bins}; bin += group_size) {{
+        local_bins[bin] = 0u;
+    }}
+    barrier();
+
     ivec2 texel_coord = ivec2(gl_GlobalInvocationID.xy);
-    {vec2type} pos = map_pixel({floattype}(texel_coord.x), {floattype}(texel_coord.y), u_resolution, u_real_range, u_imag_range);
-    int iters = calculate_iters(pos);
-    vec4 value = getColor(iters);
-    imageStore(img_output, texel_coord, value);
+    if (all(lessThan(texel_coord, imageSize(img_iters)))) {{
+        int iters = int(imageLoad(img_iters, texel_coord).x);
+        // the last entry counts the pixels at the limit, bins are [k, k + 1) * u_maxIter / {bins} like np.histogram's
+        if (iters >= u_maxIter) {{
+            atomicAdd(local_bins[{bins}], 1u);
+        }}
+        else if (iters >= 0) {{
+            atomicAdd(local_bins[iters * {bins} / u_maxIter], 1u);
+        }}
+    }}
+    barrier();
+
+    for (uint bin = index; bin <= {bins}; bin += group_size) {{
+        if (local_bins[bin] > 0u && bin == {bins}) {{
+            atomicAdd(capped_samples, local_bins[bin]);
+        }}
+        else if (local_bins[bin] > 0u) {{
+            atomicAdd(escape_bins[bin], local_bins[bin]);
+        }}
+    }}
 }}
 """
 
 sierpinsky_carpet_compute_source = """#version 430 core
-uniform int u_depth;
-uniform int u_zoom;
-uniform vec2 u_center;
-layout (local_size_x = 1, local_size_y = 1, local_size_z = 1) in;
+uniform ivec2 u_low;
+uniform vec2 u_fraction;
+uniform float u_scale;
+uniform int u_modulus;
+uniform int u_digits;
+uniform int u_skip;
+uniform ivec4 u_high_holes;
+layout (local_size_x = {local_size_x}, local_size_y = {local_size_y}, local_size_z = 1) in;
 layout(location = 0, rgba32f) uniform image2D img_output;
 void main() {{
-    {vec2type} centered = {vec2type}(gl_GlobalInvocationID.xy) - u_center;
-    {vec2type} zoomed = centered / u_zoom;
-    {vec2type} final_coord = zoomed + u_center;
-    ivec2 coord = ivec2(final_coord);
-    bool isHole = false;
-    for (int i = 0; i < u_depth; ++i) {{
-        if (coord.x % 3 == 1 && coord.y % 3 == 1) {{
-            isHole = true;
-            break;
-        }}
+    if (any(greaterThanEqual(ivec2(gl_GlobalInvocationID.xy), imageSize(img_output)))) {{
+        return;
+    }}
+
+    // cells of the finest visible level, relative to the view origin, the digits above u_modulus come from the host
+    {vec2type} cells = {vec2type}(u_fraction) + {vec2type}(gl_GlobalInvocationID.xy) * {floattype}(u_scale);
+    ivec2 coord = u_low + ivec2(floor(cells));
+    ivec2 carry = ivec2(greaterThanEqual(coord, ivec2(u_modulus)));
+    coord -= carry * u_modulus;
+    bool isHole = u_high_holes[carry.x + 2 * carry.y] != 0;
+    for (int i = 0; i < u_digits && !isHole; ++i) {{
+        isHole = i >= u_skip && coord.x % 3 == 1 && coord.y % 3 == 1;
         coord /= 3;
     }}
     vec4 color = isHole ? vec4(0, 0, 0, 1) : vec4(1, 1, 1, 1);
@@ -137,6 +725,20 @@ void main() {{
 }}
 """
 
+# z^n by repeated squaring, unlike pow(), atan() and cos() it has double overloads and is exact for the integer n of the multi-n fractals
+complex_power_calc = """
+{vec2type} complex_power({vec2type} z, int n) {{
+    {vec2type} result = {vec2type}(1.0, 0.0);
+    for (; n > 0; n >>= 1) {{
+        if ((n & 1) == 1) {{
+            result = {vec2type}(result.x * z.x - result.y * z.y, result.x * z.y + result.y * z.x);
+        }}
+        z = {vec2type}(z.x * z.x - z.y * z.y, 2.0 * z.x * z.y);
+    }}
+    return result;
+}}
+"""
+
 normal_julia_calc = """
 {vec2type} fractal_iteration ({vec2type} z, {vec2type} c) {{
     int n = {multi_n};
@@ -145,14 +747,9 @@ normal_julia_calc = """
 }}
 """
 
-multi_julia_calc = """
+multi_julia_calc = complex_power_calc + """
 {vec2type} fractal_iteration ({vec2type} z, {vec2type} c) {{
-    {floattype} n = {floattype}({multi_n});
-    {floattype} r = length(z);
-    {floattype} theta = atan(z.y, z.x);
-    {floattype} r_pow = pow(r, n);
-
-    return {vec2type}(r_pow * cos(n * theta), r_pow * sin(n * theta)) + c;
+    return complex_power(z, {multi_n}) + c;
 }}
 """
 
@@ -165,17 +762,10 @@ mandelbrot_calc = """
 }}
 """
 
-multibrot_calc = """
+multibrot_calc = complex_power_calc + """
 {vec2type} fractal_iteration ({vec2type} z, {vec2type} c) {{
-    {floattype} n = {multi_n};
-    {floattype} r = length(z);
-    {floattype} theta = atan(z.y, z.x);
-
-    {floattype} r_n = pow(r, n);
-    {floattype} theta_n = n * theta;
-
-    return r_n * {vec2type}(cos(theta_n), sin(theta_n)) + c;
-}} 
+    return complex_power(z, {multi_n}) + c;
+}}
 """
 
 mandelbar_calc = """
@@ -187,16 +777,9 @@ mandelbar_calc = """
 }}
 """
 
-multi_mandelbar_calc = """
+multi_mandelbar_calc = complex_power_calc + """
 {vec2type} fractal_iteration ({vec2type} z, {vec2type} c) {{
-    {floattype} n = {multi_n};
-    {floattype} r = length(z);
-    {floattype} theta = atan(-z.y, z.x);
-
-    {floattype} r_n = pow(r, n);
-    {floattype} theta_n = n * theta;
-
-    return r_n * {vec2type}(cos(theta_n), sin(theta_n)) + c;
+    return complex_power({vec2type}(z.x, -z.y), {multi_n}) + c;
 }}
 """
 
@@ -208,16 +791,9 @@ buffalo_fractal_calc = """
 }}
 """
 
-multi_buffalo_fractal_calc = """
+multi_buffalo_fractal_calc = complex_power_calc + """
 {vec2type} fractal_iteration ({vec2type} z, {vec2type} c) {{
-    {floattype} n = {floattype}({multi_n});
-    {floattype} r = length(z);
-    {floattype} theta = atan(z.y, z.x);
-    {floattype} r_n = pow(r, n);
-    {floattype} theta_n = n * theta;
-    {floattype} zn_real = r_n * cos(theta_n);
-    {floattype} zn_imag = r_n * sin(theta_n);
-    return {vec2type}(abs(zn_real) + c.x, abs(zn_imag) + c.y);
+    return abs(complex_power(z, {multi_n})) + c;
 }}
 """
 
@@ -319,17 +895,507 @@ newton_fractal_calc = """{vec2type} cmul({vec2type} a, {vec2type} b) {{
 }}
 """
 
-def create_sierpinsky_carpet_shader(width, height, precision="single"):
-    shader_source = sierpinsky_carpet_compute_source
+# Derivatives for the channels, see the derivative steps in game/cpu_engine.py. Also compiled in double precision
+# as delta_derivative_iteration for perturbation, where z is the full value reference + delta.
+holomorphic_derivative_calc = """
+{vec2type} {derivative_name}({vec2type} z, {vec2type} d, {vec2type} c, {floattype} pixel_size) {{
+    // n z^(n - 1) d, plus the pixel size for the sets where c varies{conjugate}
+    {vec2type} power = {vec2type}({multi_n}, 0.0);
+    for (int i = 1; i < {multi_n}; i++) {{
+        power = {vec2type}(power.x * z.x - power.y * z.y, power.x * z.y + power.y * z.x);
+    }}
+    return {vec2type}(power.x * d.x - power.y * d.y, power.x * d.y + power.y * d.x) + {vec2type}({derivative_c} * pixel_size, 0.0);
+}}
+"""
+
+scalar_derivative_calc = """
+{vec2type} {derivative_name}({vec2type} z, {vec2type} d, {vec2type} c, {floattype} pixel_size) {{
+    // abs() is not holomorphic, n |z|^(n - 1) |d| + 1 bounds the growth of the derivative instead
+    {floattype} scale = {floattype}({degree});
+    for (int i = 1; i < {degree}; i++) {{
+        scale *= length(z);
+    }}
+    return {vec2type}(scale * length(d) + pixel_size, 0.0);
+}}
+"""
+
+lambda_derivative_calc = """
+{vec2type} {derivative_name}({vec2type} z, {vec2type} d, {vec2type} c, {floattype} pixel_size) {{
+    // the step is c z w with w = (1 + i) - z, so this is z w + c (w - z) d
+    if (z.x == 0) {{
+        z.x = 0.5;
+    }}
+    {vec2type} w = {vec2type}(1.0, 1.0) - z;
+    {vec2type} e = w - z;
+    {vec2type} ce = {vec2type}(c.x * e.x - c.y * e.y, c.x * e.y + c.y * e.x);
+    return {vec2type}(z.x * w.x - z.y * w.y, z.x * w.y + z.y * w.x) * pixel_size + {vec2type}(ce.x * d.x - ce.y * d.y, ce.x * d.y + ce.y * d.x);
+}}
+"""
+
+derivative_stub = """
+{vec2type} {derivative_name}({vec2type} z, {vec2type} d, {vec2type} c, {floattype} pixel_size) {{
+    return d;
+}}
+"""
+
+def get_derivative_calc(fractal_type):
+    if fractal_type in ("mandelbrot", "julia", "mandelbar"):
+        return holomorphic_derivative_calc
+    elif fractal_type in ("buffalo_fractal", "burning_ship"):
+        return scalar_derivative_calc
+    elif fractal_type == "lambda_fractal":
+        return lambda_derivative_calc
+    return derivative_stub
+
+mandelbrot_delta_calc = """
+dvec2 delta_iteration(dvec2 Z, dvec2 dz, dvec2 dc) {{
+    // (Z + dz)^2 + c + dc - (Z^2 + c)
+    return cmul_double(2.0 * Z + dz, dz) + dc;
+}}
+"""
+
+delta_power_calc = """
+const double binomials[{multi_n} + 1] = double[]({binomials});
+
+dvec2 delta_power(dvec2 Z, dvec2 dz) {{
+    // (Z + dz)^n - Z^n = sum binomial(n, k) * Z^(n - k) * dz^k for k >= 1, evaluated with Horner's scheme in dz
+    dvec2 Z_powers[{multi_n}];
+    Z_powers[0] = dvec2(1.0, 0.0);
+    for (int i = 1; i < {multi_n}; i++) {{
+        Z_powers[i] = cmul_double(Z_powers[i - 1], Z);
+    }}
+
+    dvec2 result = dvec2(1.0, 0.0);
+    for (int k = {multi_n} - 1; k >= 1; k--) {{
+        result = cmul_double(result, dz) + binomials[k] * Z_powers[{multi_n} - k];
+    }}
+
+    return cmul_double(result, dz);
+}}
+"""
+
+multibrot_delta_calc = delta_power_calc + """
+dvec2 delta_iteration(dvec2 Z, dvec2 dz, dvec2 dc) {{
+    return delta_power(Z, dz) + dc;
+}}
+"""
+
+mandelbar_delta_calc = delta_power_calc + """
+dvec2 delta_iteration(dvec2 Z, dvec2 dz, dvec2 dc) {{
+    return delta_power(dvec2(Z.x, -Z.y), dvec2(dz.x, -dz.y)) + dc;
+}}
+"""
+
+burning_ship_delta_calc = """
+dvec2 delta_iteration(dvec2 Z, dvec2 dz, dvec2 dc) {{
+    return dvec2(
+        (2.0 * Z.x + dz.x) * dz.x - (2.0 * Z.y + dz.y) * dz.y + dc.x,
+        2.0 * diffabs(Z.x * Z.y, Z.x * dz.y + dz.x * Z.y + dz.x * dz.y) + dc.y
+    );
+}}
+"""
+
+buffalo_fractal_delta_calc = """
+dvec2 delta_iteration(dvec2 Z, dvec2 dz, dvec2 dc) {{
+    return dvec2(
+        diffabs(Z.x * Z.x - Z.y * Z.y, (2.0 * Z.x + dz.x) * dz.x - (2.0 * Z.y + dz.y) * dz.y) + dc.x,
+        2.0 * diffabs(Z.x * Z.y, Z.x * dz.y + dz.x * Z.y + dz.x * dz.y) + dc.y
+    );
+}}
+"""
+
+def parse_workgroup_size(workgroup_size):
+    if isinstance(workgroup_size, str):
+        return tuple(map(int, workgroup_size.split("x")))
+
+    return tuple(workgroup_size)
+
+def get_workgroup_count(width, height, workgroup_size):
+    local_size_x, local_size_y = parse_workgroup_size(workgroup_size)
+    # ceil-div, the shaders discard the invocations that fall outside the image
+    return -(-width // local_size_x), -(-height // local_size_y)
+
+def measure_dispatch_time(shader_program, workgroup_count, repeats=5):
+    with shader_program:
+        shader_program.dispatch(*workgroup_count, 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS) # warm-up, the first dispatch includes driver-side setup
+        pyglet.gl.glFinish()
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            shader_program.dispatch(*workgroup_count, 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+        pyglet.gl.glFinish()
+
+    return (time.perf_counter() - start) / repeats
+
+subdivision_stages = {"start": 1, "classify": 2, "refine": 3, "finish": 4} # 0 is a plain dispatch
+
+def dispatch_subdivided(shader_program, width, height, workgroup_size, tile_size=subdivision_tile_size):
+    # Mariani-Silver: the grid lines every tile_size pixels are computed and a tile whose whole border has one value is filled with it,
+    # the others are looked at again on the grid of half the size, down to single pixels. tile_size has to be a power of two.
+    if isinstance(shader_program, CPUIterCalcProgram):
+        shader_program.dispatch_subdivided(tile_size)
+        return
+
+    # Full-screen dispatches cost the same however many pixels return early, so filling a level and computing the next grid share one.
+    def run_stage(stage, size, spacing, invocations_x, invocations_y):
+        shader_program["u_subdivision_stage"] = subdivision_stages[stage]
+        shader_program["u_subdivision_size"] = size
+        shader_program["u_subdivision_spacing"] = spacing
+        shader_program.dispatch(*get_workgroup_count(invocations_x, invocations_y, workgroup_size), 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+
+    with shader_program:
+        run_stage("start", tile_size, tile_size, width, height)
+
+        size = tile_size
+        while size >= subdivision_min_tile_size:
+            tiles_x, tiles_y = -(-width // size), -(-height // size)
+            run_stage("classify", size, size, tiles_x, tiles_y)
+            run_stage("refine", size, size // 2 if size > subdivision_min_tile_size else 1, width, height)
+            size //= 2
+
+        run_stage("finish", size * 2, 1, tiles_x, tiles_y)
+        shader_program["u_subdivision_stage"] = 0
+
+def dispatch_antialiasing(shader_program, iteration_buffers, x, y, workgroup_size):
+    # Computes the samples at the (x, y) positions in pixels with the uniforms of the frame, one row per position like calculate_iters' samples
+    if isinstance(shader_program, CPUIterCalcProgram):
+        return shader_program.calculate_positions(x, y)
+
+    samples = np.zeros((len(x), 4), dtype=np.float32)
+    samples[:, 0], samples[:, 1] = x, y
+
+    if len(samples):
+        local_size_x, local_size_y = parse_workgroup_size(workgroup_size)
+        workgroups = -(-len(samples) // (local_size_x * local_size_y))
+        rows = -(-workgroups // 65535) # the smallest maximum workgroup count GL allows per dimension
+
+        sample_buffer = upload_storage_buffer(4, samples)
+        with shader_program:
+            shader_program["u_antialias"] = True
+            shader_program["u_antialias_count"] = len(samples)
+            shader_program.dispatch(-(-workgroups // rows), rows, 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+            shader_program["u_antialias"] = False
+
+        sample_buffer.bind()
+        pyglet.gl.glGetBufferSubData(pyglet.gl.GL_ARRAY_BUFFER, 0, samples.nbytes, samples.ctypes.data)
+
+    if iteration_buffers.channels:
+        return samples[:, :3]
+    return samples[:, 0].astype(np.int32)
+
+# Bits the kernels resolve a view to, float-float is a pair of floats. The double kernel iterates in doubles but gets its view as the
+# float uniforms plus the floats they round off (set_view_uniforms), which is no more than float-float holds.
+precision_bits = {"single": 24, "float-float": 48, "double": 48}
+
+def get_required_bits(real_min, real_max, imag_min, imag_max, width):
+    # bits it takes to tell neighbouring pixels apart at the magnitude of the view's coordinates, orbits reach magnitude 1 anyway
+    scale = max(max(abs(mpf(value)) for value in (real_min, real_max, imag_min, imag_max)), 1)
+    return float(mp.log(scale * width / (mpf(real_max) - mpf(real_min)), 2))
+
+def get_precision_ladder(fractal_type, multi_n=2, float_float=False):
+    # The kernels as (precision, perturbation), cheapest first. float_float puts the emulated doubles in front of the real ones,
+    # they are cheaper where fp64 is slow. Perturbation stays exact at any depth, its reference orbit has arbitrary precision.
+    if fractal_type == "newton_fractal":
+        return [("single", False)]
+
+    ladder = [("single", False)]
+    if float_float and fractal_type in float_float_powers:
+        ladder.append(("float-float", False))
+    ladder.append(("double", False))
+    if supports_preturbation(fractal_type, multi_n):
+        ladder.append(("double", True))
+    return ladder
+
+def is_exact_enough(precision, use_preturbation, required_bits, margin=precision_margin_bits):
+    return use_preturbation or precision_bits[precision] - margin >= required_bits
+
+def select_precision(ladder, required_bits):
+    # the cheapest kernel that is exact enough, the most exact one if none is
+    for precision, use_preturbation in ladder:
+        if is_exact_enough(precision, use_preturbation, required_bits):
+            return precision, use_preturbation
+    return ladder[-1]
+
+def split_float(value):
+    # two floats whose sum is value to about 48 bits, the hi and lo of a float-float number
+    high = float(np.float32(float(value)))
+    return high, float(np.float32(float(value - high)))
+
+def set_view_uniforms(shader_program, real_min, real_max, imag_min, imag_max):
+    # The ranges are float uniforms, the lo uniforms carry what they round off for the double and float-float kernels.
+    # Coordinates can be mpf, the NumPy engine reads the ranges as Python floats.
+    shader_program["u_real_range"] = (float(real_min), float(real_max))
+    shader_program["u_imag_range"] = (float(imag_min), float(imag_max))
+    shader_program["u_real_range_lo"] = (split_float(real_min)[1], split_float(real_max)[1])
+    shader_program["u_imag_range_lo"] = (split_float(imag_min)[1], split_float(imag_max)[1])
+
+def supports_compute_shaders():
+    return pyglet.gl.current_context.get_info().have_version(4, 3)
+
+def upload_texture(texture, data, fmt=pyglet.gl.GL_RED):
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    pyglet.gl.glBindTexture(texture.target, texture.id)
+    pyglet.gl.glTexSubImage2D(texture.target, 0, 0, 0, texture.width, texture.height, fmt, pyglet.gl.GL_FLOAT, data.ctypes.data)
+
+def create_palette_texture(palette, size=1024):
+    colors = palettes[palette](np.linspace(0.0, 1.0, size, dtype=np.float32))
+
+    palette_texture = pyglet.image.Texture.create(size, 1, internalformat=pyglet.gl.GL_RGBA32F, min_filter=pyglet.gl.GL_LINEAR, mag_filter=pyglet.gl.GL_LINEAR)
+    upload_texture(palette_texture, colors, pyglet.gl.GL_RGBA)
+    return palette_texture
+
+def create_coloring_program(fractal_type, max_iter, smooth_coloring=False):
+    # smooth_coloring needs the iteration buffers of a program created with channels
+    coloring_program = pyglet.gl.current_context.create_program((pyglet.sprite.vertex_source, "vertex"), (coloring_fragment_source, "fragment"))
+
+    with coloring_program:
+        coloring_program["palette"] = 1
+        coloring_program["u_maxIter"] = int(max_iter)
+        coloring_program["u_root_coloring"] = fractal_type == "newton_fractal"
+        coloring_program["u_smooth_coloring"] = smooth_coloring
+        coloring_program["antialiased"] = 2
+        coloring_program["u_antialiased"] = False
+
+    return coloring_program
+
+class CPUIterCalcProgram:
+    # Same interface as the ComputeShaderProgram returned by create_iter_calc_shader, but dispatching renders with the NumPy engine.
+    # Without iteration buffers the counts only live in self.iters, which is all the batch and video renderers need.
+    def __init__(self, fractal_type, width, height, precision="single", multi_n=2, escape_radius=2, julia_type="Classic swirling", workers=1, iteration_buffers=None, periodicity_check=True, channels=False):
+        self.fractal_type = fractal_type
+        self.width = width
+        self.height = height
+        self.iteration_buffers = iteration_buffers
+        self.precision = precision
+        self.multi_n = multi_n
+        self.escape_radius = escape_radius
+        self.julia_type = julia_type
+        self.periodicity_check = periodicity_check
+        self.channels = channels
+        self.uniforms = {"u_pass_scale": 1, "u_previous_scale": 0, "u_reuse": False}
+        self.preturbation_reference = None
+        self.iters = self.create_iters()
+        self.previous_iters = self.iters
+        self.reuse_stats = (0, 0)
+        self.tile_renderer = TileRenderer(width, height, workers, channels=channels) if workers != 1 and get_mp_context() else None
+        self.subdivision_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        ...
+
+    def __getitem__(self, name):
+        return self.uniforms[name]
+
+    def __setitem__(self, name, value):
+        self.uniforms[name] = value
+
+    def create_iters(self):
+        # the layout of calculate_iters, a channel axis with channels
+        if self.channels:
+            return np.zeros((self.height, self.width, 3), dtype=np.float32)
+        return np.zeros((self.height, self.width), dtype=np.int32)
+
+    def calculate_samples(self, scale, mask):
+        width, height = self.width, self.height
+
+        if self.preturbation_reference:
+            return calculate_preturbation_iters(self.fractal_type, width, height, max_iter=self.uniforms["u_maxIter"], multi_n=self.multi_n, escape_radius=self.escape_radius, mask=mask, step=scale, channels=self.channels, **self.preturbation_reference)
+        elif self.tile_renderer and scale == 1:
+            return self.tile_renderer.render(self.fractal_type, self.uniforms["u_real_range"], self.uniforms["u_imag_range"], self.uniforms["u_maxIter"], self.precision, self.multi_n, self.escape_radius, self.julia_type, mask, self.periodicity_check)
+
+        return calculate_iters(self.fractal_type, width, height, self.uniforms["u_real_range"], self.uniforms["u_imag_range"], self.uniforms["u_maxIter"], self.precision, self.multi_n, self.escape_radius, self.julia_type, mask=mask, step=scale, periodicity_check=self.periodicity_check, channels=self.channels)
+
+    def calculate_positions(self, x, y):
+        if self.preturbation_reference:
+            return calculate_preturbation_iters(self.fractal_type, self.width, self.height, max_iter=self.uniforms["u_maxIter"], multi_n=self.multi_n, escape_radius=self.escape_radius, channels=self.channels, samples=(x, y), **self.preturbation_reference)
+
+        return calculate_iters(self.fractal_type, self.width, self.height, self.uniforms["u_real_range"], self.uniforms["u_imag_range"], self.uniforms["u_maxIter"], self.precision, self.multi_n, self.escape_radius, self.julia_type, periodicity_check=self.periodicity_check, channels=self.channels, samples=(x, y))
+
+    def dispatch_subdivided(self, tile_size):
+        self.subdivision_size = tile_size
+        try:
+            self.dispatch()
+        finally:
+            self.subdivision_size = 0
+
+    def reproject(self, sample_x, sample_y, compute):
+        # Same rule as reproject() in the shader: reuse a sample only if it lands on a pixel of the previous frame.
+        width, height = self.width, self.height
+        previous_x = self.uniforms["u_previous_origin"][0] + sample_x * self.uniforms["u_previous_step"][0]
+        previous_y = self.uniforms["u_previous_origin"][1] + sample_y * self.uniforms["u_previous_step"][1]
+        texel_x, texel_y = np.rint(previous_x).astype(np.intp), np.rint(previous_y).astype(np.intp)
+
+        valid_x = (np.abs(previous_x - texel_x) <= 0.001) & (texel_x >= 0) & (texel_x < width)
+        valid_y = (np.abs(previous_y - texel_y) <= 0.001) & (texel_y >= 0) & (texel_y < height)
+        reused = compute & valid_y[:, np.newaxis] & valid_x[np.newaxis, :]
+        previous_samples = self.previous_iters[np.ix_(np.clip(texel_y, 0, height - 1), np.clip(texel_x, 0, width - 1))]
+
+        previous_max_iter = self.uniforms.get("u_previous_max_iter") or self.uniforms["u_maxIter"]
+        reused &= (get_counts(previous_samples) < previous_max_iter) | (self.uniforms["u_maxIter"] <= previous_max_iter)
+
+        return reused, previous_samples
+
+    def dispatch(self, x=1, y=1, z=1, barrier=None):
+        width, height = self.width, self.height
+        scale, previous_scale = int(self.uniforms["u_pass_scale"]), int(self.uniforms["u_previous_scale"])
+        sample_x, sample_y = np.arange(0, width, scale), np.arange(0, height, scale)
+
+        if not previous_scale:
+            # first pass of a frame, what was rendered so far becomes the frame reprojection reads from
+            self.previous_iters, self.iters = self.iters, self.create_iters()
+            self.reuse_stats = (0, 0)
+
+        samples = self.iters[np.ix_(sample_y, sample_x)]
+        compute = np.ones(samples.shape[:2], dtype=bool)
+
+        if previous_scale:
+            compute &= ~((sample_y % previous_scale == 0)[:, np.newaxis] & (sample_x % previous_scale == 0)[np.newaxis, :])
+
+        reused = np.zeros_like(compute)
+        if self.uniforms["u_reuse"]:
+            reused, previous_samples = self.reproject(sample_x, sample_y, compute)
+            samples[reused] = previous_samples[reused]
+            compute &= ~reused
+
+            lowered = reused & (get_counts(samples) >= self.uniforms["u_maxIter"])
+            samples[lowered] = self.uniforms["u_maxIter"]
+            if samples.ndim == 3:
+                samples[lowered, 2] = -1
+
+        if compute.any() and self.subdivision_size:
+            samples[compute] = unresolved
+            samples[:], compute = subdivide_iters(lambda mask: self.calculate_samples(1, mask), samples, self.subdivision_size, subdivision_min_tile_size)
+        elif compute.any():
+            samples[compute] = self.calculate_samples(scale, compute)[compute]
+
+        self.reuse_stats = (self.reuse_stats[0] + int(reused.sum()), self.reuse_stats[1] + int(compute.sum()))
+
+        # every sample fills its scale x scale block like the shader does
+        self.iters = samples.repeat(scale, axis=0).repeat(scale, axis=1)[:height, :width].copy()
+
+        if self.iteration_buffers:
+            upload_texture(self.iteration_buffers.images[0], self.iters, pyglet.gl.GL_RGB if self.channels else pyglet.gl.GL_RED)
+
+    def delete(self):
+        if self.tile_renderer:
+            self.tile_renderer.close()
+            self.tile_renderer = None
+
+pixel_state_strides = {"single": 24, "double": 48}
+
+class IterationBuffers:
+    # Raw iteration counts of the frame being rendered and of the previous one, which reprojection reads from.
+    # With channels they are RGBA32F and also hold the smooth iteration count and the distance estimate.
+    def __init__(self, width, height, channels=False):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.format = pyglet.gl.GL_RGBA32F if channels else pyglet.gl.GL_R32F
+        self.images = [self.create_image() for _ in range(2)]
+        self.antialiased_image = None
+        # RenderStats: reused and computed samples, then the pixels at the limit and the escape bins of read_escape_histogram
+        self.stats_buffer = pyglet.graphics.vertexbuffer.BufferObject((3 + auto_max_iter_bins) * ctypes.sizeof(ctypes.c_uint32))
+        self.pixel_state_buffer = None
+        self.bind()
+
+    def create_image(self):
+        # R32F is a quarter of the memory of the RGBA32F color image it replaced, nearest filtering because iteration counts must not be blended
+        return pyglet.image.Texture.create(self.width, self.height, internalformat=self.format, min_filter=pyglet.gl.GL_NEAREST, mag_filter=pyglet.gl.GL_NEAREST)
+
+    def upload_antialiased(self, pixels, colors):
+        # RGBA image of the antialiased pixels' colors for the coloring program, alpha 0 marks the pixels it colors itself
+        if self.antialiased_image is None:
+            self.antialiased_image = pyglet.image.Texture.create(self.width, self.height, internalformat=pyglet.gl.GL_RGBA32F, min_filter=pyglet.gl.GL_NEAREST, mag_filter=pyglet.gl.GL_NEAREST)
+
+        image = np.zeros((self.height, self.width, 4), dtype=np.float32)
+        image[pixels[:, 1], pixels[:, 0], :3] = colors[:, :3]
+        image[pixels[:, 1], pixels[:, 0], 3] = 1
+        upload_texture(self.antialiased_image, image, pyglet.gl.GL_RGBA)
+
+    def bind(self):
+        self.images[0].bind_image_texture(unit=1, fmt=self.format)
+        self.images[1].bind_image_texture(unit=2, access=pyglet.gl.GL_READ_ONLY, fmt=self.format)
+        pyglet.gl.glBindBufferBase(pyglet.gl.GL_SHADER_STORAGE_BUFFER, 3, self.stats_buffer.id)
+        if self.pixel_state_buffer:
+            pyglet.gl.glBindBufferBase(pyglet.gl.GL_SHADER_STORAGE_BUFFER, 5, self.pixel_state_buffer.id)
+
+    def delete(self):
+        # a zoom video frame with nothing to reproject from is in both slots
+        for image in {id(image): image for image in self.images}.values():
+            image.delete()
+        if self.antialiased_image is not None:
+            self.antialiased_image.delete()
+        self.stats_buffer.delete()
+        if self.pixel_state_buffer:
+            self.pixel_state_buffer.delete()
+
+    def reset_pixel_states(self, precision):
+        # PixelState of the kernel in std430, all zero is a pixel with nothing left to iterate
+        size = self.width * self.height * pixel_state_strides[precision]
+        if self.pixel_state_buffer is None or self.pixel_state_buffer.size != size:
+            self.pixel_state_buffer = pyglet.graphics.vertexbuffer.BufferObject(size)
+            self.bind()
+
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_SHADER_STORAGE_BUFFER, self.pixel_state_buffer.id)
+        pyglet.gl.glClearBufferData(pyglet.gl.GL_SHADER_STORAGE_BUFFER, pyglet.gl.GL_R32UI, pyglet.gl.GL_RED_INTEGER, pyglet.gl.GL_UNSIGNED_INT, None)
+
+    def swap(self):
+        self.images.reverse()
+        self.reset_stats()
+        self.bind()
+
+    def reset_stats(self):
+        self.stats_buffer.set_data((ctypes.c_uint32 * (3 + auto_max_iter_bins))())
+
+    def read_stats(self, shader_program):
+        if isinstance(shader_program, CPUIterCalcProgram):
+            return shader_program.reuse_stats
+
+        stats = (ctypes.c_uint32 * 2)()
+        self.stats_buffer.bind()
+        pyglet.gl.glGetBufferSubData(pyglet.gl.GL_ARRAY_BUFFER, 0, ctypes.sizeof(stats), stats)
+        return stats[0], stats[1]
+
+    def read_escape_histogram(self, shader_program, max_iter, workgroup_size=(8, 8)):
+        # get_escape_histogram of the current frame, on the GPU only the counters are read back instead of the whole frame
+        if isinstance(shader_program, CPUIterCalcProgram):
+            return get_escape_histogram(shader_program.iters, max_iter)
+
+        self.bind()
+        histogram_program = get_compute_program(escape_histogram_template, {"local_size_x": workgroup_size[0], "local_size_y": workgroup_size[1], "iters_format": "rgba32f" if self.channels else "r32f", "bins": auto_max_iter_bins})
+        counters = (ctypes.c_uint32 * (1 + auto_max_iter_bins))()
+        self.stats_buffer.set_data_region(counters, 2 * ctypes.sizeof(ctypes.c_uint32), ctypes.sizeof(counters))
+
+        with histogram_program:
+            histogram_program["u_maxIter"] = int(max_iter)
+            histogram_program.dispatch(*get_workgroup_count(self.width, self.height, workgroup_size), 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+
+        self.stats_buffer.bind()
+        pyglet.gl.glGetBufferSubData(pyglet.gl.GL_ARRAY_BUFFER, 2 * ctypes.sizeof(ctypes.c_uint32), ctypes.sizeof(counters), counters)
+        return np.array(counters[1:], dtype=np.int64), counters[0]
+
+    def read_iters(self):
+        # (height, width), or (height, width, 3) with channels like calculate_iters
+        iters = np.empty((self.height, self.width, 3) if self.channels else (self.height, self.width), dtype=np.float32)
+        pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, self.images[0].id)
+        pyglet.gl.glGetTexImage(pyglet.gl.GL_TEXTURE_2D, 0, pyglet.gl.GL_RGB if self.channels else pyglet.gl.GL_RED, pyglet.gl.GL_FLOAT, iters.ctypes.data)
+        return iters
+
+@traced
+def create_sierpinsky_carpet_shader(width, height, precision="single", workgroup_size=(8, 8), binary_cache=False):
+    local_size_x, local_size_y = parse_workgroup_size(workgroup_size)
 
     replacements = {
         "vec2type": "dvec2" if precision == "double" else "vec2",
-        "floattype": "double" if precision == "double" else "float"
+        "floattype": "double" if precision == "double" else "float",
+        "local_size_x": local_size_x,
+        "local_size_y": local_size_y
     }
 
-    shader_source = shader_source.format_map(replacements)
-
-    shader_program = pyglet.graphics.shader.ComputeShaderProgram(shader_source)
+    shader_program = get_compute_program(sierpinsky_carpet_compute_source, replacements, binary_cache)
 
     sierpinsky_carpet_image = pyglet.image.Texture.create(width, height, internalformat=pyglet.gl.GL_RGBA32F)
 
@@ -338,29 +1404,114 @@ def create_sierpinsky_carpet_shader(width, height, precision="single"):
 
     return shader_program, sierpinsky_carpet_image
 
-def create_iter_calc_shader(fractal_type, width, height, precision="single", multi_n=2, escape_radius=2, julia_type="Classic swirling", use_preturbation=False, preturbation_center=mpc(0, 0), max_iters=0):
-    shader_source = iter_fractal_template
+def set_carpet_uniforms(shader_program, carpet_view):
+    with shader_program:
+        shader_program['u_low'] = carpet_view["low"]
+        shader_program['u_fraction'] = carpet_view["fraction"]
+        shader_program['u_scale'] = carpet_view["scale"]
+        shader_program['u_modulus'] = carpet_view["modulus"]
+        shader_program['u_digits'] = carpet_view["digits"]
+        shader_program['u_skip'] = carpet_view["skip"]
+        shader_program['u_high_holes'] = carpet_view["high_holes"]
+
+def upload_storage_buffer(binding, data):
+    data = np.ascontiguousarray(data)
+    storage_buffer = pyglet.graphics.vertexbuffer.BufferObject(data.nbytes)
+    storage_buffer.set_data(data.ctypes.data)
+    pyglet.gl.glBindBufferBase(pyglet.gl.GL_SHADER_STORAGE_BUFFER, binding, storage_buffer.id)
+    return storage_buffer
+
+def get_preturbation_reference(fractal_type, center, span, max_iter, multi_n=2, julia_type="Classic swirling", escape_radius=2, series_approximation=True, orbit_cache_budget=0):
+    real_span, imag_span = float(span[0]), float(span[1])
+
+    orbit = get_orbit(fractal_type, center, int(max_iter), multi_n, julia_type, escape_radius, min(real_span, imag_span), orbit_cache_budget)
+
+    if series_approximation:
+        series_skip, series_coefficients = calculate_series_approximation(fractal_type, orbit, np.hypot(real_span, imag_span) / 2, multi_n)
+    else:
+        series_skip, series_coefficients = calculate_series_approximation(fractal_type, orbit, 0, multi_n)
+
+    logging.debug(f"{fractal_type} reference orbit: {len(orbit)} iterations, series approximation skips {series_skip}")
+
+    return {
+        "span": (real_span, imag_span),
+        "orbit": orbit,
+        "series_skip": series_skip,
+        "series_coefficients": series_coefficients
+    }
+
+def update_preturbation_reference(shader_program, fractal_type, center, span, max_iter, multi_n=2, julia_type="Classic swirling", escape_radius=2, series_approximation=True, orbit_cache_budget=0):
+    reference = get_preturbation_reference(fractal_type, center, span, max_iter, multi_n, julia_type, escape_radius, series_approximation, orbit_cache_budget)
+
+    if isinstance(shader_program, CPUIterCalcProgram):
+        shader_program.preturbation_reference = reference
+        return []
+
+    real_span, imag_span = reference["span"]
+    orbit, series_skip, series_coefficients = reference["orbit"], reference["series_skip"], reference["series_coefficients"]
+
+    # std430 layout of PreturbationParams: four dvec2 followed by two ints, padded to the 16 byte dvec2 alignment
+    params = np.zeros(80, dtype=np.uint8)
+    params[:64].view(np.float64)[:] = [real_span, imag_span] + [part for coefficient in series_coefficients for part in (coefficient.real, coefficient.imag)]
+    params[64:72].view(np.int32)[:] = [len(orbit), series_skip]
+
+    return [
+        upload_storage_buffer(1, orbit.view(np.float64)),
+        upload_storage_buffer(2, params)
+    ]
+
+@traced
+def create_iter_calc_shader(fractal_type, width, height, precision="single", multi_n=2, escape_radius=2, julia_type="Classic swirling", use_preturbation=False, workgroup_size=(8, 8), backend="auto", cpu_workers=1, binary_cache=False, periodicity_check=True, channels=False):
+    if precision == "float-float" and fractal_type not in float_float_powers:
+        logging.info(f"The {fractal_type} has no float-float kernel, rendering it in double precision.")
+        precision = "double"
+
+    if backend == "cpu" or (backend == "auto" and not supports_compute_shaders()):
+        iteration_buffers = IterationBuffers(width, height, channels)
+        return CPUIterCalcProgram(fractal_type, width, height, precision, multi_n, escape_radius, julia_type, cpu_workers, iteration_buffers, periodicity_check, channels), iteration_buffers
+
+    local_size_x, local_size_y = parse_workgroup_size(workgroup_size)
 
     replacements = {
         "multi_n": str(multi_n),
         "escape_radius": str(escape_radius),
-        "vec2type": "dvec2" if int(multi_n) == 2 and precision == "double" else "vec2",
-        "floattype": "double" if int(multi_n) == 2 and precision == "double" else "float"
+        "vec2type": {"double": "dvec2", "float-float": "vec4"}.get(precision, "vec2"),
+        "floattype": "double" if precision == "double" else "float",
+        "local_size_x": local_size_x,
+        "local_size_y": local_size_y,
+        "binomials": ", ".join(f"{comb(int(multi_n), k)}.0" for k in range(int(multi_n) + 1)),
+        "delta_c": "dvec2(0.0)" if fractal_type == "julia" else "offset",
+        "periodicity_check": "true" if periodicity_check else "false",
+        "periodicity_tolerance": get_periodicity_tolerance(precision, multi_n),
+        "interior_check": "",
+        **{f"subdivision_{stage}": value for stage, value in subdivision_stages.items()},
+        "iters_format": "rgba32f" if channels else "r32f",
+        "channels": "true" if channels else "false",
+        "degree": get_degree(fractal_type, multi_n),
+        "initial_derivative": "1.0" if fractal_type == "julia" else "0.0",
+        "derivative_c": "0.0" if fractal_type == "julia" else "1.0",
+        "conjugate": "\n    z.y = -z.y;\n    d.y = -d.y;" if fractal_type == "mandelbar" else "",
+        "derivative_name": "derivative_iteration"
     }
 
-    replacements["coloring_func"] = polynomial_coloring.format_map(replacements)
     replacements["fractal_type"] = 0
 
-    if fractal_type == "julia":
+    if fractal_type == "julia" and precision == "float-float":
         replacements["initial_z"] = "pos"
-        replacements["initial_c"] = f"{replacements['vec2type']}{c_for_julia_type[julia_type]}" # this works because if its vec2, it would be vec2(..., ...) for example.
+        replacements["initial_c"] = f"vec4({', '.join(str(part) for value in c_for_julia_type[julia_type] for part in split_float(value))})"
+    elif fractal_type == "julia":
+        # double literals for the double kernel, c rounded to float would make it a different Julia set from the CPU engine's
+        suffix = "LF" if precision == "double" else ""
+        replacements["initial_z"] = "pos"
+        replacements["initial_c"] = f"{replacements['vec2type']}({', '.join(repr(float(value)) + suffix for value in c_for_julia_type[julia_type])})"
     else:
-        replacements["initial_z"] = "vec2(0.0)"
+        replacements["initial_z"] = f"{replacements['vec2type']}(0.0)"
         replacements["initial_c"] = "pos"
 
     if fractal_type == "mandelbrot":
         if int(multi_n) == 2:
             replacements["iter_calc_func"] = mandelbrot_calc.format_map(replacements)
+            replacements["interior_check"] = mandelbrot_interior_check.format_map(replacements)
         else:
             replacements["iter_calc_func"] = multibrot_calc.format_map(replacements)
 
@@ -384,31 +1535,66 @@ def create_iter_calc_shader(fractal_type, width, height, precision="single", mul
             replacements["iter_calc_func"] = multi_julia_calc.format_map(replacements)
 
     elif fractal_type == "buffalo_fractal":
-        replacements["coloring_func"] = fire_coloring.format_map(replacements)
         if int(multi_n) == 2:
             replacements["iter_calc_func"] = buffalo_fractal_calc.format_map(replacements)
         else:
             replacements["iter_calc_func"] = multi_buffalo_fractal_calc.format_map(replacements)
 
     elif fractal_type == "burning_ship":
-        replacements["coloring_func"] = fire_coloring.format_map(replacements)
         replacements["iter_calc_func"] = burning_ship_calc.format_map(replacements)
 
     elif fractal_type == "newton_fractal":
-        replacements["coloring_func"] = newton_coloring.format_map(replacements)
         replacements["iter_calc_func"] = newton_fractal_calc.format_map(replacements)
         replacements["fractal_type"] = 2
 
-    shader_source = shader_source.format_map(replacements)
-
-    shader_program = pyglet.graphics.shader.ComputeShaderProgram(shader_source)
-
-    fractal_image = pyglet.image.Texture.create(width, height, internalformat=pyglet.gl.GL_RGBA32F)
-
-    fractal_image.bind_image_texture(unit=shader_program['img_output'])
+    if precision == "float-float":
+        # the float-float kernel has its own fractal_iteration, the derivative and the interior check get the float part of z and c
+        float_replacements = {**replacements, "vec2type": "vec2", "floattype": "float"}
+        replacements["iter_calc_func"] = ""
+        replacements["interior_check"] = mandelbrot_interior_check.format_map(float_replacements) if fractal_type == "mandelbrot" and int(multi_n) == 2 else ""
+        replacements["derivative_calc_func"] = get_derivative_calc(fractal_type).format_map(float_replacements)
+        replacements["float_float_power"] = float_float_powers[fractal_type].format_map(replacements)
+        replacements["calculate_iters_func"] = float_float_template.format_map(replacements)
+    else:
+        replacements["derivative_calc_func"] = get_derivative_calc(fractal_type).format_map(replacements)
+        replacements["calculate_iters_func"] = calculate_iters_template.format_map(replacements)
 
     if use_preturbation:
-        orbit_image = calculate_orbit(fractal_type, preturbation_center, max_iters, multi_n, julia_type)
-        orbit_image.bind_image_texture(unit=shader_program['orbit'])
-
-    return shader_program, fractal_image
+        if fractal_type in ("mandelbrot", "julia"):
+            replacements["delta_calc_func"] = (mandelbrot_delta_calc if int(multi_n) == 2 else multibrot_delta_calc).format_map(replacements)
+        elif fractal_type == "mandelbar":
+            replacements["delta_calc_func"] = mandelbar_delta_calc.format_map(replacements)
+        elif fractal_type == "burning_ship":
+            replacements["delta_calc_func"] = burning_ship_delta_calc.format_map(replacements)
+        elif fractal_type == "buffalo_fractal":
+            replacements["delta_calc_func"] = buffalo_fractal_delta_calc.format_map(replacements)
+
+        replacements["delta_calc_func"] += get_derivative_calc(fractal_type).format_map({**replacements, "vec2type": "dvec2", "floattype": "double", "derivative_name": "delta_derivative_iteration"})
+
+        replacements["preturbation_func"] = preturbation_template.format_map(replacements)
+    else:
+        replacements["preturbation_func"] = preturbation_stub.format_map(replacements)
+
+    try:
+        shader_program = get_compute_program(iter_fractal_template, replacements, binary_cache)
+    except pyglet.graphics.shader.ShaderException:
+        if backend != "auto":
+            raise
+
+        logging.exception(f"Compiling the {fractal_type} compute shader failed, falling back to the CPU engine.")
+        return create_iter_calc_shader(fractal_type, width, height, precision, multi_n, escape_radius, julia_type, use_preturbation, workgroup_size, "cpu", cpu_workers, binary_cache, periodicity_check, channels)
+
+    iteration_buffers = IterationBuffers(width, height, channels)
+
+    with shader_program:
+        shader_program["u_preturbation"] = use_preturbation
+        shader_program["u_pass_scale"] = 1
+        shader_program["u_previous_scale"] = 0
+        shader_program["u_reuse"] = False
+        shader_program["u_previous_max_iter"] = 0
+        shader_program["u_subdivision_stage"] = 0
+        shader_program["u_antialias"] = False
+        shader_program["u_iter_limit"] = 0
+        shader_program["u_continue"] = False
+
+    return shader_program, iteration_buffers
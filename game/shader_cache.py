@@ -0,0 +1,108 @@
+import os, ctypes, hashlib, logging
+import pyglet
+
+from pyglet.graphics.shader import ComputeShaderProgram, ShaderException, _introspect_uniforms, _introspect_uniform_blocks
+from utils.constants import shader_cache_dir
+
+# Compiled compute programs live for the whole session, keyed by their template and the full replacement dictionary.
+# Optionally the driver's program binary is also kept on disk so the next launch skips compilation too.
+program_cache = {}
+program_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+class BinaryComputeShaderProgram(ComputeShaderProgram):
+    # ComputeShaderProgram restored from glGetProgramBinary output instead of compiled from source.
+    def __init__(self, binary_format, binary):
+        self._id = None
+        self._context = pyglet.gl.current_context
+        self._id = pyglet.gl.glCreateProgram()
+
+        pyglet.gl.glProgramBinary(self._id, binary_format, binary, len(binary))
+
+        status = pyglet.gl.GLint()
+        pyglet.gl.glGetProgramiv(self._id, pyglet.gl.GL_LINK_STATUS, ctypes.byref(status))
+        if not status.value:
+            self.delete()
+            raise ShaderException("Cached program binary was rejected by the driver.")
+
+        self._uniforms = _introspect_uniforms(self._id, True)
+        self._uniform_blocks = _introspect_uniform_blocks(self)
+
+        self.max_work_group_size = self._get_tuple(pyglet.gl.GL_MAX_COMPUTE_WORK_GROUP_SIZE)
+        self.max_work_group_count = self._get_tuple(pyglet.gl.GL_MAX_COMPUTE_WORK_GROUP_COUNT)
+        self.max_shared_memory_size = self._get_value(pyglet.gl.GL_MAX_COMPUTE_SHARED_MEMORY_SIZE)
+        self.max_work_group_invocations = self._get_value(pyglet.gl.GL_MAX_COMPUTE_WORK_GROUP_INVOCATIONS)
+
+def get_driver_id():
+    # Same strings utils.utils.dump_gl logs, a binary is only valid for the exact driver that produced it.
+    info = pyglet.gl.current_context.get_info()
+    return f"{info.get_vendor()}|{info.get_renderer()}|{info.get_version_string()}"
+
+def get_binary_path(shader_source):
+    return os.path.join(shader_cache_dir, hashlib.sha256(shader_source.encode()).hexdigest() + ".bin")
+
+def load_program_binary(shader_source):
+    path = get_binary_path(shader_source)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        driver_id = file.readline().decode(errors="replace").rstrip("\n")
+        binary_format = int.from_bytes(file.read(4), "little")
+        binary = file.read()
+
+    if driver_id != get_driver_id():
+        logging.debug(f"Discarding program binary {path}, it was built by {driver_id}")
+        os.remove(path)
+        return None
+
+    try:
+        return BinaryComputeShaderProgram(binary_format, binary)
+    except ShaderException:
+        logging.debug(f"Discarding program binary {path}, the driver rejected it")
+        os.remove(path)
+        return None
+
+def save_program_binary(shader_program, shader_source):
+    length = pyglet.gl.GLint()
+    pyglet.gl.glGetProgramiv(shader_program.id, pyglet.gl.GL_PROGRAM_BINARY_LENGTH, ctypes.byref(length))
+    if not length.value:
+        return
+
+    binary = ctypes.create_string_buffer(length.value)
+    binary_format = pyglet.gl.GLenum()
+    pyglet.gl.glGetProgramBinary(shader_program.id, length.value, None, ctypes.byref(binary_format), binary)
+
+    os.makedirs(shader_cache_dir, exist_ok=True)
+    with open(get_binary_path(shader_source), "wb") as file:
+        file.write(get_driver_id().encode() + b"\n")
+        file.write(binary_format.value.to_bytes(4, "little"))
+        file.write(binary.raw)
+
+def get_compute_program(template, replacements, binary_cache=False):
+    key = (template, tuple(sorted((name, str(value)) for name, value in replacements.items())))
+
+    if key in program_cache:
+        program_cache_stats["hits"] += 1
+        return program_cache[key]
+
+    shader_source = template.format_map(replacements)
+
+    shader_program = load_program_binary(shader_source) if binary_cache else None
+    if shader_program:
+        program_cache_stats["disk_hits"] += 1
+    else:
+        program_cache_stats["misses"] += 1
+        shader_program = ComputeShaderProgram(shader_source)
+
+        if binary_cache:
+            save_program_binary(shader_program, shader_source)
+
+    logging.debug(f"Shader program cache: {program_cache_stats['hits']} hits, {program_cache_stats['disk_hits']} disk hits, {program_cache_stats['misses']} compiles")
+
+    program_cache[key] = shader_program
+    return shader_program
+
+def release_program(shader_program):
+    # Cached programs stay alive for reuse, anything else (the CPU programs) is freed.
+    if not any(shader_program is cached for cached in program_cache.values()):
+        shader_program.delete()
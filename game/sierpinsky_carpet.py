@@ -1,7 +1,13 @@
-import arcade, arcade.gui, pyglet, json
+import arcade, arcade.gui, pyglet, json, logging
 
-from game.shader import create_sierpinsky_carpet_shader
-from utils.constants import button_style
+from fractions import Fraction
+from mpmath import mp, mpf
+
+from game.shader import create_sierpinsky_carpet_shader, set_carpet_uniforms, parse_workgroup_size, get_workgroup_count, measure_dispatch_time
+from game.shader_cache import release_program
+from game.profiler import trace, trace_gpu, poll_timer_queries, format_timings
+from game.cpu_engine import get_carpet_view
+from utils.constants import button_style, workgroup_sizes
 from utils.preload import button_texture, button_hovered_texture, cursor_texture
 
 class SierpinskyCarpetViewer(arcade.gui.UIView):
@@ -13,21 +19,24 @@ class SierpinskyCarpetViewer(arcade.gui.UIView):
         with open("settings.json", "r") as file:
             self.settings_dict = json.load(file)
 
-        self.depth = self.settings_dict.get("sierpinsky_depth", 10)
-        self.zoom = 1.0
-        self.click_center = (self.width / 2, self.height / 2)
+        self.depth = self.settings_dict.get("sierpinsky_depth", 100)
+        self.workgroup_size = parse_workgroup_size(self.settings_dict.get("sierpinsky_workgroup_size", "8x8"))
+        # exact view: the carpet point under the bottom left pixel and the size of a pixel, both in pixels of the initial view
+        self.origin = (Fraction(0), Fraction(0))
+        self.scale = Fraction(1)
+        self.carpet_view = None
         self.has_controller = False
         
     def on_show_view(self):
         super().on_show_view()
 
-        self.shader_program, self.sierpinsky_carpet_image = create_sierpinsky_carpet_shader(self.window.width, self.window.height, self.settings_dict.get("sierpinsky_precision", "Single").lower())
+        self.shader_program, self.sierpinsky_carpet_image = create_sierpinsky_carpet_shader(self.window.width, self.window.height, self.settings_dict.get("sierpinsky_precision", "Single").lower(), self.workgroup_size, self.settings_dict.get("shader_binary_cache", True))
 
         self.sierpinsky_carpet_sprite = pyglet.sprite.Sprite(img=self.sierpinsky_carpet_image)
 
         self.create_image()
 
-        self.pypresence_client.update(state='Viewing Sierpinsky Carpet', details=f'Zoom: {self.zoom}\nDepth: {self.depth}', start=self.pypresence_client.start_time)
+        self.pypresence_client.update(state='Viewing Sierpinsky Carpet', details=f'Zoom: {self.format_zoom()}\nDepth: {self.depth}', start=self.pypresence_client.start_time)
 
         self.setup_ui()
 
@@ -41,37 +50,85 @@ class SierpinskyCarpetViewer(arcade.gui.UIView):
         self.anchor = self.add_widget(arcade.gui.UIAnchorLayout(size_hint=(1, 1)))
 
         self.info_box = self.anchor.add(arcade.gui.UIBoxLayout(space_between=10, vertical=False), anchor_x="center", anchor_y="top")
-        self.zoom_label = self.info_box.add(arcade.gui.UILabel(text=f"Zoom: {self.zoom}", font_name="Roboto", font_size=16))
-        self.depth_label = self.info_box.add(arcade.gui.UILabel(text=f"Depth: {self.depth}", font_name="Roboto", font_size=16))
+        self.zoom_label = self.info_box.add(arcade.gui.UILabel(text=f"Zoom: {self.format_zoom()}", font_name="Roboto", font_size=16))
+        self.depth_label = self.info_box.add(arcade.gui.UILabel(text=self.get_depth_text(), font_name="Roboto", font_size=16))
+        self.workgroup_label = self.info_box.add(arcade.gui.UILabel(text=f"Workgroup: {self.workgroup_size[0]}x{self.workgroup_size[1]}", font_name="Roboto", font_size=16))
+
+        # F3, the latest time of every traced section, GPU times arrive a few frames late
+        self.timings_label = self.anchor.add(arcade.gui.UILabel(text="", font_name="Roboto", font_size=12, width=400, height=300, multiline=True), anchor_x="left", anchor_y="bottom", align_x=5, align_y=5)
+        self.timings_label.visible = False
 
         self.back_button = arcade.gui.UITextureButton(texture=button_texture, texture_hovered=button_hovered_texture, text='<--', style=button_style, width=100, height=50)
         self.back_button.on_click = lambda event: self.main_exit()
         self.anchor.add(self.back_button, anchor_x="left", anchor_y="top", align_x=5, align_y=-5)
 
+    def format_zoom(self):
+        return mp.nstr(mpf(self.scale.denominator) / self.scale.numerator, 6)
+
+    def get_depth_text(self):
+        # levels finer than the depth setting are solid, the kernel only loops over the ones between the pixel and the image size
+        return f"Depth: {self.depth} ({max(self.carpet_view['digits'] - self.carpet_view['skip'], 0)} per pixel)"
+
+    def set_uniforms(self, shader_program):
+        set_carpet_uniforms(shader_program, self.carpet_view)
+
     def create_image(self):
-        with self.shader_program:
-            self.shader_program['u_depth'] = int(self.depth)
-            self.shader_program['u_zoom'] = int(self.zoom)
-            self.shader_program['u_center'] = self.click_center
-            self.shader_program.dispatch(self.sierpinsky_carpet_image.width, self.sierpinsky_carpet_image.height, 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+        self.carpet_view = get_carpet_view(self.origin, self.scale, self.sierpinsky_carpet_image.width, self.sierpinsky_carpet_image.height, self.depth)
+        self.set_uniforms(self.shader_program)
+
+        with trace("dispatch"), trace_gpu("dispatch"), self.shader_program:
+            self.shader_program.dispatch(*get_workgroup_count(self.sierpinsky_carpet_image.width, self.sierpinsky_carpet_image.height, self.workgroup_size), 1, barrier=pyglet.gl.GL_ALL_BARRIER_BITS)
+
+    def compare_workgroup_sizes(self):
+        frame_times = {}
+
+        for workgroup_size in workgroup_sizes:
+            shader_program, sierpinsky_carpet_image = create_sierpinsky_carpet_shader(self.window.width, self.window.height, self.settings_dict.get("sierpinsky_precision", "Single").lower(), workgroup_size, self.settings_dict.get("shader_binary_cache", True))
+            self.set_uniforms(shader_program)
+
+            frame_times[workgroup_size] = measure_dispatch_time(shader_program, get_workgroup_count(sierpinsky_carpet_image.width, sierpinsky_carpet_image.height, workgroup_size))
+
+            logging.info(f"sierpinsky_carpet {self.window.width}x{self.window.height} workgroup {workgroup_size}: {frame_times[workgroup_size] * 1000:.2f} ms")
+
+            release_program(shader_program)
+
+        # Every candidate bound its own image to the shared image unit, take it back.
+        self.sierpinsky_carpet_image.bind_image_texture(unit=self.shader_program['img_output'])
+
+        best_workgroup_size = min(frame_times, key=frame_times.get)
+        self.workgroup_label.text = f"Workgroup: {self.workgroup_size[0]}x{self.workgroup_size[1]} (best: {best_workgroup_size}, {frame_times[best_workgroup_size] * 1000:.2f} ms)"
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == arcade.key.T:
+            self.compare_workgroup_sizes()
+        elif symbol == arcade.key.F3:
+            self.timings_label.visible = not self.timings_label.visible
+
+    def on_update(self, delta_time):
+        poll_timer_queries()
+
+        if self.timings_label.visible:
+            self.timings_label.text = format_timings()
 
     def on_mouse_press(self, x: int, y: int, button: int, modifiers: int) -> bool | None:
         if button == arcade.MOUSE_BUTTON_LEFT:
-            zoom = self.settings_dict.get("sierpinsky_zoom_increase", 2)
+            zoom = Fraction(self.settings_dict.get("sierpinsky_zoom_increase", 2))
         elif button == arcade.MOUSE_BUTTON_RIGHT:
-            zoom = 1 / self.settings_dict.get("sierpinsky_zoom_increase", 2)
+            zoom = 1 / Fraction(self.settings_dict.get("sierpinsky_zoom_increase", 2))
         else:
             return
 
-        self.zoom *= zoom
+        # the carpet point under the cursor stays where it is
+        new_scale = self.scale / zoom
+        self.origin = tuple(origin + Fraction(int(position)) * (self.scale - new_scale) for origin, position in zip(self.origin, (x, y)))
+        self.scale = new_scale
 
-        self.click_center = (x, y)
-
-        self.zoom_label.text = f"Zoom: {self.zoom}"
+        self.zoom_label.text = f"Zoom: {self.format_zoom()}"
 
         self.create_image()
+        self.depth_label.text = self.get_depth_text()
 
-        self.pypresence_client.update(state='Viewing Sierpinsky Carpet', details=f'Zoom: {self.zoom}\nDepth: {self.depth}', start=self.pypresence_client.start_time)
+        self.pypresence_client.update(state='Viewing Sierpinsky Carpet', details=f'Zoom: {self.format_zoom()}\nDepth: {self.depth}', start=self.pypresence_client.start_time)
 
     def on_button_press(self, controller, name):
         if name == "a":
@@ -89,8 +146,11 @@ class SierpinskyCarpetViewer(arcade.gui.UIView):
         self.window.show_view(Main(self.pypresence_client))
 
     def on_draw(self):
-        self.window.clear()
-        self.sierpinsky_carpet_sprite.draw()
-        self.ui.draw()
+        with trace("draw"):
+            self.window.clear()
+            self.sierpinsky_carpet_sprite.draw()
+
+        with trace("ui_draw"):
+            self.ui.draw()
         if self.has_controller:
             self.sprite_list.draw()
@@ -0,0 +1,149 @@
+import multiprocessing, os, time, logging
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+from game.cpu_engine import calculate_iters
+
+worker_output = None
+
+def get_output_layout(width, height, channels=False):
+    return ((height, width, 3), np.float32) if channels else ((height, width), np.int32)
+
+def init_worker(shared_memory_name, width, height, channels=False):
+    global worker_output, worker_shared_memory
+
+    # Kept as a global so the mapping stays alive for the lifetime of the worker, the parent owns and unlinks the segment.
+    worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    shape, dtype = get_output_layout(width, height, channels)
+    worker_output = np.ndarray(shape, dtype=dtype, buffer=worker_shared_memory.buf)
+
+def render_tile(tile, width, height, params, mask=None):
+    start = time.perf_counter()
+
+    x0, y0, x1, y1 = tile
+    worker_output[y0:y1, x0:x1] = calculate_iters(width=width, height=height, region=tile, mask=mask, channels=worker_output.ndim == 3, **params)
+
+    return tile, time.perf_counter() - start, os.getpid()
+
+def split_tile(tile):
+    x0, y0, x1, y1 = tile
+    xm, ym = (x0 + x1) // 2, (y0 + y1) // 2
+    return [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)]
+
+def get_mp_context():
+    # Spawned workers would re-import run.py and open a second window (and the frozen build has no multiprocessing support),
+    # so without fork (Windows) there is no worker pool and the CPU engine renders in a single process.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+class TileRenderer:
+    def __init__(self, width, height, workers=0, tile_size=128, min_tile_size=16, preview_scale=8, mp_context=None, channels=False):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self.min_tile_size = min_tile_size
+        self.preview_scale = preview_scale
+        self.tile_timings = []
+
+        shape, dtype = get_output_layout(width, height, channels)
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.output = np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf)
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp_context or get_mp_context(),
+            initializer=init_worker,
+            initargs=(self.shared_memory.name, width, height, channels)
+        )
+
+    def estimate_costs(self, params):
+        # A coarse render tells which tiles are full of slow in-set pixels before any real work is handed out.
+        preview_width = max(self.width // self.preview_scale, 1)
+        preview_height = max(self.height // self.preview_scale, 1)
+        preview = calculate_iters(width=preview_width, height=preview_height, **params)
+
+        cost_map = np.maximum(preview, 1).astype(np.float64)
+        return np.pad(cost_map.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+
+    def tile_cost(self, summed_costs, tile):
+        x0, y0, x1, y1 = tile
+        scale_x = (summed_costs.shape[1] - 1) / self.width
+        scale_y = (summed_costs.shape[0] - 1) / self.height
+
+        px0, px1 = int(x0 * scale_x), max(int(x1 * scale_x), int(x0 * scale_x) + 1)
+        py0, py1 = int(y0 * scale_y), max(int(y1 * scale_y), int(y0 * scale_y) + 1)
+        px1, py1 = min(px1, summed_costs.shape[1] - 1), min(py1, summed_costs.shape[0] - 1)
+
+        preview_cost = summed_costs[py1, px1] - summed_costs[py0, px1] - summed_costs[py1, px0] + summed_costs[py0, px0]
+        preview_area = max((px1 - px0) * (py1 - py0), 1)
+
+        return preview_cost / preview_area * (x1 - x0) * (y1 - y0)
+
+    def create_tiles(self, params):
+        summed_costs = self.estimate_costs(params)
+
+        tiles = [
+            (x, y, min(x + self.tile_size, self.width), min(y + self.tile_size, self.height))
+            for y in range(0, self.height, self.tile_size)
+            for x in range(0, self.width, self.tile_size)
+        ]
+        split_threshold = summed_costs[-1, -1] * self.preview_scale * self.preview_scale / (self.workers * 8)
+
+        scheduled = []
+        while tiles:
+            tile = tiles.pop()
+            cost = self.tile_cost(summed_costs, tile)
+            x0, y0, x1, y1 = tile
+
+            if cost > split_threshold and min(x1 - x0, y1 - y0) >= self.min_tile_size * 2:
+                tiles.extend(split_tile(tile))
+            else:
+                scheduled.append((cost, tile))
+
+        # Cheap tiles first so most of the image lands early, the split-up expensive tiles keep the workers busy at the end.
+        scheduled.sort()
+        return scheduled
+
+    def render(self, fractal_type, real_range, imag_range, max_iter, precision="single", multi_n=2, escape_radius=2, julia_type="Classic swirling", mask=None, periodicity_check=True):
+        params = {
+            "fractal_type": fractal_type,
+            "real_range": tuple(map(float, real_range)),
+            "imag_range": tuple(map(float, imag_range)),
+            "max_iter": int(max_iter),
+            "precision": precision,
+            "multi_n": multi_n,
+            "escape_radius": escape_radius,
+            "julia_type": julia_type,
+            "periodicity_check": periodicity_check
+        }
+
+        start = time.perf_counter()
+        scheduled = self.create_tiles(params)
+
+        # Workers pull the next tile from the executor's shared queue as soon as they are free, so a slow tile never holds up the rest.
+        futures = {
+            self.executor.submit(render_tile, tile, self.width, self.height, params, None if mask is None else mask[tile[1]:tile[3], tile[0]:tile[2]]): cost
+            for cost, tile in scheduled
+        }
+
+        self.tile_timings = []
+        for future in as_completed(futures):
+            tile, elapsed, pid = future.result()
+            self.tile_timings.append({"tile": tile, "seconds": elapsed, "estimated_cost": futures[future], "pid": pid})
+
+        total = time.perf_counter() - start
+        busy = sum(timing["seconds"] for timing in self.tile_timings)
+        logging.debug(f"Tile render of {fractal_type}: {len(scheduled)} tiles on {self.workers} workers in {total * 1000:.1f} ms, {busy * 1000:.1f} ms of tile work ({busy / (total * self.workers) * 100:.0f}% utilisation)")
+
+        return self.output.copy()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        del self.output
+        self.shared_memory.close()
+        self.shared_memory.unlink()
@@ -0,0 +1,226 @@
+import sys, json, time, logging
+import numpy as np
+
+from mpmath import mp, mpf
+
+from game.batch_renderer import create_job, get_initial_viewport, write_output, write_pixels, to_rgb, is_image_output
+from game.shader import CPUIterCalcProgram, get_required_bits, get_precision_ladder, select_precision
+
+# Zoom sequences between keyframes of {"frame", "center": [real, imag], "zoom"}, zoom being the viewer's zoom: initial real span / real span.
+# Frames are written as they finish, the only state kept are the iteration buffers later frames will reproject from.
+
+def load_zoom_video(path, overrides=None):
+    # {"job": {...batch job keys...}, "keyframes": [...]}, the job's output should contain {index}, or be - for stdout
+    with open(path, "r") as file:
+        data = json.load(file)
+
+    job = {**data.get("job", {}), **(overrides or {})}
+    return job, data["keyframes"]
+
+def interpolate_keyframes(keyframes, frame):
+    for start, end in zip(keyframes, keyframes[1:]):
+        if frame <= end["frame"]:
+            break
+
+    t = mpf(frame - start["frame"]) / (end["frame"] - start["frame"])
+    start_zoom, end_zoom = mpf(start["zoom"]), mpf(end["zoom"])
+
+    # exponential, every frame zooms in by the same factor
+    zoom = start_zoom * (end_zoom / start_zoom) ** t
+
+    # the center moves with the span, which makes the motion a pure scaling around one fixed point of the screen
+    progress = (1 / start_zoom - 1 / zoom) / (1 / start_zoom - 1 / end_zoom) if start_zoom != end_zoom else t
+
+    center_real, center_imag = (mpf(a) + (mpf(b) - mpf(a)) * progress for a, b in zip(start["center"], end["center"]))
+    return center_real, center_imag, zoom
+
+def get_frame_view(initial_viewport, center_real, center_imag, zoom):
+    # (real_min, imag_min, real_span, imag_span), the same spans the viewer has at this zoom
+    real_span = (initial_viewport[1] - initial_viewport[0]) / zoom
+    imag_span = (initial_viewport[3] - initial_viewport[2]) / zoom
+    return center_real - real_span / 2, center_imag - imag_span / 2, real_span, imag_span
+
+def get_reprojection(view, previous_view, width, height):
+    # Where pixel (0, 0) and one pixel step of view fall in previous_view pixels, or None if no sample would land on a previous pixel.
+    real_min, imag_min, real_span, imag_span = view
+    previous_real_min, previous_imag_min, previous_real_span, previous_imag_span = previous_view
+
+    # the ratio needs no more than double precision, only the difference of the origins needs every digit
+    with mp.workprec(64):
+        step = (float(real_span / previous_real_span), float(imag_span / previous_imag_span))
+
+    # with a step of 1 / n every n-th sample lands on a pixel, but only from a pixel aligned origin
+    for value in (1 / step[0], 1 / step[1]):
+        if value < 0.999 or abs(value - round(value)) > 1e-6:
+            return None
+
+    origin = (float((real_min - previous_real_min) / previous_real_span * width), float((imag_min - previous_imag_min) / previous_imag_span * height))
+
+    for value in origin:
+        if abs(value - round(value)) > 1e-3:
+            return None
+
+    return origin, step
+
+def plan_reprojection(views, width, height, reuse_window):
+    # For every frame the earlier frame with the most samples to reuse: the smallest whole zoom factor, the newest on a tie.
+    sources = []
+
+    for index, view in enumerate(views):
+        best, best_factor = None, None
+
+        for previous_index in range(index - 1, max(index - reuse_window, 0) - 1, -1):
+            reprojection = get_reprojection(view, views[previous_index], width, height)
+            if not reprojection:
+                continue
+
+            factor = round(1 / reprojection[1][0])
+            if best_factor is None or factor < best_factor:
+                best, best_factor = (previous_index, reprojection), factor
+
+        sources.append(best)
+
+    return sources
+
+class ZoomVideoRenderer:
+    def __init__(self, renderer, job, keyframes, reuse_window=60):
+        self.renderer = renderer
+        self.output = job.get("output", "zoom/{index:05d}.png")
+        self.job = create_job(0, {**job, "output": ""})
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe["frame"])
+        self.reuse_window = reuse_window
+
+        if len(self.keyframes) < 2:
+            raise ValueError("A zoom video needs at least two keyframes")
+
+        if job.get("precision") == "auto":
+            # one program renders every frame, create_job picked the kernel for the first one but it has to resolve the deepest
+            real_min, imag_min, real_span, imag_span = min(self.get_views(), key=lambda view: view[2])
+            precision, preturbation = select_precision(get_precision_ladder(self.job["fractal"], self.job["multi_n"]), get_required_bits(real_min, real_min + real_span, imag_min, imag_min + imag_span, self.job["width"]))
+            self.job["precision"], self.job["preturbation"] = precision, self.job["preturbation"] or preturbation
+
+        if renderer.backend == "cpu":
+            self.shader_program = CPUIterCalcProgram(self.job["fractal"], self.job["width"], self.job["height"], self.job["precision"], self.job["multi_n"], self.job["escape_radius"], self.job["julia_type"], renderer.cpu_workers, periodicity_check=self.job["periodicity_check"], channels=self.job["channels"])
+            self.iteration_buffers = None
+        else:
+            self.shader_program, self.iteration_buffers = renderer.get_program(self.job)
+
+        # GPU frames are textures of the iteration buffers' format recycled through this pool, CPU frames are the NumPy arrays the CPU program leaves behind
+        self.free_images = [] if isinstance(self.shader_program, CPUIterCalcProgram) else list(self.iteration_buffers.images)
+        # colored on the GPU and read back while the next frames render, the iterations never leave the GPU
+        self.exports_on_gpu = renderer.exports_on_gpu({**self.job, "output": self.output})
+
+    def get_views(self):
+        initial_viewport = get_initial_viewport(self.job)
+        frames = range(self.keyframes[0]["frame"], self.keyframes[-1]["frame"] + 1)
+        return [get_frame_view(initial_viewport, *interpolate_keyframes(self.keyframes, frame)) for frame in frames]
+
+    def create_image(self):
+        if self.free_images:
+            return self.free_images.pop()
+
+        return self.iteration_buffers.create_image()
+
+    def release_frame(self, frame):
+        if not isinstance(self.shader_program, CPUIterCalcProgram):
+            self.free_images.append(frame)
+
+    def render_frame(self, view, source):
+        # source is None or the (origin, step) reprojection and the frame it reads from
+        real_min, imag_min, real_span, imag_span = view
+        shader_program = self.shader_program
+
+        preturbation_buffers = self.renderer.set_uniforms(shader_program, self.job, real_min, real_min + real_span, imag_min, imag_min + imag_span)
+
+        with shader_program:
+            shader_program["u_reuse"] = source is not None
+            if source:
+                shader_program["u_previous_origin"], shader_program["u_previous_step"] = source[0]
+
+        if isinstance(shader_program, CPUIterCalcProgram):
+            # dispatch moves self.iters to previous_iters before rendering into a new array
+            if source:
+                shader_program.iters = source[1]
+
+            self.renderer.dispatch(shader_program, self.job)
+            return shader_program.iters, shader_program.iters, shader_program.reuse_stats
+
+        image = self.create_image()
+        self.iteration_buffers.images = [image, source[1] if source else image]
+        self.iteration_buffers.bind()
+        self.iteration_buffers.reset_stats()
+
+        self.renderer.dispatch(shader_program, self.job)
+        del preturbation_buffers
+
+        return image, None if self.exports_on_gpu else self.iteration_buffers.read_iters(), self.iteration_buffers.read_stats(shader_program)
+
+    def get_frame_job(self, index):
+        return {**self.job, "index": index, "output": self.output if self.output == "-" else self.output.format(**{**self.job, "index": index})}
+
+    def write_pixels(self, index, pixels):
+        if self.output == "-":
+            sys.stdout.buffer.write(np.flipud(pixels).tobytes())
+            sys.stdout.buffer.flush()
+        else:
+            write_pixels(self.get_frame_job(index), pixels)
+
+    def write_exports(self, wait=False):
+        for index, pixels in self.renderer.collect_exports(wait):
+            self.write_pixels(index, pixels)
+
+    def write_frame(self, index, iters, view):
+        job = self.get_frame_job(index)
+
+        colors = None
+        if job["antialiasing"] and (self.output == "-" or is_image_output(job)):
+            real_min, imag_min, real_span, imag_span = view
+            colors = self.renderer.antialias(job, iters, (real_min, real_min + real_span, imag_min, imag_min + imag_span))
+
+        if self.output == "-":
+            # raw rgb24 frames top to bottom, e.g. for ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -i -
+            sys.stdout.buffer.write(to_rgb(job, np.flipud(iters), None if colors is None else np.flipud(colors)).tobytes())
+            sys.stdout.buffer.flush()
+        else:
+            write_output(job, iters, colors)
+
+    def run(self):
+        views = self.get_views()
+        sources = plan_reprojection(views, self.job["width"], self.job["height"], self.reuse_window)
+
+        # a frame is kept only until the last frame that reprojects from it is rendered
+        last_use = {}
+        for index, source in enumerate(sources):
+            if source:
+                last_use[source[0]] = index
+
+        frames = {}
+        reused_total = computed_total = 0
+        start = report_time = time.perf_counter()
+
+        for index, (view, source) in enumerate(zip(views, sources)):
+            frame, iters, (reused, computed) = self.render_frame(view, source and (source[1], frames[source[0]]))
+
+            if self.exports_on_gpu:
+                self.renderer.export(index, self.job, frame)
+                self.write_exports()
+            else:
+                self.write_frame(index, iters, view)
+
+            reused_total += reused
+            computed_total += computed
+
+            if index in last_use:
+                frames[index] = frame
+            else:
+                self.release_frame(frame)
+
+            for previous_index in [previous_index for previous_index in frames if last_use[previous_index] <= index]:
+                self.release_frame(frames.pop(previous_index))
+
+            if time.perf_counter() - report_time >= 1 or index == len(views) - 1:
+                report_time = time.perf_counter()
+                logging.info(f"Frame {index + 1}/{len(views)}: {(index + 1) / (report_time - start):.2f} frames/s, {reused_total / max(reused_total + computed_total, 1) * 100:.1f}% of the samples reprojected, {len(frames)} frames kept")
+
+        self.write_exports(wait=True)
+        return len(views) / (time.perf_counter() - start)
@@ -39,6 +39,12 @@ class FractalChooser(arcade.gui.UIView):
         self.sierpinsky_carpet_button = self.grid.add(arcade.gui.UITextureButton(texture=button_texture, texture_hovered=button_hovered_texture, text='Sierpinsky Carpet', style=button_style, width=200, height=200), row=row, column=col)
         self.sierpinsky_carpet_button.on_click = lambda event: self.sierpinsky_carpet()
 
+        row = (n + 2) // 3
+        col = (n + 2) % 3
+
+        self.ifs_button = self.grid.add(arcade.gui.UITextureButton(texture=button_texture, texture_hovered=button_hovered_texture, text='Geometric Fractals', style=button_style, width=200, height=200), row=row, column=col)
+        self.ifs_button.on_click = lambda event: self.ifs()
+
         self.anchor.detect_focusable_widgets()
 
     def main_exit(self):
@@ -51,4 +57,8 @@ class FractalChooser(arcade.gui.UIView):
 
     def sierpinsky_carpet(self):
         from game.sierpinsky_carpet import SierpinskyCarpetViewer
-        self.window.show_view(SierpinskyCarpetViewer(self.pypresence_client))
\ No newline at end of file
+        self.window.show_view(SierpinskyCarpetViewer(self.pypresence_client))
+
+    def ifs(self):
+        from game.ifs_viewer import IFSViewer
+        self.window.show_view(IFSViewer(self.pypresence_client))
\ No newline at end of file
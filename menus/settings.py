@@ -86,7 +86,7 @@ class Settings(arcade.gui.UIView):
             setting_dict = settings[category][setting]
 
             if setting_dict['type'] == "option":
-                dropdown = arcade.gui.UIDropdown(options=setting_dict['options'], width=200, height=50, default=self.settings_dict.get(setting_dict["config_key"], setting_dict["options"][0]), active_style=dropdown_style, dropdown_style=dropdown_style, primary_style=dropdown_style)
+                dropdown = arcade.gui.UIDropdown(options=setting_dict['options'], width=200, height=50, default=self.settings_dict.get(setting_dict["config_key"], setting_dict.get("default", setting_dict["options"][0])), active_style=dropdown_style, dropdown_style=dropdown_style, primary_style=dropdown_style)
                 dropdown.on_change = lambda _, setting=setting, dropdown=dropdown: self.update(setting, dropdown.value, "option")
                 self.value_layout.add(dropdown)
 
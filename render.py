@@ -0,0 +1,86 @@
+import os, sys, argparse, logging
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_dir)
+
+from utils.headless import use_headless_gl
+use_headless_gl()
+
+from mpmath import mp
+mp.dps = 1000
+
+from game.batch_renderer import BatchRenderer, load_jobs, create_job
+from game.zoom_video import ZoomVideoRenderer, load_zoom_video
+from game.shader import parse_workgroup_size
+from game.cpu_engine import palettes
+from utils.constants import initial_real_imag, c_for_julia_type, workgroup_sizes
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Render fractals without a window. Writes PNG, or raw float32 iteration counts for .npy and .raw outputs (rows from the top of the view).",
+        epilog="Job options given on the command line override the job file defaults, keys set on a single job override both."
+    )
+
+    parser.add_argument("fractal", nargs="?", choices=list(initial_real_imag), help="Fractal to render when no job file is given")
+    parser.add_argument("--jobs", help="JSON job file, a list of jobs or {\"defaults\": {...}, \"jobs\": [...]}, rendered with one context")
+    parser.add_argument("--zoom-video", help="JSON zoom sequence, {\"job\": {...}, \"keyframes\": [{\"frame\": 0, \"center\": [real, imag], \"zoom\": 1}, ...]}")
+    parser.add_argument("--reuse-window", type=int, default=60, help="How many frames back a zoom video frame may reproject samples from")
+    parser.add_argument("-o", "--output", help="Output path, may use job keys like {index:05d} or {fractal}, - streams zoom video frames to stdout as raw rgb24")
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--viewport", nargs=4, metavar=("REAL_MIN", "REAL_MAX", "IMAG_MIN", "IMAG_MAX"))
+    parser.add_argument("--center", nargs=2, metavar=("REAL", "IMAG"))
+    parser.add_argument("--span", help="Width of the view on the real axis, used with --center")
+    parser.add_argument("--max-iter", dest="max_iter", type=int)
+    parser.add_argument("--precision", choices=["auto", "single", "double", "float-float"], help="float-float emulates double precision with pairs of floats, for GPUs with slow double precision, auto picks the cheapest kernel that resolves the pixels of the view, perturbation included")
+    parser.add_argument("--n", dest="multi_n", type=int)
+    parser.add_argument("--escape-radius", dest="escape_radius", type=float)
+    parser.add_argument("--julia-type", dest="julia_type", choices=list(c_for_julia_type))
+    parser.add_argument("--deep-zoom", dest="preturbation", action="store_const", const=True, help="Render with perturbation around a reference orbit")
+    parser.add_argument("--no-series-approximation", dest="series_approximation", action="store_const", const=False)
+    parser.add_argument("--periodicity-check", dest="periodicity_check", action=argparse.BooleanOptionalAction, help="Stop iterating points whose orbit repeats, on by default for the Mandelbrot and Mandelbar sets")
+    parser.add_argument("--palette", choices=list(palettes))
+    parser.add_argument("--strategy", choices=["pixel", "subdivision"], help="subdivision only iterates the borders of tiles and fills the tiles whose border has a single value")
+    parser.add_argument("--channels", action="store_const", const=True, help="Also compute the smooth iteration count and the distance estimate in pixels, .npy and .raw outputs get the three channels per pixel and PNGs are colored smoothly")
+    parser.add_argument("--antialiasing", type=int, help="Jittered samples per pixel on the edges of PNG outputs, at most 16, 0 turns antialiasing off")
+    parser.add_argument("--antialiasing-budget", dest="antialiasing_budget", type=float, help="Largest fraction of the pixels that gets antialiased, the strongest edges go first")
+    parser.add_argument("--check", action="store_true", help="Render every job pixel by pixel as well, report the pixels its strategy got wrong and exit with 1 if there are any")
+
+    parser.add_argument("--backend", choices=["auto", "gpu", "cpu"], default="auto")
+    parser.add_argument("--workgroup-size", choices=workgroup_sizes, default="8x8")
+    parser.add_argument("--cpu-workers", type=int, default=0, help="Processes of the CPU backend, 0 uses every core")
+    parser.add_argument("--no-binary-cache", dest="binary_cache", action="store_false")
+    parser.add_argument("--orbit-cache-size", type=int, default=256, help="Reference orbit cache size in MB")
+    parser.add_argument("-v", "--verbose", action="store_true")
+
+    return parser.parse_args()
+
+def main():
+    arguments = parse_arguments()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.DEBUG if arguments.verbose else logging.INFO)
+
+    job_keys = ["fractal", "output", "width", "height", "viewport", "center", "span", "max_iter", "precision", "multi_n", "escape_radius", "julia_type", "preturbation", "series_approximation", "periodicity_check", "strategy", "channels", "antialiasing", "antialiasing_budget", "palette"]
+    overrides = {key: getattr(arguments, key) for key in job_keys if getattr(arguments, key) is not None}
+
+    if not (arguments.jobs or arguments.zoom_video or arguments.fractal):
+        sys.exit("Either a fractal, a --jobs file or a --zoom-video file is required.")
+
+    renderer = BatchRenderer(arguments.backend, parse_workgroup_size(arguments.workgroup_size), arguments.cpu_workers, arguments.binary_cache, arguments.orbit_cache_size * 1024 * 1024)
+
+    mismatched_jobs = 0
+    try:
+        if arguments.zoom_video:
+            ZoomVideoRenderer(renderer, *load_zoom_video(arguments.zoom_video, overrides), arguments.reuse_window).run()
+        elif arguments.jobs:
+            mismatched_jobs = renderer.run(load_jobs(arguments.jobs, overrides), arguments.check)
+        else:
+            mismatched_jobs = renderer.run([create_job(0, overrides)], arguments.check)
+    finally:
+        renderer.close()
+
+    if mismatched_jobs:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -10,11 +10,12 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 pyglet.resource.path.append(script_dir)
 pyglet.font.add_directory(os.path.join(script_dir, 'assets', 'fonts'))
 
-import mpmath
-mpmath.dps = 1000
+from mpmath import mp
+mp.dps = 1000
 
 from utils.utils import get_closest_resolution, print_debug_info, on_exception
 from utils.constants import log_dir, menu_background_color
+from game.profiler import ChromeTraceHandler
 from menus.main import Main
 from arcade.experimental.controller_window import ControllerWindow
 
@@ -88,6 +89,10 @@ else:
     with open("settings.json", "w") as file:
         file.write(json.dumps(settings))
 
+if settings.get("performance_trace", False):
+    # Chrome trace events of the timed sections, open in chrome://tracing or ui.perfetto.dev
+    logging.getLogger("trace").addHandler(ChromeTraceHandler(os.path.join(log_dir, f"trace_{timestamp}.json")))
+
 try:
     window = ControllerWindow(width=resolution[0], height=resolution[1], title='FractalViewer', samples=antialiasing, antialiasing=antialiasing > 0, fullscreen=fullscreen, vsync=vsync, resizable=False, style=style, visible=False)
 except (FileNotFoundError, PermissionError) as e:
@@ -0,0 +1,29 @@
+import json, pytest
+
+from game.ifs import load_ifs_fractals
+
+def write_ifs_file(tmp_path, content):
+    path = tmp_path / "ifs.json"
+    path.write_text(json.dumps(content))
+    return str(path)
+
+def test_user_fractals_are_added_to_the_presets(tmp_path):
+    triangle = [[0.5, 0, 0, 0.5, 0, 0], [0.5, 0, 0, 0.5, 0.5, 0], [0.5, 0, 0, 0.5, 0, 0.5, 0.2]]
+    fractals = load_ifs_fractals(write_ifs_file(tmp_path, {"Triangle": triangle, "Slice": {"menger_slice": [1, 0]}}))
+
+    assert fractals["Triangle"] == triangle
+    assert len(fractals["Slice"]) == 32
+    assert "Sierpinski Triangle" in fractals
+
+@pytest.mark.parametrize("content", [
+    [[0.5, 0, 0, 0.5, 0, 0]],
+    {"Triangle": [[0.5, 0, 0, 0.5, "0", 0]]},
+    {"Triangle": [0.5, 0, 0, 0.5, 0, 0]},
+    {"Triangle": "[[0.5, 0, 0, 0.5, 0, 0]]"},
+    {"Triangle": 1},
+    {"Triangle": [[0.5, 0, 0, 0.5, 0]]},
+    {"Slice": {"menger_slice": [3]}},
+])
+def test_malformed_user_files_raise_value_error(tmp_path, content):
+    with pytest.raises(ValueError):
+        load_ifs_fractals(write_ifs_file(tmp_path, content))
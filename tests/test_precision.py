@@ -0,0 +1,27 @@
+from mpmath import mpf
+
+from game.shader import get_required_bits, get_precision_ladder, select_precision
+
+def get_view_bits(exponent, width=1000):
+    # bits to resolve a view of width pixels spanning 2^-exponent around a Mandelbrot boundary point
+    span = mpf(2) ** -exponent
+    return get_required_bits(mpf("-0.75") - span / 2, mpf("-0.75") + span / 2, mpf("0.1") - span / 2, mpf("0.1") + span / 2, width)
+
+def test_double_kernel_stops_at_its_view_bits():
+    ladder = get_precision_ladder("mandelbrot")
+    assert select_precision(ladder, get_view_bits(33)) == ("double", False)
+
+    # the double kernel gets its view as a float hi and lo, 48 bits, with the margin it is left before 44
+    for exponent in range(35, 40):
+        required_bits = get_view_bits(exponent)
+        assert 44 < required_bits < 49
+        assert select_precision(ladder, required_bits) == ("double", True)
+
+def test_float_float_and_double_kernels_resolve_the_same_depth():
+    ladder = get_precision_ladder("mandelbrot", float_float=True)
+    assert select_precision(ladder, 44) == ("float-float", False)
+    assert select_precision(ladder, 46) == ("double", True)
+
+def test_without_perturbation_the_deepest_kernel_is_kept():
+    ladder = get_precision_ladder("phoenix_fractal")
+    assert select_precision(ladder, 46) == ("double", False)
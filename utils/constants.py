@@ -5,6 +5,9 @@ from arcade.gui.widgets.slider import UISliderStyle
 
 menu_background_color = (30, 30, 47)
 log_dir = 'logs'
+orbit_cache_dir = 'orbit_cache'
+shader_cache_dir = 'shader_cache'
+screenshot_dir = 'screenshots'
 discord_presence_id = 1365949409254441000
 
 initial_real_imag = {
@@ -25,6 +28,78 @@ c_for_julia_type = {
     "Snowflake": (-0.8, 0.156)
 }
 
+workgroup_sizes = ["1x1", "4x4", "8x8", "16x16", "32x32"]
+
+progressive_render_scales = [8, 4, 2, 1]
+zoom_snap_tolerance = 0.02 # with pixel reuse a zoom rect within this fraction of a whole zoom factor is snapped to it, others are kept as drawn
+subdivision_tile_size = 64 # largest tile of the subdivision render strategy, a power of two
+subdivision_min_tile_size = 8
+
+# Iteration refinement, a new view is iterated up to this limit first and the pixels still iterating go on while the view is idle,
+# each refinement dispatch doubles the limit until max_iter or the time budget of the view is reached
+refinement_start_iter = 64
+
+# Automatic max iterations, see game/iteration_limit.py
+auto_max_iter_growth = 0.25 # the limit grows by this many times the slider value for every doubling of the zoom
+auto_max_iter_bins = 16
+auto_max_iter_raise_fraction = 0.002 # more pixels than this escaping in the upper half of the range doubles the limit of the next view
+auto_max_iter_lower_fraction = 0.00005 # fewer halves it
+auto_max_iter_scale_range = (0.125, 64)
+auto_max_iter_range = (50, 100000)
+
+# Adaptive antialiasing, see game/antialiasing.py
+antialiasing_max_samples = 16
+antialiasing_budget = 0.1 # at most this fraction of the pixels is supersampled, the strongest edges first
+antialiasing_threshold = 0.01 # iteration difference to a neighbour, relative to max_iter, that makes a pixel an edge
+
+# Exports read back through pixel buffers, see game/readback.py: while one buffer is being copied the next frame renders into another
+readback_buffer_count = 2
+
+# Every key a batch render job can have, a job file or the command line only needs the ones that differ.
+batch_job_defaults = {
+    "fractal": "mandelbrot",
+    "output": "{fractal}_{index:05d}.png",
+    "width": 1920,
+    "height": 1080,
+    "viewport": None,
+    "center": None,
+    "span": None,
+    "max_iter": 200,
+    "precision": "single",
+    "multi_n": 2,
+    "escape_radius": 2,
+    "julia_type": "Classic swirling",
+    "preturbation": False,
+    "series_approximation": True,
+    "periodicity_check": None,
+    "strategy": "pixel",
+    "channels": False, # float32 [iterations, smooth iterations, distance in pixels] per pixel instead of the iterations, PNGs get smooth coloring
+    "antialiasing": 0, # samples per edge pixel of PNG outputs, 0 is off
+    "antialiasing_budget": antialiasing_budget,
+    "palette": None
+}
+
+# Fractals whose interior is mostly attracting cycles, elsewhere the periodicity check costs more than it saves and is off unless asked for
+periodicity_check_fractals = ["mandelbrot", "mandelbar"]
+
+# Automatic precision switches to a more exact kernel while a pixel is still this many bits above the last bit of the current one
+precision_margin_bits = 4
+
+# Geometric fractals drawn with the chaos game, see game/ifs.py. A map [a, b, c, d, e, f] sends (x, y) to (a x + b y + e, c x + d y + f),
+# a seventh value sets its probability, otherwise it is picked in proportion to the area it keeps. Menger slices are horizontal cuts
+# through the sponge at a height given by its repeating base 3 digits.
+user_ifs_file = 'ifs.json'
+ifs_upload_interval = 0.25 # seconds between two uploads of the shaded density, shading a window sized float image costs more than a step
+
+ifs_fractals = {
+    "Sierpinsky Carpet": [[1 / 3, 0, 0, 1 / 3, x / 3, y / 3] for y in range(3) for x in range(3) if (x, y) != (1, 1)],
+    "Sierpinski Triangle": [[0.5, 0, 0, 0.5, 0, 0], [0.5, 0, 0, 0.5, 0.5, 0], [0.5, 0, 0, 0.5, 0.25, 0.4330127018922193]],
+    "Koch Curve": [[1 / 3, 0, 0, 1 / 3, 0, 0], [1 / 6, -0.28867513459481287, 0.28867513459481287, 1 / 6, 1 / 3, 0], [1 / 6, 0.28867513459481287, -0.28867513459481287, 1 / 6, 0.5, 0.28867513459481287], [1 / 3, 0, 0, 1 / 3, 2 / 3, 0]],
+    "Menger Slice 1/8": {"menger_slice": [0, 1]},
+    "Menger Slice 3/8": {"menger_slice": [1, 0]},
+    "Menger Slice 1/2": {"menger_slice": [1]}
+}
+
 iter_fractals = ["mandelbrot", "mandelbar", "phoenix_fractal", "lambda_fractal", "julia", "burning_ship", "buffalo_fractal", "newton_fractal"]
 
 button_style = {'normal': UITextureButtonStyle(font_name="Roboto", font_color=arcade.color.BLACK), 'hover': UITextureButtonStyle(font_name="Roboto", font_color=arcade.color.BLACK),
@@ -42,70 +117,112 @@ slider_style = {'normal': slider_default_style, 'hover': slider_hover_style, 'pr
 
 settings = {
     "Mandelbrot": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "mandelbrot_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double", "Float-Float"], "config_key": "mandelbrot_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "mandelbrot_workgroup_size", "default": "8x8"},
+        "Deep Zoom": {"type": "bool", "config_key": "mandelbrot_preturbation", "default": False},
+        "Series Approximation": {"type": "bool", "config_key": "mandelbrot_series_approximation", "default": True},
+        "Periodicity Checking": {"type": "bool", "config_key": "mandelbrot_periodicity_checking", "default": True},
         "N": {"type": "slider", "min": 1, "max": 10, "config_key": "mandelbrot_n", "default": 2, "step": 1},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "mandelbrot_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "mandelbrot_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "mandelbrot_max_iter", "default": 200, "step": 100}
     },
     "Mandelbar": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "mandelbar_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double", "Float-Float"], "config_key": "mandelbar_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "mandelbar_workgroup_size", "default": "8x8"},
+        "Deep Zoom": {"type": "bool", "config_key": "mandelbar_preturbation", "default": False},
+        "Series Approximation": {"type": "bool", "config_key": "mandelbar_series_approximation", "default": True},
+        "Periodicity Checking": {"type": "bool", "config_key": "mandelbar_periodicity_checking", "default": True},
         "N": {"type": "slider", "min": 1, "max": 10, "config_key": "mandelbar_n", "default": 2, "step": 1},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "mandelbar_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "mandelbar_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "mandelbar_max_iter", "default": 200, "step": 100}
     },
     "Burning Ship": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "burning_ship_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double", "Float-Float"], "config_key": "burning_ship_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "burning_ship_workgroup_size", "default": "8x8"},
+        "Deep Zoom": {"type": "bool", "config_key": "burning_ship_preturbation", "default": False},
+        "Series Approximation": {"type": "bool", "config_key": "burning_ship_series_approximation", "default": True},
+        "Periodicity Checking": {"type": "bool", "config_key": "burning_ship_periodicity_checking", "default": False},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "burning_ship_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "burning_ship_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "burning_ship_max_iter", "default": 200, "step": 100}
     },
     "Buffalo Fractal": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "buffalo_fractal_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double", "Float-Float"], "config_key": "buffalo_fractal_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "buffalo_fractal_workgroup_size", "default": "8x8"},
+        "Deep Zoom": {"type": "bool", "config_key": "buffalo_fractal_preturbation", "default": False},
+        "Series Approximation": {"type": "bool", "config_key": "buffalo_fractal_series_approximation", "default": True},
+        "Periodicity Checking": {"type": "bool", "config_key": "buffalo_fractal_periodicity_checking", "default": False},
         "N": {"type": "slider", "min": 1, "max": 10, "config_key": "buffalo_fractal_n", "default": 2, "step": 1},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "buffalo_fractal_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "buffalo_fractal_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "buffalo_fractal_max_iter", "default": 200, "step": 100}
     },
     "Phoenix Fractal": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "phoenix_fractal_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double"], "config_key": "phoenix_fractal_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "phoenix_fractal_workgroup_size", "default": "8x8"},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "phoenix_fractal_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "phoenix_fractal_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "phoenix_fractal_max_iter", "default": 200, "step": 100}
     },
     "Lambda Fractal": {
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "phoenix_fractal_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double"], "config_key": "phoenix_fractal_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "lambda_fractal_workgroup_size", "default": "8x8"},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "phoenix_fractal_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "phoenix_fractal_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "phoenix_fractal_max_iter", "default": 200, "step": 100}
     },
     "Sierpinsky Carpet": {
         "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "sierpinsky_precision", "default": "Single"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "sierpinsky_workgroup_size", "default": "8x8"},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "sierpinsky_zoom_increase", "default": 2},
         "Depth": {"type": "slider", "min": 100, "max": 10000, "config_key": "sierpinsky_depth", "default": 100, "step": 100}
     },
+    "Geometric Fractals": {
+        "Points Per Frame": {"type": "slider", "min": 10000, "max": 2000000, "config_key": "ifs_points_per_frame", "default": 200000, "step": 10000},
+        "Max Points (Millions)": {"type": "slider", "min": 1, "max": 1000, "config_key": "ifs_max_points", "default": 100, "step": 1},
+        "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "ifs_zoom_increase", "default": 2}
+    },
     "Julia": {
         "Type": {"type": "option", "options": ["Classic swirling", "Douady rabbit", "Nebula-style", "Snowflake"], "config_key": "julia_type", "default": "Classic swirling"},
-        "Float Precision": {"type": "option", "options": ["Single", "Double"], "config_key": "julia_precision", "default": "Single"},
+        "Float Precision": {"type": "option", "options": ["Auto", "Single", "Double", "Float-Float"], "config_key": "julia_precision", "default": "Auto"},
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "julia_workgroup_size", "default": "8x8"},
+        "Deep Zoom": {"type": "bool", "config_key": "julia_preturbation", "default": False},
+        "Series Approximation": {"type": "bool", "config_key": "julia_series_approximation", "default": True},
+        "Periodicity Checking": {"type": "bool", "config_key": "julia_periodicity_checking", "default": False},
         "N": {"type": "slider", "min": 1, "max": 10, "config_key": "julia_n", "default": 2, "step": 1},
         "Escape Radius": {"type": "slider", "min": 1, "max": 10, "config_key": "julia_escape_radius", "default": 2, "step": 0.1},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "julia_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 4000, "config_key": "julia_max_iter", "default": 200, "step": 100}
     },
     "Newton Fractal": {
+        "Workgroup Size": {"type": "option", "options": workgroup_sizes, "config_key": "newton_fractal_workgroup_size", "default": "8x8"},
         "Zoom Increase Per Click": {"type": "slider", "min": 2, "max": 100, "config_key": "newton_fractal_zoom_increase", "default": 2},
         "Max Iterations": {"type": "slider", "min": 100, "max": 10000, "config_key": "newton_fractal_max_iter", "default": 200, "step": 100}
     },
     "Graphics": {
         "Window Mode": {"type": "option", "options": ["Windowed", "Fullscreen", "Borderless"], "config_key": "window_mode", "default": "Windowed"},
         "Resolution": {"type": "option", "options": ["1366x768", "1440x900", "1600x900", "1920x1080", "2560x1440", "3840x2160"], "config_key": "resolution"},
+        "Render Backend": {"type": "option", "options": ["Auto", "GPU", "CPU"], "config_key": "render_backend", "default": "Auto"},
+        "CPU Workers": {"type": "slider", "min": 0, "max": 64, "config_key": "cpu_workers", "default": 0, "step": 1},
         "Anti-Aliasing": {"type": "option", "options": ["None", "2x MSAA", "4x MSAA", "8x MSAA", "16x MSAA"], "config_key": "anti_aliasing", "default": "4x MSAA"},
         "VSync": {"type": "bool", "config_key": "vsync", "default": True},
         "FPS Limit": {"type": "slider", "min": 0, "max": 480, "config_key": "fps_limit", "default": 60, "step": 10},
+        "Shader Binary Cache": {"type": "bool", "config_key": "shader_binary_cache", "default": True},
+        "Progressive Rendering": {"type": "bool", "config_key": "progressive_rendering", "default": True},
+        "Pixel Reuse": {"type": "bool", "config_key": "pixel_reuse", "default": True},
+        "Render Strategy": {"type": "option", "options": ["Per Pixel", "Subdivision"], "config_key": "render_strategy", "default": "Per Pixel"},
+        "Smooth Coloring": {"type": "bool", "config_key": "smooth_coloring", "default": False},
+        "Adaptive Anti-Aliasing": {"type": "option", "options": ["Off", "4x", "9x", "16x"], "config_key": "adaptive_antialiasing", "default": "Off"},
+        "Automatic Max Iterations": {"type": "bool", "config_key": "auto_max_iter", "default": True},
+        "Iteration Refinement": {"type": "bool", "config_key": "iteration_refinement", "default": True},
+        "Refinement Time Budget (s)": {"type": "slider", "min": 1, "max": 120, "config_key": "refinement_time_budget", "default": 10, "step": 1},
     },
     "Miscellaneous": {
         "Discord RPC": {"type": "bool", "config_key": "discord_rpc", "default": True},
+        "Orbit Cache Size (MB)": {"type": "slider", "min": 0, "max": 4096, "config_key": "orbit_cache_size", "default": 256, "step": 64},
+        "Performance Trace": {"type": "bool", "config_key": "performance_trace", "default": False},
     },
     "Credits": {}
 }
@@ -0,0 +1,11 @@
+import sys, pyglet
+
+def use_headless_gl():
+    # Has to run before arcade or pyglet.window are imported: no display, the GL context is an EGL pbuffer.
+    pyglet.options['headless'] = True
+    pyglet.options['shadow_window'] = False
+    pyglet.options.debug_gl = False
+
+    if sys.platform.startswith("linux"):
+        # pyglet.input (imported by arcade.gui through utils.constants) decorates with pyglet.window.xlib even in headless mode
+        from pyglet.window import xlib